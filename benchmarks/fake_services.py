@@ -0,0 +1,496 @@
+"""
+Local stand-ins for the OpenAI and Replicate HTTP APIs, used by the offline
+benchmarks. They implement just the endpoints the pipeline calls, with
+configurable latency, error rates and payload sizes (see
+OFFLINE_BENCHMARK_CONFIG). Point the SDKs at them with OPENAI_BASE_URL and
+REPLICATE_BASE_URL.
+"""
+import io
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+# Generated texts are drawn from this vocabulary, seeded by the request content
+WORDS = (
+    "photorealistic render soft daylight warm palette concrete glass timber facade shadows "
+    "aerial perspective wide angle muted tones overcast sky reflections minimal vegetation "
+    "matte materials high contrast golden hour eye level composition volumetric fog"
+).split()
+
+# Like the OpenAI prompt cache: prefixes of 1024 tokens and more are cached, in steps of 128 tokens
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_STEP_TOKENS = 128
+
+def _timestamp(seconds: float) -> str:
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat().replace("+00:00", "Z")
+
+class FakeService:
+    """
+    A threaded HTTP server that delays every API request and fails a share of them.
+    Subclasses implement handle(handler, method, path, body).
+    """
+    def __init__(self, config: dict, host: str = "127.0.0.1", port: int = 0):
+        """
+        Initializes the service without starting it.
+
+        Args:
+            config: The "openai" or "replicate" entry of OFFLINE_BENCHMARK_CONFIG.
+            host: The interface to listen on.
+            port: The port to listen on (0 picks a free port).
+        """
+        self.config = config
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def delay(self, seconds: float):
+        """Sleeps for a jittered simulated latency."""
+        jitter = self.config.get("jitter", 0.0)
+        with self._lock:
+            factor = self._random.uniform(1 - jitter, 1 + jitter)
+        time.sleep(max(0.0, seconds * factor))
+
+    def should_fail(self, rate_key: str = "error_rate") -> bool:
+        """Counts a request and tells whether it should fail."""
+        with self._lock:
+            self.requests += 1
+            failed = self._random.random() < self.config.get(rate_key, 0.0)
+            if failed:
+                self.errors += 1
+        return failed
+
+    def handle(self, handler: BaseHTTPRequestHandler, method: str, path: str, body: bytes):
+        raise NotImplementedError
+
+    def _handler_class(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def send_json(self, status: int, body: dict, headers: Optional[dict] = None):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _dispatch(self, method: str):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length) if length else b""
+                try:
+                    service.handle(self, method, self.path.split("?", 1)[0], body)
+                except Exception as e:
+                    logging.error(f"Fake service error for {method} {self.path}: {e}", exc_info=True)
+                    self.send_json(500, {"error": str(e)})
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_HEAD(self):
+                self._dispatch("HEAD")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "FakeService":
+        """Starts serving in a background thread."""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the server."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class FakeOpenAI(FakeService):
+    """
+    An OpenAI-compatible chat completions endpoint. Every answer is a
+    deterministic text derived from the request, so different inputs get
+    different answers and repeated requests get the same one.
+
+    The first token arrives after latency_seconds and the rest follow at
+    tokens_per_second, streamed as server-sent events if the request asks for it.
+
+    Batch jobs complete all their requests batch_seconds after submission.
+    Usage reports cached_tokens for the longest message prefix (whole
+    messages, in order) that an earlier request already sent.
+
+    Endpoints:
+        POST /v1/chat/completions
+        POST /v1/files
+        GET  /v1/files/<id>/content
+        POST /v1/batches
+        GET  /v1/batches/<id>
+    """
+    def __init__(self, config: dict, **kwargs):
+        super().__init__(config, **kwargs)
+        self.files = {}
+        self.batches = {}
+        self._prefixes = set()
+
+    def completion_text(self, body: bytes, request: dict) -> str:
+        seeded = random.Random(hashlib.sha256(body).digest())
+        def words() -> str:
+            return " ".join(seeded.choice(WORDS) for _ in range(self.config["completion_words"]))
+
+        # A request with several images gets one "### Image N" section per image, like a batched description
+        images = sum(1 for message in request.get("messages", []) if isinstance(message.get("content"), list)
+                     for part in message["content"] if part.get("type") == "image_url")
+        if images > 1:
+            return "\n\n".join(f"### Image {number}\n{words()}" for number in range(1, images + 1))
+        return words()
+
+    def _chunk(self, completion_id: str, model: str, delta: dict, finish_reason: Optional[str] = None, usage: dict = None) -> bytes:
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+        if usage:
+            chunk["usage"] = usage
+        return f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+
+    def _stream(self, handler, completion_id: str, request: dict, words: list, usage: dict):
+        """Sends the completion as server-sent events, one word per chunk."""
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+        handler.close_connection = True
+        model = request.get("model", "fake")
+        handler.wfile.write(self._chunk(completion_id, model, {"role": "assistant", "content": ""}))
+        for index, word in enumerate(words):
+            if index:
+                time.sleep(1 / self.config["tokens_per_second"])
+            handler.wfile.write(self._chunk(completion_id, model, {"content": word}))
+            handler.wfile.flush()
+        handler.wfile.write(self._chunk(completion_id, model, {}, finish_reason="stop"))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            handler.wfile.write(self._chunk(completion_id, model, {}, usage=usage))
+        handler.wfile.write(b"data: [DONE]\n\n")
+
+    def cached_tokens(self, messages: list) -> int:
+        """Returns the prompt tokens an earlier request with the same leading messages would have cached."""
+        cached = 0
+        prefix = hashlib.sha256()
+        prefix_bytes = 0
+        with self._lock:
+            for message in messages:
+                serialized = json.dumps(message, sort_keys=True).encode("utf-8")
+                prefix.update(serialized)
+                prefix_bytes += len(serialized)
+                digest = prefix.hexdigest()
+                if digest in self._prefixes:
+                    cached = prefix_bytes // 4
+                self._prefixes.add(digest)
+        if cached < PROMPT_CACHE_MIN_TOKENS:
+            return 0
+        return cached - cached % PROMPT_CACHE_STEP_TOKENS
+
+    def _completion(self, body: bytes, request: dict) -> tuple:
+        """Returns the tokens and the response body of a chat completion request."""
+        text = self.completion_text(body, request)
+        # One token per word, keeping the whitespace (and line breaks) in front of it
+        words = re.findall(r"\s*\S+", text)
+        prompt_tokens = len(body) // 4
+        cached_tokens = min(self.cached_tokens(request.get("messages", [])), prompt_tokens)
+        response = {
+            "id": f"chatcmpl-{hashlib.sha256(body).hexdigest()[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(words),
+                "total_tokens": prompt_tokens + len(words),
+                "prompt_tokens_details": {"cached_tokens": cached_tokens}
+            }
+        }
+        return words, response
+
+    def _upload(self, handler, body: bytes) -> dict:
+        """Stores the "file" field of a multipart upload."""
+        from email.parser import BytesParser
+        message = BytesParser().parsebytes(f"Content-Type: {handler.headers['Content-Type']}\r\n\r\n".encode("utf-8") + body)
+        content = next(part.get_payload(decode=True) for part in message.get_payload()
+                       if part.get_param("name", header="content-disposition") == "file")
+        return self._store_file(content, "batch")
+
+    def _store_file(self, content: bytes, purpose: str) -> dict:
+        file_id = f"file-{hashlib.sha256(content).hexdigest()[:24]}"
+        with self._lock:
+            self.files[file_id] = content
+        return {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                "filename": f"{file_id}.jsonl", "purpose": purpose, "status": "processed"}
+
+    def _run_batch(self, batch_id: str):
+        """Completes every request of a batch job and writes its output and error files."""
+        batch = self.batches[batch_id]
+        batch["status"] = "in_progress"
+        time.sleep(self.config["batch_seconds"])
+        outputs, errors = [], []
+        for line in self.files[batch["input_file_id"]].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            result = {"id": f"batch_req_{len(outputs) + len(errors)}", "custom_id": entry["custom_id"], "error": None}
+            if self.should_fail():
+                result["response"] = {"status_code": self.config["error_status"],
+                                      "body": {"error": {"message": "simulated error", "type": "fake_error"}}}
+                errors.append(result)
+            else:
+                body = json.dumps(entry["body"], sort_keys=True).encode("utf-8")
+                result["response"] = {"status_code": 200, "body": self._completion(body, entry["body"])[1]}
+                outputs.append(result)
+        for name, results in (("output_file_id", outputs), ("error_file_id", errors)):
+            if results:
+                content = "\n".join(json.dumps(result) for result in results).encode("utf-8") + b"\n"
+                batch[name] = self._store_file(content, "batch_output")["id"]
+        batch["request_counts"] = {"total": len(outputs) + len(errors), "completed": len(outputs), "failed": len(errors)}
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+    def handle(self, handler, method, path, body):
+        path = path.rstrip("/")
+        if method == "POST" and path == "/v1/files":
+            return handler.send_json(200, self._upload(handler, body))
+        match = re.fullmatch(r"/v1/files/([^/]+)/content", path)
+        if method == "GET" and match and match.group(1) in self.files:
+            content = self.files[match.group(1)]
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/octet-stream")
+            handler.send_header("Content-Length", str(len(content)))
+            handler.end_headers()
+            return handler.wfile.write(content)
+        if method == "POST" and path == "/v1/batches":
+            request = json.loads(body)
+            batch_id = f"batch_{hashlib.sha256(body + str(time.time()).encode()).hexdigest()[:24]}"
+            self.batches[batch_id] = {
+                "id": batch_id, "object": "batch", "endpoint": request["endpoint"], "errors": None,
+                "input_file_id": request["input_file_id"], "completion_window": request["completion_window"],
+                "status": "validating", "output_file_id": None, "error_file_id": None, "created_at": int(time.time()),
+                "request_counts": {"total": 0, "completed": 0, "failed": 0}
+            }
+            threading.Thread(target=self._run_batch, args=(batch_id,), daemon=True).start()
+            return handler.send_json(200, self.batches[batch_id])
+        match = re.fullmatch(r"/v1/batches/([^/]+)", path)
+        if method == "GET" and match and match.group(1) in self.batches:
+            return handler.send_json(200, self.batches[match.group(1)])
+        if method != "POST" or path != "/v1/chat/completions":
+            return handler.send_json(404, {"error": {"message": f"no route for {method} {path}"}})
+
+        self.delay(self.config["latency_seconds"])
+        if self.should_fail():
+            status = self.config["error_status"]
+            headers = {"Retry-After": "1"} if status == 429 else None
+            return handler.send_json(status, {"error": {"message": "simulated error", "type": "fake_error"}}, headers)
+
+        request = json.loads(body)
+        words, response = self._completion(body, request)
+        if request.get("stream"):
+            return self._stream(handler, response["id"], request, words, response["usage"])
+
+        # Without streaming the whole text is generated before the answer is sent
+        time.sleep(len(words) / self.config["tokens_per_second"])
+        handler.send_json(200, response)
+
+class FakeReplicate(FakeService):
+    """
+    A Replicate-compatible API: file uploads, predictions that "render" for a
+    configured time, and the files they produce (with HTTP Range support).
+
+    Endpoints:
+        POST /v1/files
+        POST /v1/models/<owner>/<name>/predictions
+        GET  /v1/predictions/<id>
+        POST /v1/predictions/<id>/cancel
+        GET|HEAD /outputs/<id>.<ext>
+    """
+    def __init__(self, config: dict, video_models: tuple = (), **kwargs):
+        """
+        Initializes the service without starting it.
+
+        Args:
+            config: The "replicate" entry of OFFLINE_BENCHMARK_CONFIG.
+            video_models: Models whose predictions produce a video instead of an image.
+            **kwargs: Passed to FakeService.
+        """
+        super().__init__(config, **kwargs)
+        self.video_models = set(video_models)
+        self.predictions = {}
+        self.uploaded_bytes = 0
+        self.image_payload = self._make_image(config["image_bytes"])
+        # Video content is never decoded, so a repeated random block is enough
+        block = os.urandom(1024 * 1024)
+        self.video_payload = (block * (config["video_bytes"] // len(block) + 1))[:config["video_bytes"]]
+
+    def _make_image(self, size: int) -> bytes:
+        """Returns a noise PNG of roughly the given size (noise does not compress)."""
+        from PIL import Image
+        pixels = max(1, size // 3)
+        width = max(1, int((pixels * 1.5) ** 0.5))
+        height = max(1, pixels // width)
+        image = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+        output = io.BytesIO()
+        image.save(output, format="PNG", compress_level=0)
+        return output.getvalue()
+
+    def _prediction(self, prediction_id: str) -> dict:
+        """Returns the public state of a prediction, advancing it by the elapsed time."""
+        state = self.predictions[prediction_id]
+        now = time.time()
+        prediction = dict(state["public"])
+        if prediction["status"] in ("starting", "processing"):
+            if now >= state["finishes_at"]:
+                prediction["status"] = "failed" if state["fails"] else "succeeded"
+                prediction["completed_at"] = _timestamp(state["finishes_at"])
+                prediction["metrics"] = {"predict_time": state["finishes_at"] - state["created_at"]}
+                if state["fails"]:
+                    prediction["error"] = "simulated prediction failure"
+                else:
+                    prediction["output"] = f"{self.url}/outputs/{prediction_id}.{state['extension']}"
+                state["public"] = prediction
+            elif now > state["created_at"]:
+                prediction["status"] = "processing"
+                prediction["started_at"] = prediction["created_at"]
+        return prediction
+
+    def _serve_output(self, handler, method: str, name: str):
+        prediction_id, extension = os.path.splitext(name)
+        if prediction_id not in self.predictions:
+            return handler.send_json(404, {"detail": "not found"})
+        # The prediction ID is appended after the PNG end marker, so every image is a distinct file
+        payload = self.video_payload if extension == ".mp4" else self.image_payload + prediction_id.encode("ascii")
+        start, end, status = 0, len(payload) - 1, 200
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", handler.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), end) if match.group(2) else end
+            if start >= len(payload):
+                handler.send_response(416)
+                handler.send_header("Content-Range", f"bytes */{len(payload)}")
+                handler.send_header("Content-Length", "0")
+                handler.end_headers()
+                return
+            status = 206
+
+        handler.send_response(status)
+        handler.send_header("Content-Type", "video/mp4" if extension == ".mp4" else "image/png")
+        handler.send_header("Content-Length", str(end - start + 1))
+        handler.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            handler.send_header("Content-Range", f"bytes {start}-{end}/{len(payload)}")
+        handler.end_headers()
+        if method == "GET":
+            view = memoryview(payload)[start:end + 1]
+            for offset in range(0, len(view), 1024 * 1024):
+                handler.wfile.write(view[offset:offset + 1024 * 1024])
+
+    def _create_prediction(self, model: str, body: bytes) -> dict:
+        request = json.loads(body or b"{}")
+        prediction_id = hashlib.sha256(f"{model}{time.time_ns()}{random.random()}".encode()).hexdigest()[:20]
+        video = model in self.video_models
+        now = time.time()
+        state = {
+            "created_at": now,
+            "finishes_at": now + self.config["video_seconds" if video else "image_seconds"],
+            "fails": self.should_fail("failure_rate"),
+            "extension": "mp4" if video else "png",
+            "public": {
+                "id": prediction_id,
+                "model": model,
+                "version": "fake",
+                "status": "starting",
+                "input": request.get("input"),
+                "output": None,
+                "logs": "",
+                "error": None,
+                "metrics": None,
+                "created_at": _timestamp(now),
+                "started_at": None,
+                "completed_at": None,
+                "urls": {
+                    "get": f"{self.url}/v1/predictions/{prediction_id}",
+                    "cancel": f"{self.url}/v1/predictions/{prediction_id}/cancel"
+                }
+            }
+        }
+        with self._lock:
+            self.predictions[prediction_id] = state
+        return state["public"]
+
+    def handle(self, handler, method, path, body):
+        if path.startswith("/outputs/"):
+            return self._serve_output(handler, method, path[len("/outputs/"):])
+
+        self.delay(self.config["latency_seconds"])
+        if self.should_fail():
+            return handler.send_json(self.config["error_status"], {"detail": "simulated error", "status": self.config["error_status"]})
+
+        if method == "POST" and path == "/v1/files":
+            with self._lock:
+                self.uploaded_bytes += len(body)
+            file_id = hashlib.sha256(body).hexdigest()[:20]
+            return handler.send_json(201, {
+                "id": file_id,
+                "name": "upload",
+                "content_type": "application/octet-stream",
+                "size": len(body),
+                "etag": file_id,
+                "checksums": {"sha256": hashlib.sha256(body).hexdigest()},
+                "metadata": {},
+                "created_at": _timestamp(time.time()),
+                "expires_at": None,
+                "urls": {"get": f"{self.url}/v1/files/{file_id}"}
+            })
+
+        match = re.fullmatch(r"/v1/models/([^/]+/[^/]+)/predictions", path)
+        if method == "POST" and match:
+            return handler.send_json(201, self._create_prediction(match.group(1), body))
+
+        match = re.fullmatch(r"/v1/predictions/([0-9a-f]+)(/cancel)?", path)
+        if match and match.group(1) in self.predictions:
+            if method == "POST" and match.group(2):
+                with self._lock:
+                    state = self.predictions[match.group(1)]
+                    if state["public"]["status"] in ("starting", "processing"):
+                        state["public"] = {**state["public"], "status": "canceled", "completed_at": _timestamp(time.time())}
+            with self._lock:
+                prediction = self._prediction(match.group(1))
+            return handler.send_json(200, prediction)
+
+        handler.send_json(404, {"detail": f"no route for {method} {path}"})
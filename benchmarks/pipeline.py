@@ -0,0 +1,216 @@
+"""
+Runs the full non-interactive pipeline against local stand-ins for OpenAI and
+Replicate (see fake_services.py) and reports throughput, per-stage latency
+percentiles, peak RSS and file I/O.
+
+Everything runs in a temporary working directory, so the project's input,
+output, cache and state folders are never touched. The first round starts
+with empty caches; later rounds show the warm-cache path.
+
+Usage:
+    python benchmarks/pipeline.py [--images N] [--workers N] [--video] [--engine threads|async]
+                                  [--rounds N] [--openai-latency S] [--render-seconds S]
+                                  [--error-rate R] [--openai-batch] [--json PATH] [--keep]
+"""
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import multiprocessing
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+import config
+from config import OFFLINE_BENCHMARK_CONFIG, OPENAI_BATCH_CONFIG, VIDEO_ANIMATOR_CONFIG
+from fake_services import FakeOpenAI, FakeReplicate
+
+# The config paths redirected into the benchmark working directory
+PATH_SETTINGS = {"INPUT_DIR": "input", "IMAGE_DIR": "image", "VIDEO_DIR": "video",
+                 "LOG_DIR": "logs", "CACHE_DIR": "cache", "STATE_DIR": "state"}
+
+def percentile(values: list, q: float) -> float:
+    """Returns the q-th percentile (0-100) of the values by linear interpolation."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def _read_proc(pid, name: str) -> dict:
+    """Parses a "key: value" file from /proc (Linux only); returns {} elsewhere."""
+    try:
+        with open(f"/proc/{pid}/{name}", "r", encoding="ascii") as f:
+            fields = (line.split(":", 1) for line in f if ":" in line)
+            return {key.strip(): value.split()[0] for key, value in fields if value.strip()}
+    except OSError:
+        return {}
+
+def _process_ids() -> list:
+    """This process and its live children (the CPU pool workers)."""
+    return ["self"] + [child.pid for child in multiprocessing.active_children()]
+
+def peak_rss_mb() -> dict:
+    """Returns the peak resident set size of this process and of its workers, in MB."""
+    import resource
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    own_mb = own / 1024 / (1024 if sys.platform == "darwin" else 1)
+    workers_mb = sum(int(_read_proc(pid, "status").get("VmHWM", 0)) for pid in _process_ids()[1:]) / 1024
+    return {"main": round(own_mb, 1), "workers": round(workers_mb, 1)}
+
+def io_counters() -> dict:
+    """
+    Returns the I/O counters of this process and its workers: bytes read and
+    written through system calls (files and sockets) and bytes that reached storage.
+    """
+    totals = {"rchar": 0, "wchar": 0, "read_bytes": 0, "write_bytes": 0}
+    for pid in _process_ids():
+        counters = _read_proc(pid, "io")
+        for key in totals:
+            totals[key] += int(counters.get(key, 0))
+    return totals
+
+def make_inputs(input_dir: str, count: int, size: tuple):
+    """Writes `count` distinct noise JPEGs (noise is the worst case for encoders and caches)."""
+    from PIL import Image
+    os.makedirs(input_dir, exist_ok=True)
+    for index in range(count):
+        image = Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3))
+        image.save(os.path.join(input_dir, f"bench_{index:03d}.jpg"), format="JPEG", quality=90)
+
+def summarize(records: dict, seconds: float, io_before: dict, io_after: dict, services: list) -> dict:
+    """Builds the report of one round from the finished pipeline records."""
+    stages = {}
+    totals = []
+    pipeline_bytes = {"bytes_uploaded": 0, "bytes_downloaded": 0}
+    for record in records.values():
+        if not record:
+            continue
+        for stage, values in (record.get("metrics") or {}).items():
+            if "wall_seconds" in values:
+                stages.setdefault(stage, []).append(values["wall_seconds"])
+            for key in pipeline_bytes:
+                pipeline_bytes[key] += values.get(key, 0)
+        if record.get("completed_at"):
+            started = datetime.fromisoformat(record["timestamp"])
+            totals.append((datetime.fromisoformat(record["completed_at"]) - started).total_seconds())
+    if totals:
+        stages["total"] = totals
+
+    completed = sum(1 for record in records.values() if record and record.get("status") == "completed")
+    return {
+        "images": len(records),
+        "completed": completed,
+        "seconds": round(seconds, 3),
+        "images_per_minute": round(completed / seconds * 60, 2) if seconds else 0.0,
+        "stages": {
+            stage: {f"p{q}": round(percentile(values, q), 3) for q in (50, 95, 99)} | {"count": len(values)}
+            for stage, values in stages.items()
+        },
+        "peak_rss_mb": peak_rss_mb(),
+        "io_bytes": {key: io_after[key] - io_before[key] for key in io_after},
+        "pipeline_bytes": pipeline_bytes,
+        "api_requests": {type(service).__name__: {"requests": service.requests, "errors": service.errors}
+                         for service in services}
+    }
+
+def print_report(index: int, report: dict):
+    print(f"\n=== Round {index}: {report['completed']}/{report['images']} completed in {report['seconds']:.1f}s "
+          f"({report['images_per_minute']:.1f} images/min) ===")
+    print(f"{'stage':<12}{'count':>7}{'p50 s':>10}{'p95 s':>10}{'p99 s':>10}")
+    for stage, values in report["stages"].items():
+        print(f"{stage:<12}{values['count']:>7}{values['p50']:>10.3f}{values['p95']:>10.3f}{values['p99']:>10.3f}")
+    rss = report["peak_rss_mb"]
+    print(f"Peak RSS: {rss['main']:.1f} MB (main process), {rss['workers']:.1f} MB (CPU pool workers)")
+    io = report["io_bytes"]
+    mb = 1024 * 1024
+    print(f"I/O: {io['rchar'] / mb:.1f} MB read / {io['wchar'] / mb:.1f} MB written by system calls, "
+          f"{io['read_bytes'] / mb:.1f} MB / {io['write_bytes'] / mb:.1f} MB on storage")
+    print(f"Pipeline: {report['pipeline_bytes']['bytes_uploaded'] / mb:.1f} MB uploaded, "
+          f"{report['pipeline_bytes']['bytes_downloaded'] / mb:.1f} MB downloaded")
+    for name, counts in report["api_requests"].items():
+        print(f"{name}: {counts['requests']} requests, {counts['errors']} simulated errors")
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmark of the full pipeline against local API stand-ins.")
+    parser.add_argument("--images", type=int, default=OFFLINE_BENCHMARK_CONFIG["images"], help="Input images per round.")
+    parser.add_argument("--workers", type=int, default=OFFLINE_BENCHMARK_CONFIG["workers"], help="Images processed concurrently.")
+    parser.add_argument("--video", action="store_true", help="Also animate every generated image.")
+    parser.add_argument("--engine", choices=["threads", "async"], default="threads", help="The batch engine to benchmark.")
+    parser.add_argument("--rounds", type=int, default=2, help="Rounds over the same inputs; rounds after the first run with warm caches.")
+    parser.add_argument("--openai-latency", type=float, default=None, help="Seconds per chat completion.")
+    parser.add_argument("--render-seconds", type=float, default=None, help="Seconds per image prediction.")
+    parser.add_argument("--error-rate", type=float, default=None, help="Share of API requests of both services that fail.")
+    parser.add_argument("--openai-batch", action="store_true", help="Create descriptions and prompts through the Batch API.")
+    parser.add_argument("--json", default=None, help="Also write the reports to this JSON file.")
+    parser.add_argument("--workdir", default=None, help="The working directory (a new temporary one by default).")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary working directory.")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own log output.")
+    args = parser.parse_args()
+
+    settings = copy.deepcopy(OFFLINE_BENCHMARK_CONFIG)
+    if args.openai_latency is not None:
+        settings["openai"]["latency_seconds"] = args.openai_latency
+    if args.render_seconds is not None:
+        settings["replicate"]["image_seconds"] = args.render_seconds
+    if args.error_rate is not None:
+        settings["openai"]["error_rate"] = settings["replicate"]["error_rate"] = args.error_rate
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="image-to-video-bench-")
+    # The modules copy these paths when they are imported, so they are redirected first
+    for name, folder in PATH_SETTINGS.items():
+        setattr(config, name, os.path.join(workdir, folder))
+    # The stand-in finishes batch jobs within seconds, not hours
+    OPENAI_BATCH_CONFIG["poll_interval"] = 0.5
+
+    openai_service = FakeOpenAI(settings["openai"]).start()
+    replicate_service = FakeReplicate(settings["replicate"], video_models=(VIDEO_ANIMATOR_CONFIG["model"],)).start()
+    services = [openai_service, replicate_service]
+    os.environ.update({
+        "OPENAI_BASE_URL": f"{openai_service.url}/v1",
+        "OPENAI_API_KEY": "benchmark",
+        "REPLICATE_BASE_URL": replicate_service.url,
+        "REPLICATE_API_KEY": "benchmark"
+    })
+
+    import main as pipeline
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    reports = []
+    try:
+        make_inputs(config.INPUT_DIR, args.images, tuple(settings["input_size"]))
+        print(f"Benchmarking {args.images} images x {args.rounds} rounds ({args.engine} engine, {args.workers} workers, "
+              f"video={'on' if args.video else 'off'}, openai-batch={'on' if args.openai_batch else 'off'}) in {workdir}")
+        for index in range(1, args.rounds + 1):
+            for service in services:
+                service.requests = service.errors = 0
+            io_before = io_counters()
+            started = time.perf_counter()
+            records = pipeline.process_batch(config.INPUT_DIR, create_video=args.video, max_workers=args.workers,
+                                             engine=args.engine, resume=False, openai_batch=args.openai_batch)
+            report = summarize(records, time.perf_counter() - started, io_before, io_counters(), services)
+            print_report(index, report)
+            reports.append(report)
+    finally:
+        for service in services:
+            service.stop()
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "rounds": reports}, f, indent=2)
+    return 0 if all(report["completed"] == report["images"] for report in reports) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+Measures how long `import main` takes and fails if it exceeds the budget in
+STARTUP_BENCHMARK_CONFIG or imports one of the lazily loaded API SDKs.
+
+Every run uses a fresh interpreter, so nothing is served from sys.modules.
+
+Usage:
+    python benchmarks/startup.py [--runs N] [--budget SECONDS] [--top N]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from config import STARTUP_BENCHMARK_CONFIG
+
+# Runs in the child interpreter; prints the import time and the SDKs it loaded
+PROBE = """
+import sys, json, time
+started = time.perf_counter()
+import main
+seconds = time.perf_counter() - started
+print(json.dumps({"seconds": seconds, "loaded": [name for name in %r if name in sys.modules]}))
+"""
+
+def measure_import(lazy_modules: list, importtime: bool = False) -> tuple:
+    """
+    Imports main in a fresh interpreter.
+
+    Args:
+        lazy_modules: Module names to report if they were imported.
+        importtime: If True, also collect the `-X importtime` report.
+
+    Returns:
+        A tuple (result dict, importtime report lines).
+    """
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", PROBE % (lazy_modules,)]
+    completed = subprocess.run(command, cwd=BASE_DIR, capture_output=True, text=True, check=True)
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    report = [line for line in completed.stderr.splitlines() if line.startswith("import time:")]
+    return result, report
+
+def slowest_imports(report: list, count: int) -> list:
+    """Returns the top-level imports of main with the highest cumulative time, in microseconds."""
+    entries = []
+    for line in report:
+        _, cumulative_us, name = line.split("|")
+        if name.strip() == "main":
+            break
+        if not name.startswith("  "):
+            # A module finishes after its imports, so everything listed before belongs to other top-level imports
+            entries = []
+        elif not name.startswith("    "):
+            entries.append((int(cumulative_us), name.strip()))
+    return sorted(entries, reverse=True)[:count]
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Startup time benchmark for the pipeline entry point.")
+    parser.add_argument("--runs", type=int, default=STARTUP_BENCHMARK_CONFIG["runs"], help="The number of fresh interpreters to time.")
+    parser.add_argument("--budget", type=float, default=STARTUP_BENCHMARK_CONFIG["import_budget_seconds"],
+                        help="The maximum median import time in seconds.")
+    parser.add_argument("--top", type=int, default=10, help="The number of slowest imports to list.")
+    args = parser.parse_args()
+
+    lazy_modules = STARTUP_BENCHMARK_CONFIG["lazy_modules"]
+    # The first run only warms the bytecode cache
+    measure_import(lazy_modules)
+    timings = []
+    loaded = set()
+    for _ in range(args.runs):
+        result, _ = measure_import(lazy_modules)
+        timings.append(result["seconds"])
+        loaded.update(result["loaded"])
+    _, report = measure_import(lazy_modules, importtime=True)
+
+    median = statistics.median(timings)
+    print(f"import main: median {median * 1000:.1f} ms, min {min(timings) * 1000:.1f} ms, "
+          f"max {max(timings) * 1000:.1f} ms over {args.runs} runs (budget {args.budget * 1000:.0f} ms)")
+    print("Slowest imports:")
+    for cumulative_us, name in slowest_imports(report, args.top):
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    failures = []
+    if median > args.budget:
+        failures.append(f"median import time {median * 1000:.1f} ms exceeds the budget of {args.budget * 1000:.0f} ms")
+    if loaded:
+        failures.append(f"modules that must load lazily were imported at startup: {', '.join(sorted(loaded))}")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if not failures:
+        print("OK")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,8 @@
 import os
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
 
 # --- API Keys ---
-# It's recommended to load keys from the environment for security
+# It's recommended to load keys from the environment for security.
+# The .env file is loaded by the entry point (main.py) before this module is imported.
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 # --- Configurations for AI Models ---
@@ -16,6 +13,13 @@ IMAGE_DESCRIBER_CONFIG = {
     "model_name": "gpt-4o-mini",
     "temperature": 0.1,
     "top_p": 0.9,
+    "max_image_edge": 2048, # larger images are downscaled before upload; the vision model does not use more
+    "jpeg_quality": 85, # quality used when an image has to be re-encoded and IMAGE_GENERATOR_CONFIG["preprocess"] does not fit max_image_edge
+    "rate_limit": {"requests_per_minute": 500, "burst": 20}, # None for no limit (e.g. a local server)
+    "stream": True, # consume and log the description as it is generated; reports time to first token
+    "batch_size": 4, # batch jobs: images described per request, sharing one copy of the system prompt; 1 disables batching
+    "batch_wait_seconds": 0.5, # how long an image waits for others to share its request before it is sent anyway
+    "batch_workers": 4, # batched requests running concurrently
     "system_prompt": """You are an architectural visualization analyzer. Your task is to describe ONLY the visual style, rendering technique, and aesthetic properties of architectural images. DO NOT describe the building's function, type, or specific architectural elements.
 
 Analyze the image systematically across these categories:
@@ -81,7 +85,9 @@ Note visualization-specific elements:
 - Model complexity (low-poly, high-detail)
 - Presence of entourage (people, vegetation, vehicles)
 
-Provide a concise yet comprehensive style description that captures all essential visual characteristics needed to recreate or modify this architectural visualization style. Use specific architectural visualization terminology."""
+Provide a concise yet comprehensive style description that captures all essential visual characteristics needed to recreate or modify this architectural visualization style. Use specific architectural visualization terminology.""",
+    # Appended to the system prompt when several images are described in one request; the markers split the answer
+    "batch_prompt": """The {count} images below are unrelated to each other. Describe each of them separately, following the instructions above. Start every description with a line containing only "### Image N", where N is the number of the image (1 to {count}), and describe the images in order. Do not compare the images and do not write anything before the first marker."""
 }
 
 # Configuration for the prompt creator model
@@ -90,6 +96,8 @@ PROMPT_CREATOR_CONFIG = {
     "model_name": "gpt-4o-mini",
     "temperature": 0.5,
     "top_p": 0.9,
+    "rate_limit": {"requests_per_minute": 500, "burst": 20},
+    "stream": True, # show the prompt while it is generated in interactive mode
     "system_prompt": """You are an architectural prompt engineer specializing in creating precise prompts for AI image generation. Your task is to transform detailed visual style descriptions into concise, effective generation prompts.
 
 INPUT: You will receive a comprehensive visual style analysis of an architectural image from the Image Describer.
@@ -135,6 +143,7 @@ PROMPT_ENHANCER_CONFIG = {
     "temperature": 0.5,
     "top_p": 0.9,
     "max_tokens": 150,
+    "rate_limit": {"requests_per_minute": 500, "burst": 20},
     "system_prompt": """You are an Architectural Prompt Enhancer, specialized in refining image generation prompts for architectural visualizations. Your expertise lies in seamlessly integrating user modifications while preserving essential visual characteristics.
 
 INPUTS:
@@ -207,7 +216,25 @@ IMAGE_GENERATOR_CONFIG = {
     "seed": 55,
     "output_format": "png",
     "safety_tolerance": 0,
-    "aspect_ratio": "match_input_image"
+    "aspect_ratio": "match_input_image",
+    "variants": 4, # default number of candidates in variant mode; variant i uses seed + i
+    "speculative": True, # interactive mode: start rendering a prompt while the user reviews it; canceled if they modify it
+    # The input image is downscaled and re-encoded once (metadata stripped) before upload
+    "preprocess": {"max_edge": 2048, "format": "JPEG", "quality": 95},
+    "rate_limit": {"requests_per_minute": 600, "burst": 10} # prediction submissions
+}
+
+# Preview tier for the interactive tweak loop: every iteration is rendered with a faster model on a
+# smaller input, and only the accepted prompt is rendered with IMAGE_GENERATOR_CONFIG.
+# Settings not given here (seed, aspect_ratio) are taken from IMAGE_GENERATOR_CONFIG.
+IMAGE_PREVIEW_CONFIG = {
+    "enabled": True,
+    "model": "black-forest-labs/flux-kontext-dev",
+    "output_format": "jpg",
+    "safety_tolerance": None, # not an input of the dev model
+    "input": {"num_inference_steps": 16, "go_fast": True, "output_quality": 80}, # model-specific parameters
+    "preprocess": {"max_edge": 1024, "format": "JPEG", "quality": 85},
+    "rate_limit": {"requests_per_minute": 600, "burst": 10} # prediction submissions
 }
 
 # Configuration for the video animator model (using Replicate)
@@ -215,7 +242,175 @@ VIDEO_ANIMATOR_CONFIG = {
     "model": "kwaivgi/kling-v1.6-standard",
     "duration": 5, # in seconds
     "cfg_scale": 0.5,
-    "negative_prompt": "blurry, low quality, bad quality, watermark, text, signature"
+    "negative_prompt": "blurry, low quality, bad quality, watermark, text, signature",
+    "speculative": False, # interactive mode: start animating while the user decides whether to tweak the image (billed even if discarded)
+    "preprocess": {"max_edge": 2048, "format": "JPEG", "quality": 95}, # applied to the start image before upload
+    "rate_limit": {"requests_per_minute": 600, "burst": 10} # prediction submissions
+}
+
+# Tracking of Replicate predictions: adaptive polling, optional webhooks and restart recovery
+PREDICTION_MANAGER_CONFIG = {
+    "state_file": "predictions.json", # stored in STATE_DIR
+    "poll_initial_interval": 1.0, # seconds
+    "poll_max_interval": 15.0, # seconds
+    "poll_backoff": 1.5, # the interval grows by this factor after every poll
+    "webhook_url": None, # public URL routed to the local webhook receiver; polling only if None
+    "webhook_host": "127.0.0.1", # interface the receiver listens on: local for a tunnel or reverse proxy, "0.0.0.0" to accept webhooks directly
+    "webhook_port": 8765,
+    "webhook_secret": os.getenv("REPLICATE_WEBHOOK_SECRET"), # signing secret ("whsec_..."); webhooks are not used without it
+    "webhook_tolerance_seconds": 300, # webhooks with an older (or future) timestamp are rejected as replays
+    "rate_limit": {"requests_per_minute": 3000, "burst": 50} # polling, cancels and file uploads
+}
+
+# Retries and circuit breaking for all OpenAI and Replicate calls; rate limits are set per model above
+SCHEDULER_CONFIG = {
+    "max_retries": 5, # retries of a rate-limited (429), overloaded (5xx) or dropped call
+    "backoff_base": 1.0, # seconds; the retry delay is drawn from [0, base * 2^attempt] unless Retry-After says otherwise
+    "backoff_max": 60.0, # seconds
+    "circuit_failure_threshold": 10, # consecutive failures that open the circuit of a provider/model
+    "circuit_reset_seconds": 60.0 # calls fail fast while the circuit is open
+}
+
+# Configuration for headless batch processing of the input directory
+BATCH_CONFIG = {
+    "max_workers": 4, # number of images processed concurrently
+    "image_extensions": [".jpg", ".jpeg", ".png", ".webp"]
+}
+
+# OpenAI Batch API mode for bulk runs (--openai-batch): the describe and prompt requests of all images are
+# submitted as batch jobs, which are billed at a discount and do not count against the per-minute rate limits
+OPENAI_BATCH_CONFIG = {
+    "completion_window": "24h", # the only window the Batch API offers
+    "poll_interval": 30.0, # seconds between status checks
+    "max_requests": 50000, # per batch file (API limit)
+    "max_file_bytes": 190 * 1024 * 1024, # per batch file (API limit: 200 MB)
+    "price_factor": 0.5, # share of the synchronous token prices (see METRICS_CONFIG) that batch requests cost
+    "state_file": "openai_batches.json", # stored in STATE_DIR; submitted batches are reattached after a restart
+    "batch_dir": "openai_batches", # stored in STATE_DIR; request files are deleted once their batch has finished
+    "keep_results": False # also keep copies of the downloaded output and error files in batch_dir (for debugging)
+}
+
+# Worker processes for CPU-bound work (hashing, image conversion, base64 encoding), so it does not hold the GIL
+CPU_POOL_CONFIG = {
+    "enabled": True,
+    "max_workers": None, # defaults to the number of CPU cores
+    "min_file_bytes": 2 * 1024 * 1024, # smaller files are processed inline; a process round trip costs more
+    "start_method": "spawn" # forking a process with running I/O threads is unsafe
+}
+
+# HTTP job API (python main.py --serve); jobs are kept in a SQLite queue in STATE_DIR
+SERVER_CONFIG = {
+    "host": "127.0.0.1",
+    "port": 8080,
+    "workers": 4, # number of jobs processed concurrently
+    "queue_file": "jobs.sqlite3",
+    "max_upload_bytes": 50 * 1024 * 1024,
+    "poll_interval": 1.0 # seconds an idle worker waits before checking the queue again
+}
+
+# Per-stage concurrency limits for the asyncio pipeline engine (batch mode with --engine async)
+ASYNC_PIPELINE_CONFIG = {
+    "concurrency": {
+        "describe": 16, # OpenAI vision calls
+        "prompt": 16, # OpenAI prompt creation calls
+        "generate": 8, # Replicate image predictions
+        "animate": 4, # Replicate video predictions
+        "download": 8 # video downloads
+    }
+}
+
+# Connection pooling for the shared OpenAI, Replicate and download clients
+HTTP_CLIENT_CONFIG = {
+    "max_connections": 64, # per client
+    "max_keepalive_connections": 32,
+    "keepalive_expiry": 60, # seconds an idle connection is kept open
+    "pool_connections": 8, # number of hosts the download session keeps pools for
+    "timeout": 120 # seconds
+}
+
+# Downloads of generated images and videos: resumable, verified and optionally split into parallel ranged segments
+DOWNLOAD_CONFIG = {
+    "chunk_size": 1024 * 1024, # bytes read per iteration
+    "max_retries": 5, # attempts per download (or per segment); each retry resumes where the last one stopped
+    "retry_backoff": 1.0, # seconds, doubled after every failed attempt
+    "parallel_segments": 4, # set to 1 to always download in a single stream
+    "parallel_min_size": 32 * 1024 * 1024, # bytes; smaller files are downloaded in a single stream
+    "stale_part_seconds": 3600 # partial files of other URLs for the same path are deleted once unchanged this long
+}
+
+# Per-stage metrics export; token prices are USD per 1M tokens and only used for cost estimates
+METRICS_CONFIG = {
+    "export_file": "metrics.prom", # Prometheus text format, written to LOG_DIR after every run
+    "token_prices": {
+        "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60}
+    }
+}
+
+# Startup benchmark (benchmarks/startup.py): `import main` must stay within the budget
+# and must not import the API SDKs, which are loaded when their stage first runs
+STARTUP_BENCHMARK_CONFIG = {
+    "import_budget_seconds": 0.5, # median over the runs, without interpreter startup
+    "runs": 5,
+    "lazy_modules": ["openai", "replicate", "requests", "httpx", "PIL"]
+}
+
+# Offline pipeline benchmark (benchmarks/pipeline.py) against local stand-ins for OpenAI and Replicate
+OFFLINE_BENCHMARK_CONFIG = {
+    "images": 8, # generated input images per round
+    "input_size": (3000, 2000), # pixels; inputs are random noise, so every image is distinct
+    "workers": 4,
+    "openai": {
+        "latency_seconds": 0.8, # time to the first token, +/- jitter
+        "tokens_per_second": 80, # generation speed after the first token
+        "jitter": 0.2, # relative spread of every simulated latency
+        "error_rate": 0.0, # share of requests answered with error_status
+        "error_status": 429,
+        "completion_words": 250, # length of every generated text
+        "batch_seconds": 2.0 # time a Batch API job takes to complete
+    },
+    "replicate": {
+        "latency_seconds": 0.05, # per API request (create, poll, upload)
+        "jitter": 0.2,
+        "error_rate": 0.0,
+        "error_status": 503,
+        "failure_rate": 0.0, # share of predictions that end as failed
+        "image_seconds": 4.0, # render time of an image prediction
+        "video_seconds": 12.0, # render time of a video prediction
+        "image_bytes": 2 * 1024 * 1024, # size of every generated image
+        "video_bytes": 16 * 1024 * 1024 # size of every generated video
+    }
+}
+
+# --- Caching ---
+
+# Persistent cache of ImageDescriber style descriptions, keyed by image content and model settings
+DESCRIPTION_CACHE_CONFIG = {
+    "enabled": True,
+    "max_entries": 5000,
+    "max_bytes": 50 * 1024 * 1024 # evicts least recently used entries above this size
+}
+
+# Store of generated images, keyed by the model, all input parameters and the input image content.
+# Only used with a fixed seed, which makes the output reproducible.
+GENERATION_STORE_CONFIG = {
+    "enabled": True,
+    "max_bytes": 2 * 1024 * 1024 * 1024, # disk quota; least recently used images are evicted above it
+    "max_entries": None,
+    "grace_seconds": 300 # images stored or looked up this recently are never evicted (they may still be in use)
+}
+
+# Normalized (downscaled, re-encoded, metadata-free) copies of input images, keyed by content and target settings
+NORMALIZED_IMAGE_CACHE_CONFIG = {
+    "max_bytes": 1024 * 1024 * 1024, # disk quota; least recently used files are evicted above it
+    "grace_seconds": 300 # files returned this recently are never evicted, so a caller can still read them
+}
+
+# Persistent memo of PromptCreator and PromptEnhancer results, keyed by the normalized inputs and model settings
+PROMPT_CACHE_CONFIG = {
+    "enabled": True,
+    "max_entries": 10000,
+    "max_bytes": 20 * 1024 * 1024,
+    "ttl_seconds": 30 * 24 * 3600 # entries older than this are generated again
 }
 
 # --- File System Paths ---
@@ -223,21 +418,11 @@ VIDEO_ANIMATOR_CONFIG = {
 # Base directory of the project
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-# Input and output directories
+# Input and output directories. They are created on demand by the code that
+# writes to them, so importing the config has no side effects.
 INPUT_DIR = os.path.join(BASE_DIR, "input")
 IMAGE_DIR = os.path.join(BASE_DIR, "image")
 VIDEO_DIR = os.path.join(BASE_DIR, "video")
 LOG_DIR = os.path.join(BASE_DIR, "logs")
-
-# --- Directory Creation ---
-
-# Ensure that the necessary directories exist
-def create_directories():
-    """Creates the project directories if they do not already exist."""
-    os.makedirs(INPUT_DIR, exist_ok=True)
-    os.makedirs(IMAGE_DIR, exist_ok=True)
-    os.makedirs(VIDEO_DIR, exist_ok=True)
-    os.makedirs(LOG_DIR, exist_ok=True)
-
-# Automatically create directories when the config is loaded
-create_directories() 
\ No newline at end of file
+CACHE_DIR = os.path.join(BASE_DIR, "cache")
+STATE_DIR = os.path.join(BASE_DIR, "state")
@@ -1,66 +1,185 @@
 import os
+import time
+import argparse
 import logging
+from functools import partial
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from config import INPUT_DIR
+
+# Load environment variables from .env file before the config reads them
+load_dotenv()
+
+from config import LOG_DIR, INPUT_DIR, BATCH_CONFIG, DESCRIPTION_CACHE_CONFIG, PROMPT_CACHE_CONFIG, GENERATION_STORE_CONFIG, IMAGE_GENERATOR_CONFIG, IMAGE_PREVIEW_CONFIG, VIDEO_ANIMATOR_CONFIG
 from modules.image_describer import ImageDescriber
 from modules.prompt_creator import PromptCreator
 from modules.image_generator import ImageGenerator
 from modules.video_animator import VideoAnimator
 from modules.json_logger import JSONLogger
+from modules.disk_cache import get_cache, get_file_cache
+from modules.async_pipeline import run_async_pipeline
+from modules.metrics import METRICS, RunMetrics, start_run
+from modules.checkpoint import PipelineCheckpoint
+from modules.openai_batch import OpenAIBatchRunner
+from modules.speculation import Speculator
+from modules.server import PipelineServer
 from modules.spinner import Spinner
 
 # --- Logging Setup ---
+os.makedirs(LOG_DIR, exist_ok=True)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler("logs/app.log"),
+        logging.FileHandler(os.path.join(LOG_DIR, "app.log")),
         logging.StreamHandler()
     ]
 )
 
-# Load environment variables from .env file
-load_dotenv()
+def _stage_spinner(message: str, interactive: bool):
+    """Returns a Spinner in interactive mode and a no-op context otherwise."""
+    return Spinner(message) if interactive else nullcontext()
+
+def _in_stage(run_metrics: RunMetrics, stage: str, function, *args, **kwargs):
+    """Runs a function within a metrics stage, e.g. a step started speculatively in the background."""
+    with run_metrics.stage(stage):
+        return function(*args, **kwargs)
 
-def process_image(input_path: str, create_video: bool = False):
+def _finish_run(json_logger: JSONLogger, run_metrics: RunMetrics, success: bool, error_message: str = None) -> dict:
+    """Stores the run metrics in the JSON log, finishes the process and exports the totals."""
+    json_logger.log_metrics(run_metrics.to_dict())
+    record = json_logger.finish_process(success=success, error_message=error_message)
+    METRICS.observe(run_metrics, record["status"])
+    METRICS.export()
+    return record
+
+def _choose_variant(variant_paths: list, interactive: bool) -> str:
+    """Lets the user pick one of the generated variants; the first one is used in batch mode."""
+    if not interactive or len(variant_paths) == 1:
+        return variant_paths[0]
+
+    print("\n--- Image Variants ---")
+    for index, path in enumerate(variant_paths, start=1):
+        print(f"[{index}] {path}")
+    while True:
+        choice = input(f"Choose a variant (1-{len(variant_paths)}): ").strip()
+        if choice.isdigit() and 1 <= int(choice) <= len(variant_paths):
+            return variant_paths[int(choice) - 1]
+        print(f"Invalid choice. Please enter a number from 1 to {len(variant_paths)}.")
+
+def process_image(input_path: str, create_video: bool = False, interactive: bool = True, queued_at: float = None,
+                  resume: bool = True, variants: int = 1, style_description: str = None, generation_prompt: str = None):
     """
     Orchestrates the entire image-to-video pipeline for a single input image.
 
     Args:
         input_path: The full path to the input image.
         create_video: If True, the process will continue to generate a video.
+        interactive: If False, no stdin prompts are shown: the first generated
+            prompt is accepted and it is reused as the video prompt.
+        queued_at: The time.perf_counter() value when the image was queued,
+            used to report how long it waited for a worker.
+        resume: If True, stages completed by an earlier, unfinished run of the
+            same image are taken from its checkpoint instead of being run again.
+            In interactive mode only the style description is resumed; the
+            steps the user reviews are always shown again.
+        variants: The number of candidate images generated in parallel per
+            iteration; with more than one, the user picks the one to continue with.
+        style_description: A description produced beforehand, e.g. by the
+            Batch API; Step 1 is skipped if given (optional).
+        generation_prompt: A prompt produced beforehand for the style
+            description, e.g. by the Batch API; used instead of Step 2 in
+            non-interactive mode (optional).
+
+    Returns:
+        The finished JSON log record, or None if the input file does not exist.
     """
     if not os.path.exists(input_path):
         logging.error(f"Input file not found at: {input_path}")
-        return
+        return None
 
     # Inicjalizuj JSON logger
     json_logger = JSONLogger()
     input_filename = os.path.basename(input_path)
     json_logger.start_process(input_filename)
+    run_metrics = start_run()
+    if queued_at is not None:
+        run_metrics.add("queue", wall_seconds=time.perf_counter() - queued_at)
 
     # Get API key from environment
     replicate_api_key = os.getenv("REPLICATE_API_KEY")
     if not replicate_api_key:
         logging.error("REPLICATE_API_KEY environment variable not found.")
-        json_logger.finish_process(success=False, error_message="REPLICATE_API_KEY not found")
-        return
+        return _finish_run(json_logger, run_metrics, success=False, error_message="REPLICATE_API_KEY not found")
+
+    output_filename_base = os.path.splitext(input_filename)[0]
+    speculators = []
 
     try:
+        checkpoint = PipelineCheckpoint(input_path)
+        if not resume:
+            checkpoint.clear()
+        elif interactive:
+            # The user reviews the prompt, the image and the video prompt again; only the description is resumed
+            checkpoint.reset_from("prompt")
+
         # --- Step 1: Analyze Image Style ---
-        with Spinner("Step 1: Analyzing image style..."):
-            describer = ImageDescriber()
-            style_description = describer.describe(input_path)
-        logging.info("Step 1: Image style analysis complete.")
+        if checkpoint.get("style_description"):
+            style_description = checkpoint.get("style_description")
+            logging.info(f"Step 1: Reusing style description from checkpoint for '{input_filename}'.")
+        elif style_description:
+            logging.info(f"Step 1: Using style description from the Batch API for '{input_filename}'.")
+            checkpoint.save(style_description=style_description)
+        else:
+            with _stage_spinner("Step 1: Analyzing image style...", interactive), run_metrics.stage("describe"):
+                describer = ImageDescriber()
+                # Batch jobs share multi-image requests with the images other workers describe at the same time
+                style_description = describer.describe(input_path) if interactive else describer.describe_batched(input_path)
+            checkpoint.save(style_description=style_description)
+        logging.info(f"Step 1: Image style analysis complete for '{input_filename}'.")
         logging.info(f"Style description received:\n---\n{style_description}\n---")
         
         # Zapisz opis stylu do JSON
         json_logger.log_style_description(style_description)
 
+        image_generator = ImageGenerator(api_key=replicate_api_key)
+        video_animator = VideoAnimator(api_key=replicate_api_key) if create_video else None
+        # While the user iterates, images are rendered by the faster preview tier; the accepted prompt is rendered in full afterwards
+        preview = interactive and variants == 1 and IMAGE_PREVIEW_CONFIG.get("enabled")
+        preview_generator = ImageGenerator(api_key=replicate_api_key, preview=True) if preview else None
+        loop_generator = preview_generator or image_generator
+        loop_output_name = f"{output_filename_base}_preview" if preview else f"{output_filename_base}_generated"
+        # In interactive mode, rendering starts while the user is still reviewing; the result is
+        # used if they accept what they saw, and the prediction is canceled if they change it
+        image_speculator = Speculator(image_generator.predictions.cancel, "image generation")
+        video_speculator = Speculator(image_generator.predictions.cancel, "animation")
+        speculators.extend([image_speculator, video_speculator])
+        speculate_images = interactive and variants == 1 and IMAGE_GENERATOR_CONFIG.get("speculative")
+        # A preview is never animated, so there is nothing to animate before the full render
+        speculate_videos = interactive and create_video and not preview and VIDEO_ANIMATOR_CONFIG.get("speculative")
+
+        def speculate_image(prompt: str):
+            image_speculator.start(prompt, _in_stage, run_metrics, "speculative_generate", loop_generator.generate,
+                                   prompt=prompt, output_name=loop_output_name, input_image_path=input_path)
+
         # --- Step 2: Create Generation Prompt ---
         # The new prompt_creator handles the interaction, so we call it directly.
-        prompt_creator = PromptCreator()
-        generation_prompt = prompt_creator.create_prompt(style_description)
+        if checkpoint.get("generation_prompt"):
+            generation_prompt = checkpoint.get("generation_prompt")
+            logging.info("Step 2: Reusing accepted prompt from checkpoint.")
+        elif generation_prompt and not interactive:
+            logging.info("Step 2: Using generation prompt from the Batch API.")
+            checkpoint.save(generation_prompt=generation_prompt)
+        else:
+            prompt_creator = PromptCreator()
+            with run_metrics.stage("prompt"):
+                if interactive:
+                    generation_prompt = prompt_creator.create_prompt(
+                        style_description, on_prompt=speculate_image if speculate_images else None
+                    )
+                else:
+                    generation_prompt = prompt_creator.generate_prompt(style_description)
+            checkpoint.save(generation_prompt=generation_prompt)
         
         logging.info(f"Step 2: Generation prompt accepted: '{generation_prompt}'")
         
@@ -68,19 +187,53 @@ def process_image(input_path: str, create_video: bool = False):
         json_logger.log_generation_prompt(generation_prompt)
 
         # --- Tweak Loop: Generate Image and allow for modifications ---
+        generated_image_path = checkpoint.get_file("generated_image")
         while True:
             # --- Step 3: Generate New Image ---
-            with Spinner("Step 3: Generating new image..."):
-                image_generator = ImageGenerator(api_key=replicate_api_key)
-                output_filename_base = os.path.splitext(os.path.basename(input_path))[0]
-                generated_image_path = image_generator.generate(
-                    prompt=generation_prompt,
-                    output_name=f"{output_filename_base}_generated",
-                    input_image_path=input_path
-                )
+            if generated_image_path:
+                logging.info("Step 3: Reusing generated image from checkpoint.")
+            else:
+                step_message = "Step 3: Generating preview image..." if preview else "Step 3: Generating new image..."
+                with _stage_spinner(step_message, interactive), run_metrics.stage("preview" if preview else "generate"):
+                    if variants > 1:
+                        variant_paths = image_generator.generate_variants(
+                            prompt=generation_prompt,
+                            output_name=f"{output_filename_base}_generated",
+                            input_image_path=input_path,
+                            count=variants
+                        )
+                    elif preview:
+                        generated_image_path = image_speculator.take(generation_prompt) or preview_generator.generate(
+                            prompt=generation_prompt,
+                            output_name=loop_output_name,
+                            input_image_path=input_path
+                        )
+                    else:
+                        generated_image_path = image_speculator.take(generation_prompt) or image_generator.generate(
+                            prompt=generation_prompt,
+                            output_name=f"{output_filename_base}_generated",
+                            input_image_path=input_path,
+                            prediction_id=checkpoint.get("image_prediction_id"),
+                            on_submit=lambda prediction_id: checkpoint.save(image_prediction_id=prediction_id)
+                        )
+                if variants > 1:
+                    json_logger.log_variant_images(variant_paths)
+                    generated_image_path = _choose_variant(variant_paths, interactive)
+                if not preview:
+                    checkpoint.save_file("generated_image", generated_image_path)
             logging.info(f"Step 3: New image saved at: {generated_image_path}")
-            
-            json_logger.log_output_image(generated_image_path)
+
+            if not preview:
+                json_logger.log_output_image(generated_image_path)
+
+            if not interactive:
+                break
+
+            if speculate_videos and not checkpoint.get_file("video"):
+                # No video prompt has been entered yet, so the default one (the image prompt) is animated
+                video_speculator.start((generated_image_path, generation_prompt), _in_stage, run_metrics, "speculative_animate",
+                                       video_animator.animate, generated_image_path, f"{output_filename_base}_animated",
+                                       generation_prompt)
 
             # --- Ask user to tweak ---
             print("\n--- Image Generated ---")
@@ -101,58 +254,268 @@ def process_image(input_path: str, create_video: bool = False):
             new_prompt = input("Enter your new prompt: ").strip()
             
             if new_prompt:
+                video_speculator.discard()
                 generation_prompt = new_prompt
                 json_logger.log_generation_prompt(generation_prompt)
+                # The checkpointed image and its prediction belong to the previous prompt
+                checkpoint.save(generation_prompt=generation_prompt, generated_image=None, image_prediction_id=None,
+                                video_prompt=None, video_prediction_id=None, video=None)
+                generated_image_path = None
                 print("Prompt updated. Regenerating image...")
             else:
                 print("No changes entered. Continuing with the current image.")
                 break
 
+        if preview and not checkpoint.get_file("generated_image"):
+            # The preview was accepted, so the final image is rendered at full quality
+            with _stage_spinner("Step 3: Rendering final image at full quality...", interactive), run_metrics.stage("generate"):
+                generated_image_path = image_generator.generate(
+                    prompt=generation_prompt,
+                    output_name=f"{output_filename_base}_generated",
+                    input_image_path=input_path,
+                    prediction_id=checkpoint.get("image_prediction_id"),
+                    on_submit=lambda prediction_id: checkpoint.save(image_prediction_id=prediction_id)
+                )
+            checkpoint.save_file("generated_image", generated_image_path)
+            logging.info(f"Step 3: Final image saved at: {generated_image_path}")
+            json_logger.log_output_image(generated_image_path)
+
         # --- Step 4: Animate Video (Optional) ---
         if create_video:
-            # --- Get user prompt for video ---
-            print("\n--- Video Generation ---")
-            video_prompt = input("Please enter the prompt for video generation: ")
+            video_prompt = checkpoint.get("video_prompt")
+            if video_prompt:
+                logging.info("Step 4: Reusing video prompt from checkpoint.")
+            elif interactive:
+                # --- Get user prompt for video ---
+                print("\n--- Video Generation ---")
+                video_prompt = input("Please enter the prompt for video generation: ")
+            else:
+                video_prompt = ""
             if not video_prompt:
                 logging.warning("Video prompt is empty, using the auto-generated image prompt.")
                 video_prompt = generation_prompt
             json_logger.log_video_prompt(video_prompt) # Log the chosen prompt
+            checkpoint.save(video_prompt=video_prompt)
 
-            with Spinner("Step 4: Animating video... (this may take a moment)"):
-                video_animator = VideoAnimator(api_key=replicate_api_key)
-                generated_video_path = video_animator.animate(generated_image_path, f"{output_filename_base}_animated", video_prompt)
+            generated_video_path = checkpoint.get_file("video")
+            if generated_video_path:
+                logging.info("Step 4: Reusing video from checkpoint.")
+            else:
+                with _stage_spinner("Step 4: Animating video... (this may take a moment)", interactive), run_metrics.stage("animate"):
+                    generated_video_path = video_speculator.take((generated_image_path, video_prompt)) or video_animator.animate(
+                        generated_image_path,
+                        f"{output_filename_base}_animated",
+                        video_prompt,
+                        prediction_id=checkpoint.get("video_prediction_id"),
+                        on_submit=lambda prediction_id: checkpoint.save(video_prediction_id=prediction_id)
+                    )
+                checkpoint.save_file("video", generated_video_path)
             logging.info(f"Step 4: New video saved at: {generated_video_path}")
             
             # Zapisz ścieżkę wideo do JSON
             json_logger.log_output_video(generated_video_path)
 
         # Zakończ proces jako udany
-        json_logger.finish_process(success=True)
-        logging.info("Process completed successfully!")
+        checkpoint.save(completed=True)
+        record = _finish_run(json_logger, run_metrics, success=True)
+        logging.info(f"Process completed successfully for '{input_filename}'!")
+        return record
 
     except Exception as e:
         logging.error(f"An error occurred during the process: {e}", exc_info=True)
         # Zakończ proces jako nieudany
-        json_logger.finish_process(success=False)
+        return _finish_run(json_logger, run_metrics, success=False, error_message=str(e))
+    finally:
+        for speculator in speculators:
+            speculator.discard()
 
-if __name__ == "__main__":
-    # --- Run the process for a test image ---
+def find_input_images(input_dir: str = INPUT_DIR) -> list:
+    """
+    Lists the images in the input directory that the batch mode will process.
+
+    Args:
+        input_dir: The directory to scan (not recursive).
+
+    Returns:
+        A sorted list of full paths to the supported image files.
+    """
+    if not os.path.isdir(input_dir):
+        return []
+    extensions = tuple(ext.lower() for ext in BATCH_CONFIG["image_extensions"])
+    return sorted(
+        os.path.join(input_dir, name)
+        for name in os.listdir(input_dir)
+        if name.lower().endswith(extensions) and os.path.isfile(os.path.join(input_dir, name))
+    )
+
+def process_batch(input_dir: str = INPUT_DIR, create_video: bool = False, max_workers: int = None, engine: str = "threads",
+                  resume: bool = True, variants: int = 1, openai_batch: bool = False) -> dict:
+    """
+    Runs the non-interactive pipeline for every image in the input directory.
+    A failure of one image does not stop the others.
+
+    Args:
+        input_dir: The directory containing the input images.
+        create_video: If True, every image is also animated.
+        max_workers: The number of images processed concurrently by the thread
+            engine (defaults to BATCH_CONFIG["max_workers"]).
+        engine: "threads" runs whole images on a bounded worker pool, "async"
+            runs the asyncio engine with per-stage concurrency limits
+            (ASYNC_PIPELINE_CONFIG).
+        resume: If False, checkpoints of earlier runs are discarded.
+        variants: The number of candidate images per input (thread engine only);
+            all are saved and the first one is animated.
+        openai_batch: If True, all descriptions and then all prompts are
+            produced through the OpenAI Batch API before any image is generated.
+
+    Returns:
+        A mapping of input filename to its finished JSON log record.
+    """
+    image_paths = find_input_images(input_dir)
+    if not image_paths:
+        logging.warning(f"No input images found in '{input_dir}'.")
+        return {}
+
+    descriptions, prompts = _prepare_with_batch_api(image_paths, resume) if openai_batch else ({}, {})
+    if engine == "async":
+        replicate_api_key = os.getenv("REPLICATE_API_KEY")
+        if not replicate_api_key:
+            logging.error("REPLICATE_API_KEY environment variable not found.")
+            return {}
+        logging.info(f"--- Starting async batch of {len(image_paths)} images ---")
+        results = run_async_pipeline(image_paths, replicate_api_key, create_video=create_video, resume=resume,
+                                     descriptions=descriptions, prompts=prompts)
+    else:
+        results = _process_batch_threaded(image_paths, create_video, max_workers or BATCH_CONFIG["max_workers"], resume, variants,
+                                          descriptions, prompts)
+
+    succeeded = sum(1 for record in results.values() if record and record.get("status") == "completed")
+    logging.info(f"--- Batch finished: {succeeded} succeeded, {len(results) - succeeded} failed ---")
+    if DESCRIPTION_CACHE_CONFIG["enabled"]:
+        cache_stats = get_cache("descriptions").stats()
+        logging.info(f"Description cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    if PROMPT_CACHE_CONFIG["enabled"]:
+        cache_stats = get_cache("prompts").stats()
+        logging.info(f"Prompt cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    if GENERATION_STORE_CONFIG["enabled"]:
+        cache_stats = get_file_cache("generations").stats()
+        logging.info(f"Generation store: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    return results
+
+def _prepare_with_batch_api(image_paths: list, resume: bool) -> tuple:
+    """
+    Produces the style descriptions and then the generation prompts of a batch
+    through the OpenAI Batch API (OPENAI_BATCH_CONFIG). Stages already in a
+    checkpoint are skipped; anything the batch jobs did not deliver is left to
+    each image's own synchronous stage.
+
+    Returns:
+        The descriptions and the prompts, each by input path.
+    """
+    checkpoints = {path: PipelineCheckpoint(path) for path in image_paths} if resume else {}
+    known = {path: checkpoints[path].get("style_description") for path in checkpoints if checkpoints[path].get("style_description")}
+    started = time.perf_counter()
+    run_metrics = RunMetrics()
+    runner = OpenAIBatchRunner()
+    try:
+        with run_metrics.stage("describe_batch"):
+            descriptions = ImageDescriber().describe_with_batch_api([path for path in image_paths if path not in known],
+                                                                  runner=runner)
+        pending = {
+            path: description for path, description in {**known, **descriptions}.items()
+            if not (path in checkpoints and checkpoints[path].get("generation_prompt"))
+        }
+        with run_metrics.stage("prompt_batch"):
+            prompts = PromptCreator().generate_prompts_with_batch_api(pending, runner=runner)
+    except Exception as e:
+        logging.warning(f"OpenAI batch mode failed ({e}); every image runs its stages on its own.")
+        return {}, {}
+
+    usage = run_metrics.to_dict()
+    cost = sum(stage.get("cost_usd", 0) for stage in usage.values())
+    logging.info(f"Batch API: {len(descriptions)} descriptions and {len(prompts)} prompts in "
+                 f"{time.perf_counter() - started:.1f}s (${cost:.4f}).")
+    return descriptions, prompts
+
+def _process_batch_threaded(image_paths: list, create_video: bool, max_workers: int, resume: bool, variants: int,
+                            descriptions: dict = None, prompts: dict = None) -> dict:
+    """Runs process_image for every image on a bounded thread pool."""
+    logging.info(f"--- Starting batch of {len(image_paths)} images with {max_workers} workers ---")
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(process_image, path, create_video, False, time.perf_counter(), resume, variants,
+                            (descriptions or {}).get(path), (prompts or {}).get(path)): os.path.basename(path)
+            for path in image_paths
+        }
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                record = future.result()
+            except Exception as e:
+                # process_image handles pipeline errors itself; this guards against anything else
+                logging.error(f"Unexpected error while processing '{filename}': {e}", exc_info=True)
+                record = {"input_file": filename, "status": "failed", "error": str(e)}
+            results[filename] = record
+
+            if record and record.get("status") == "completed":
+                logging.info(f"[OK] {filename}")
+            else:
+                error = (record or {}).get("error", "unknown error")
+                logging.error(f"[FAILED] {filename}: {error}")
+    return results
+
+def run_interactive(resume: bool = True, variants: int = 1):
+    """Runs the interactive pipeline for the test image in the input folder."""
     # Make sure to place a 'test.jpg' file in the 'input' folder
     test_image_name = "test.jpg"
     test_image_path = os.path.join(INPUT_DIR, test_image_name)
 
     if not os.path.exists(test_image_path):
         logging.error(f"Test file '{test_image_name}' not found in '{INPUT_DIR}'. Please place it there to run the script.")
-    else:
-        while True:
-            choice = input("What would you like to do?\n[1] Generate Image only\n[2] Generate Image and Video\nEnter choice (1 or 2): ")
-            if choice in ['1', '2']:
-                break
-            else:
-                print("Invalid choice. Please enter 1 or 2.")
+        return
 
-        create_video_choice = (choice == '2')
-        
-        logging.info(f"--- Starting Image-to-Video Process for '{test_image_name}' ---")
-        process_image(test_image_path, create_video=create_video_choice)
-        logging.info("--- Process Finished ---") 
\ No newline at end of file
+    while True:
+        choice = input("What would you like to do?\n[1] Generate Image only\n[2] Generate Image and Video\nEnter choice (1 or 2): ")
+        if choice in ['1', '2']:
+            break
+        else:
+            print("Invalid choice. Please enter 1 or 2.")
+
+    create_video_choice = (choice == '2')
+    
+    logging.info(f"--- Starting Image-to-Video Process for '{test_image_name}' ---")
+    process_image(test_image_path, create_video=create_video_choice, resume=resume, variants=variants)
+    logging.info("--- Process Finished ---")
+
+def run_server(port: int = None, workers: int = None):
+    """Runs the HTTP job API until interrupted; jobs run the non-interactive pipeline."""
+    if not os.getenv("REPLICATE_API_KEY"):
+        logging.error("REPLICATE_API_KEY environment variable not found.")
+        return
+    server = PipelineServer(partial(process_image, interactive=False), port=port, workers=workers)
+    server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Image-to-Video pipeline for architectural visualizations.")
+    parser.add_argument("--batch", action="store_true", help="Process every image in the input folder without prompts.")
+    parser.add_argument("--video", action="store_true", help="In batch mode, also animate every generated image.")
+    parser.add_argument("--workers", type=int, default=None, help="In batch mode, the number of images processed concurrently.")
+    parser.add_argument("--engine", choices=["threads", "async"], default="threads", help="Batch engine: a thread pool per image, or the asyncio engine with per-stage limits.")
+    parser.add_argument("--fresh", action="store_true", help="Ignore checkpoints of earlier runs and start every image from scratch.")
+    parser.add_argument("--variants", type=int, nargs="?", const=IMAGE_GENERATOR_CONFIG["variants"], default=1,
+                        help="Generate several candidate images in parallel (default count from IMAGE_GENERATOR_CONFIG).")
+    parser.add_argument("--openai-batch", action="store_true",
+                        help="In batch mode, create all descriptions and prompts through the OpenAI Batch API first (see OPENAI_BATCH_CONFIG).")
+    parser.add_argument("--serve", action="store_true", help="Run the HTTP job API instead (see SERVER_CONFIG).")
+    parser.add_argument("--port", type=int, default=None, help="With --serve, the port to listen on.")
+    args = parser.parse_args()
+
+    if args.serve:
+        run_server(port=args.port, workers=args.workers)
+    elif args.batch:
+        process_batch(INPUT_DIR, create_video=args.video, max_workers=args.workers, engine=args.engine, resume=not args.fresh,
+                      variants=args.variants, openai_batch=args.openai_batch)
+    else:
+        run_interactive(resume=not args.fresh, variants=args.variants)
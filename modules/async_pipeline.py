@@ -0,0 +1,184 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Optional
+from config import ASYNC_PIPELINE_CONFIG
+from .image_describer import ImageDescriber
+from .prompt_creator import PromptCreator
+from .image_generator import ImageGenerator
+from .video_animator import VideoAnimator
+from .json_logger import JSONLogger
+from .metrics import METRICS, RunMetrics, start_run
+from .checkpoint import PipelineCheckpoint
+
+class AsyncPipeline:
+    """
+    Runs the non-interactive pipeline for many images on one event loop.
+
+    Every stage has its own concurrency cap, so stages overlap across images:
+    image N+1 can be described while image N is still generating.
+    """
+    def __init__(self, replicate_api_key: str, create_video: bool = False, concurrency: Optional[dict] = None,
+                 resume: bool = True):
+        """
+        Initializes the pipeline and the stage modules shared by all images.
+
+        Args:
+            replicate_api_key: The Replicate API key.
+            create_video: If True, every generated image is also animated.
+            concurrency: Optional per-stage limits overriding ASYNC_PIPELINE_CONFIG["concurrency"].
+            resume: If False, checkpoints of earlier runs are discarded.
+        """
+        self.create_video = create_video
+        self.resume = resume
+        self.limits = {**ASYNC_PIPELINE_CONFIG["concurrency"], **(concurrency or {})}
+        self.describer = ImageDescriber()
+        self.prompt_creator = PromptCreator()
+        self.image_generator = ImageGenerator(api_key=replicate_api_key)
+        self.video_animator = VideoAnimator(api_key=replicate_api_key) if create_video else None
+        self._semaphores = {}
+
+    async def _run_stage(self, run_metrics: RunMetrics, stage: str, coroutine_function, *args):
+        """Runs one stage call while holding that stage's concurrency slot."""
+        queued_at = time.perf_counter()
+        async with self._semaphores[stage]:
+            with run_metrics.stage(stage):
+                run_metrics.add(stage, queue_wait_seconds=time.perf_counter() - queued_at)
+                return await coroutine_function(*args)
+
+    def _finish(self, json_logger: JSONLogger, run_metrics: RunMetrics, success: bool, error_message: str = None) -> dict:
+        """Stores the run metrics in the JSON log, finishes the process and exports the totals."""
+        json_logger.log_metrics(run_metrics.to_dict())
+        record = json_logger.finish_process(success=success, error_message=error_message)
+        METRICS.observe(run_metrics, record["status"])
+        METRICS.export()
+        return record
+
+    async def process(self, input_path: str, style_description: str = None, generation_prompt: str = None) -> dict:
+        """
+        Runs describe -> prompt -> generate -> (optional) animate for one image.
+
+        Args:
+            input_path: The full path to the input image.
+            style_description: A description produced beforehand, e.g. by a
+                batch job; the describe stage is skipped if given (optional).
+            generation_prompt: A prompt produced beforehand for the style
+                description; the prompt stage is skipped if given (optional).
+
+        Returns:
+            The finished JSON log record.
+        """
+        json_logger = JSONLogger()
+        input_filename = os.path.basename(input_path)
+        output_filename_base = os.path.splitext(input_filename)[0]
+        json_logger.start_process(input_filename)
+        run_metrics = start_run()
+
+        try:
+            checkpoint = await asyncio.to_thread(PipelineCheckpoint, input_path)
+            if not self.resume:
+                checkpoint.clear()
+
+            style_description = checkpoint.get("style_description") or style_description
+            if style_description:
+                checkpoint.save(style_description=style_description)
+            else:
+                style_description = await self._run_stage(run_metrics, "describe", self.describer.describe_batched_async, input_path)
+                checkpoint.save(style_description=style_description)
+            json_logger.log_style_description(style_description)
+
+            generation_prompt = checkpoint.get("generation_prompt") or generation_prompt
+            if generation_prompt:
+                checkpoint.save(generation_prompt=generation_prompt)
+            else:
+                generation_prompt = await self._run_stage(run_metrics, "prompt", self.prompt_creator.generate_prompt_async, style_description)
+                checkpoint.save(generation_prompt=generation_prompt)
+            json_logger.log_generation_prompt(generation_prompt)
+
+            generated_image_path = await asyncio.to_thread(checkpoint.get_file, "generated_image")
+            if not generated_image_path:
+                generated_image_path = await self._run_stage(
+                    run_metrics,
+                    "generate",
+                    self.image_generator.generate_async,
+                    generation_prompt,
+                    f"{output_filename_base}_generated",
+                    input_path,
+                    checkpoint.get("image_prediction_id"),
+                    lambda prediction_id: checkpoint.save(image_prediction_id=prediction_id)
+                )
+                await asyncio.to_thread(checkpoint.save_file, "generated_image", generated_image_path)
+            json_logger.log_output_image(generated_image_path)
+
+            if self.create_video:
+                json_logger.log_video_prompt(generation_prompt)
+                generated_video_path = await asyncio.to_thread(checkpoint.get_file, "video")
+                if not generated_video_path:
+                    video_url = await self._run_stage(
+                        run_metrics,
+                        "animate",
+                        self.video_animator.render_video_async,
+                        generated_image_path,
+                        generation_prompt,
+                        checkpoint.get("video_prediction_id"),
+                        lambda prediction_id: checkpoint.save(video_prediction_id=prediction_id)
+                    )
+                    generated_video_path = await self._run_stage(
+                        run_metrics,
+                        "download",
+                        asyncio.to_thread,
+                        self.video_animator.download_video,
+                        video_url,
+                        f"{output_filename_base}_animated"
+                    )
+                    await asyncio.to_thread(checkpoint.save_file, "video", generated_video_path)
+                json_logger.log_output_video(generated_video_path)
+
+            checkpoint.save(completed=True)
+            record = await asyncio.to_thread(self._finish, json_logger, run_metrics, True)
+            logging.info(f"[OK] {input_filename}")
+            return record
+
+        except Exception as e:
+            logging.error(f"[FAILED] {input_filename}: {e}", exc_info=True)
+            return await asyncio.to_thread(self._finish, json_logger, run_metrics, False, str(e))
+
+    async def run(self, image_paths: list, descriptions: Optional[dict] = None, prompts: Optional[dict] = None) -> dict:
+        """
+        Processes all images concurrently within the per-stage limits.
+
+        Args:
+            image_paths: The full paths to the input images.
+            descriptions: Style descriptions produced beforehand, by input path (optional).
+            prompts: Generation prompts produced beforehand, by input path (optional).
+
+        Returns:
+            A mapping of input filename to its finished JSON log record.
+        """
+        # Semaphores are created here so they belong to the running event loop
+        self._semaphores = {stage: asyncio.Semaphore(limit) for stage, limit in self.limits.items()}
+        descriptions = descriptions or {}
+        prompts = prompts or {}
+        records = await asyncio.gather(*(self.process(path, descriptions.get(path), prompts.get(path)) for path in image_paths))
+        return {os.path.basename(path): record for path, record in zip(image_paths, records)}
+
+def run_async_pipeline(image_paths: list, replicate_api_key: str, create_video: bool = False, concurrency: Optional[dict] = None,
+                       resume: bool = True, descriptions: Optional[dict] = None, prompts: Optional[dict] = None) -> dict:
+    """
+    Convenience wrapper that runs an AsyncPipeline on a new event loop.
+
+    Args:
+        image_paths: The full paths to the input images.
+        replicate_api_key: The Replicate API key.
+        create_video: If True, every generated image is also animated.
+        concurrency: Optional per-stage limits overriding the configured ones.
+        resume: If False, checkpoints of earlier runs are discarded.
+        descriptions: Style descriptions produced beforehand, by input path (optional).
+        prompts: Generation prompts produced beforehand, by input path (optional).
+
+    Returns:
+        A mapping of input filename to its finished JSON log record.
+    """
+    pipeline = AsyncPipeline(replicate_api_key, create_video=create_video, concurrency=concurrency, resume=resume)
+    return asyncio.run(pipeline.run(image_paths, descriptions, prompts))
@@ -0,0 +1,178 @@
+import os
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Optional
+from config import (STATE_DIR, IMAGE_DESCRIBER_CONFIG, PROMPT_CREATOR_CONFIG, IMAGE_GENERATOR_CONFIG,
+                    VIDEO_ANIMATOR_CONFIG)
+from .disk_cache import make_key
+from .cpu_pool import hash_file
+
+# The pipeline stages in order, with the checkpoint fields each one produces
+STAGE_FIELDS = {
+    "describe": ("style_description",),
+    "prompt": ("generation_prompt",),
+    "generate": ("generated_image", "image_prediction_id"),
+    "animate": ("video_prompt", "video_prediction_id", "video")
+}
+# Settings that change how a stage runs, not what it produces
+OPERATIONAL_SETTINGS = {"rate_limit", "stream", "batch_size", "batch_wait_seconds", "batch_workers", "speculative", "variants"}
+
+def stage_settings() -> dict:
+    """
+    Returns a fingerprint of the configuration of every stage. A checkpointed
+    stage is only reused while its fingerprint is unchanged.
+
+    Returns:
+        A mapping of stage name to the hash of its settings.
+    """
+    configs = {
+        "describe": IMAGE_DESCRIBER_CONFIG,
+        "prompt": PROMPT_CREATOR_CONFIG,
+        "generate": IMAGE_GENERATOR_CONFIG,
+        "animate": VIDEO_ANIMATOR_CONFIG
+    }
+    return {
+        stage: make_key(json.dumps({key: value for key, value in config.items() if key not in OPERATIONAL_SETTINGS},
+                                   sort_keys=True, default=str))
+        for stage, config in configs.items()
+    }
+
+class PipelineCheckpoint:
+    """
+    Persists the result of every completed pipeline stage for one input image,
+    so that a re-run after a crash skips the stages that already finished.
+
+    Checkpoints are keyed by the input filename and content, and stored as one
+    JSON file per image in STATE_DIR/checkpoints. A checkpoint of a run that
+    completed is not resumed, and a stage whose settings changed since it was
+    checkpointed is run again, together with every stage after it.
+    """
+    def __init__(self, input_path: str):
+        """
+        Loads the checkpoint of an input image, if one exists.
+
+        Args:
+            input_path: The full path to the input image.
+        """
+        self.input_path = input_path
+        key = make_key(os.path.basename(input_path), hash_file(input_path))
+        self.path = os.path.join(STATE_DIR, "checkpoints", f"{key}.json")
+        self._lock = threading.Lock()
+        self.settings = stage_settings()
+        self.data = self._load()
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            logging.warning(f"Ignoring unreadable checkpoint '{self.path}': {e}")
+            return {}
+        if data.get("completed"):
+            # Checkpoints exist to resume failed runs; a finished image is processed anew
+            return {}
+
+        saved_settings = data.get("settings", {})
+        for stage, fields in STAGE_FIELDS.items():
+            if saved_settings.get(stage) != self.settings[stage] and any(field in data for field in fields):
+                logging.info(f"Settings of the '{stage}' stage changed; it is run again for '{os.path.basename(self.input_path)}'.")
+                self._drop_from(data, stage)
+                break
+        return data
+
+    @staticmethod
+    def _drop_from(data: dict, stage: str):
+        """Removes the fields of a stage and of every stage after it."""
+        stages = list(STAGE_FIELDS)
+        for later_stage in stages[stages.index(stage):]:
+            for field in STAGE_FIELDS[later_stage]:
+                data.pop(field, None)
+
+    def reset_from(self, stage: str):
+        """
+        Discards a stage and every stage after it, e.g. the stages the user
+        reviews in interactive mode.
+
+        Args:
+            stage: The first stage to discard, e.g. "prompt".
+        """
+        with self._lock:
+            self._drop_from(self.data, stage)
+        self.save()
+
+    def get(self, field: str, default: Any = None) -> Any:
+        """
+        Returns a checkpointed value.
+
+        Args:
+            field: The field name, e.g. "style_description".
+            default: The value returned if the field is not checkpointed.
+
+        Returns:
+            The checkpointed value or the default.
+        """
+        return self.data.get(field, default)
+
+    def save(self, **fields: Any):
+        """
+        Updates fields and writes the checkpoint atomically. A value of None
+        removes the field.
+
+        Args:
+            **fields: The fields to update.
+        """
+        with self._lock:
+            for field, value in fields.items():
+                if value is None:
+                    self.data.pop(field, None)
+                else:
+                    self.data[field] = value
+            self.data["input_file"] = os.path.basename(self.input_path)
+            self.data["settings"] = self.settings
+            self.data["updated_at"] = datetime.now().isoformat()
+
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = f"{self.path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, indent=2, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+
+    def save_file(self, field: str, path: str, **fields: Any):
+        """
+        Checkpoints an output file together with its content hash.
+
+        Args:
+            field: The field name, e.g. "generated_image".
+            path: The path to the output file.
+            **fields: Further fields to update in the same write.
+        """
+        self.save(**{field: {"path": path, "sha256": hash_file(path)}}, **fields)
+
+    def get_file(self, field: str) -> Optional[str]:
+        """
+        Returns a checkpointed output file if it still exists unchanged.
+
+        Args:
+            field: The field name, e.g. "generated_image".
+
+        Returns:
+            The path to the file, or None if it is missing or was modified.
+        """
+        entry = self.data.get(field)
+        if not entry or not os.path.exists(entry["path"]):
+            return None
+        if hash_file(entry["path"]) != entry["sha256"]:
+            logging.warning(f"Checkpointed file '{entry['path']}' has changed; it will be regenerated.")
+            return None
+        return entry["path"]
+
+    def clear(self):
+        """Deletes the checkpoint so the next run starts from the beginning."""
+        with self._lock:
+            self.data = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
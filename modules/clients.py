@@ -0,0 +1,148 @@
+import asyncio
+import threading
+import weakref
+from typing import TYPE_CHECKING
+from config import HTTP_CLIENT_CONFIG
+
+if TYPE_CHECKING:
+    import httpx
+    import openai
+    import replicate
+    import requests
+
+# Shared, long-lived API clients. Every module gets its clients from here so that
+# connection pools (and their TLS sessions) are reused across stages and images.
+# The SDKs are imported on first use: openai alone takes most of a second to
+# import, and a run that never reaches a stage should not pay for its SDK.
+
+_lock = threading.Lock()
+_openai_clients = {}
+_replicate_clients = {}
+_http_session = None
+# Async clients hold connections bound to an event loop, so they are kept per loop
+_async_openai_clients = weakref.WeakKeyDictionary()
+_async_replicate_clients = weakref.WeakKeyDictionary()
+
+def _limits() -> "httpx.Limits":
+    import httpx
+    return httpx.Limits(
+        max_connections=HTTP_CLIENT_CONFIG["max_connections"],
+        max_keepalive_connections=HTTP_CLIENT_CONFIG["max_keepalive_connections"],
+        keepalive_expiry=HTTP_CLIENT_CONFIG["keepalive_expiry"]
+    )
+
+def _openai_kwargs(base_url: str = None, api_key: str = None) -> dict:
+    # Retries are handled by the shared CallScheduler, which also paces them across callers
+    kwargs = {"timeout": HTTP_CLIENT_CONFIG["timeout"], "max_retries": 0}
+    if base_url:
+        kwargs["base_url"] = base_url
+    if api_key:
+        kwargs["api_key"] = api_key
+    return kwargs
+
+def get_openai_client(base_url: str = None, api_key: str = None) -> "openai.OpenAI":
+    """
+    Returns the shared OpenAI client for the given endpoint.
+
+    Args:
+        base_url: An OpenAI-compatible server URL (defaults to the OpenAI API).
+        api_key: The API key (defaults to OPENAI_API_KEY from the environment).
+
+    Returns:
+        A pooled openai.OpenAI client.
+    """
+    import openai
+    key = (base_url, api_key)
+    with _lock:
+        if key not in _openai_clients:
+            _openai_clients[key] = openai.OpenAI(
+                http_client=openai.DefaultHttpxClient(limits=_limits()),
+                **_openai_kwargs(base_url, api_key)
+            )
+        return _openai_clients[key]
+
+def get_async_openai_client(base_url: str = None, api_key: str = None) -> "openai.AsyncOpenAI":
+    """
+    Returns the shared async OpenAI client for the running event loop.
+
+    Args:
+        base_url: An OpenAI-compatible server URL (defaults to the OpenAI API).
+        api_key: The API key (defaults to OPENAI_API_KEY from the environment).
+
+    Returns:
+        A pooled openai.AsyncOpenAI client.
+    """
+    import openai
+    loop_clients = _async_openai_clients.setdefault(asyncio.get_running_loop(), {})
+    key = (base_url, api_key)
+    if key not in loop_clients:
+        loop_clients[key] = openai.AsyncOpenAI(
+            http_client=openai.DefaultAsyncHttpxClient(limits=_limits()),
+            **_openai_kwargs(base_url, api_key)
+        )
+    return loop_clients[key]
+
+def get_replicate_client(api_key: str) -> "replicate.Client":
+    """
+    Returns the shared Replicate client for the given API key.
+
+    Args:
+        api_key: The Replicate API key.
+
+    Returns:
+        A pooled replicate.Client.
+    """
+    import httpx
+    import replicate
+    with _lock:
+        if api_key not in _replicate_clients:
+            _replicate_clients[api_key] = replicate.Client(
+                api_token=api_key,
+                timeout=httpx.Timeout(HTTP_CLIENT_CONFIG["timeout"]),
+                # Pool limits belong to the transport when a custom transport is used
+                transport=httpx.HTTPTransport(limits=_limits())
+            )
+        return _replicate_clients[api_key]
+
+def get_async_replicate_client(api_key: str) -> "replicate.Client":
+    """
+    Returns the Replicate client used for async calls on the running event loop.
+
+    Args:
+        api_key: The Replicate API key.
+
+    Returns:
+        A replicate.Client with a pooled async transport.
+    """
+    import httpx
+    import replicate
+    loop_clients = _async_replicate_clients.setdefault(asyncio.get_running_loop(), {})
+    if api_key not in loop_clients:
+        loop_clients[api_key] = replicate.Client(
+            api_token=api_key,
+            timeout=httpx.Timeout(HTTP_CLIENT_CONFIG["timeout"]),
+            transport=httpx.AsyncHTTPTransport(limits=_limits())
+        )
+    return loop_clients[api_key]
+
+def get_http_session() -> "requests.Session":
+    """
+    Returns the shared requests session used for file downloads.
+
+    Returns:
+        A requests.Session with keep-alive and a sized connection pool.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    global _http_session
+    with _lock:
+        if _http_session is None:
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_CLIENT_CONFIG["pool_connections"],
+                pool_maxsize=HTTP_CLIENT_CONFIG["max_connections"]
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session = session
+        return _http_session
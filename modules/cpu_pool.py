@@ -0,0 +1,125 @@
+import io
+import os
+import base64
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+from config import CPU_POOL_CONFIG, CACHE_DIR
+from .disk_cache import file_sha256
+
+# CPU-bound work (hashing, Pillow transforms, base64 encoding) runs in worker
+# processes so it never holds the GIL of the process doing network I/O. Work is
+# handed over as file paths, and results are small values or written to files,
+# so no large byte blobs are pickled between processes.
+
+# Read size for base64 encoding; a multiple of 3 so chunks encode without padding
+ENCODE_CHUNK_SIZE = 3 * 256 * 1024
+
+_pool = None
+_pool_lock = threading.Lock()
+_hashes = {}
+_hashes_lock = threading.Lock()
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=CPU_POOL_CONFIG.get("max_workers") or os.cpu_count(),
+                mp_context=multiprocessing.get_context(CPU_POOL_CONFIG.get("start_method", "spawn"))
+            )
+        return _pool
+
+def _use_pool(size_hint: int = None) -> bool:
+    return CPU_POOL_CONFIG["enabled"] and (size_hint is None or size_hint >= CPU_POOL_CONFIG["min_file_bytes"])
+
+def run_cpu(function: Callable, *args, size_hint: int = None) -> Any:
+    """
+    Runs a CPU-bound function in the shared process pool and waits for it.
+
+    Small jobs (size_hint below CPU_POOL_CONFIG["min_file_bytes"]) run inline,
+    since handing them to another process costs more than it saves.
+
+    Args:
+        function: A picklable top-level function taking and returning small values.
+        *args: The arguments for the function.
+        size_hint: The size in bytes of the data the function processes (optional).
+
+    Returns:
+        The return value of the function.
+    """
+    global _pool
+    if not _use_pool(size_hint):
+        return function(*args)
+    try:
+        return _get_pool().submit(function, *args).result()
+    except BrokenProcessPool as e:
+        logging.warning(f"CPU process pool failed ({e}); running {function.__name__} inline.")
+        with _pool_lock:
+            _pool = None
+        return function(*args)
+
+def hash_file(path: str) -> str:
+    """
+    Computes the SHA-256 of a file in the process pool. Digests are memoized
+    per path, size and modification time, so a file hashed by several stages
+    is only read once.
+
+    Args:
+        path: The path to the file.
+
+    Returns:
+        The hex digest of the file content.
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _hashes_lock:
+        digest = _hashes.get(memo_key)
+    if digest is None:
+        digest = run_cpu(file_sha256, path, size_hint=stat.st_size)
+        with _hashes_lock:
+            _hashes[memo_key] = digest
+    return digest
+
+def _write_data_url(path: str, mime_type: str, target):
+    """Base64-encodes a file chunk by chunk into a text stream, without holding the raw bytes."""
+    target.write(f"data:{mime_type};base64,")
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(ENCODE_CHUNK_SIZE), b""):
+            target.write(base64.b64encode(chunk).decode("ascii"))
+
+def _write_data_url_file(path: str, mime_type: str, output_path: str):
+    """Writes the data URL of a file to output_path (runs in a worker process)."""
+    with open(output_path, "w", encoding="ascii") as target:
+        _write_data_url(path, mime_type, target)
+
+def encode_data_url(path: str, mime_type: str) -> str:
+    """
+    Base64-encodes a file into a data URL. Large files are encoded in the
+    process pool; the worker writes the encoded text to a temporary file that
+    is read back here, instead of pickling the result.
+
+    Args:
+        path: The path to the file.
+        mime_type: The MIME type of the file.
+
+    Returns:
+        The data URL string.
+    """
+    if not _use_pool(os.path.getsize(path)):
+        data_url = io.StringIO()
+        _write_data_url(path, mime_type, data_url)
+        return data_url.getvalue()
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    output_path = os.path.join(CACHE_DIR, f"{os.path.basename(path)}.{os.getpid()}.{threading.get_ident()}.b64")
+    try:
+        run_cpu(_write_data_url_file, path, mime_type, output_path)
+        with open(output_path, "r", encoding="ascii") as f:
+            return f.read()
+    finally:
+        if os.path.exists(output_path):
+            os.remove(output_path)
@@ -0,0 +1,382 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from typing import Any, Optional
+from config import CACHE_DIR
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Computes the SHA-256 hex digest of a file without loading it into memory.
+
+    Args:
+        path: The path to the file.
+        chunk_size: The number of bytes read per iteration.
+
+    Returns:
+        The hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def make_key(*parts) -> str:
+    """
+    Builds a stable cache key from JSON-serializable parts.
+
+    Args:
+        *parts: The values that identify a cache entry.
+
+    Returns:
+        The SHA-256 hex digest of the serialized parts.
+    """
+    serialized = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes free text for use in a cache key, so that inputs differing only
+    in surrounding or repeated whitespace share an entry.
+
+    Args:
+        text: The text to normalize.
+
+    Returns:
+        The text with whitespace runs collapsed to single spaces.
+    """
+    return " ".join(text.split())
+
+class DiskCache:
+    """
+    A persistent key-value cache storing one JSON file per entry.
+
+    Recency is tracked through the file modification time, which is refreshed
+    on every hit, so eviction removes the least recently used entries first.
+    Entries older than the optional TTL are treated as misses and removed.
+    """
+    def __init__(self, namespace: str, max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+                 ttl_seconds: Optional[float] = None):
+        """
+        Initializes the cache in a subdirectory of CACHE_DIR.
+
+        Args:
+            namespace: The name of the subdirectory holding this cache's entries.
+            max_entries: The maximum number of entries kept (unbounded if None).
+            max_bytes: The maximum total size of the entries in bytes (unbounded if None).
+            ttl_seconds: The maximum age of an entry in seconds (no expiry if None).
+        """
+        self.directory = os.path.join(CACHE_DIR, namespace)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Returns the cached value for the key, or None on a miss.
+
+        Args:
+            key: The cache key, usually built with make_key().
+
+        Returns:
+            The cached value, or None if it is not cached.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            # Mark the entry as recently used
+            os.utime(path, None)
+        except FileNotFoundError:
+            entry = None
+        except (json.JSONDecodeError, OSError) as e:
+            logging.warning(f"Discarding unreadable cache entry '{path}': {e}")
+            self._remove(path)
+            entry = None
+        if entry and self.ttl_seconds is not None and time.time() - entry["created_at"] > self.ttl_seconds:
+            self._remove(path)
+            entry = None
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return entry["value"]
+
+    def set(self, key: str, value: Any):
+        """
+        Stores a value and evicts the least recently used entries if the cache
+        exceeds its bounds.
+
+        Args:
+            key: The cache key, usually built with make_key().
+            value: A JSON-serializable value.
+        """
+        path = self._path(key)
+        entry = {"created_at": time.time(), "value": value}
+        # Write to a temporary file first so readers never see a partial entry
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+        self._evict()
+
+    def stats(self) -> dict:
+        """
+        Returns the hit/miss counters of this cache instance.
+
+        Returns:
+            A dictionary with hits, misses and the hit rate.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        """Removes the least recently used entries until the cache is within its bounds."""
+        if self.max_entries is None and self.max_bytes is None:
+            return
+
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            entries.sort()
+            total_bytes = sum(size for _, size, _ in entries)
+            count = len(entries)
+            for _, size, path in entries:
+                over_entries = self.max_entries is not None and count > self.max_entries
+                over_bytes = self.max_bytes is not None and total_bytes > self.max_bytes
+                if not (over_entries or over_bytes):
+                    break
+                self._remove(path)
+                count -= 1
+                total_bytes -= size
+
+class FileCache:
+    """
+    A persistent store of output files (e.g. generated images), one file per key.
+
+    Like DiskCache, recency is tracked through the file modification time and
+    the least recently used files are evicted once the store exceeds its quota.
+    Files stored or looked up within the grace period are kept even then, since
+    the path returned by put() or lookup() may still be about to be read.
+    """
+    def __init__(self, namespace: str, max_bytes: Optional[int] = None, max_entries: Optional[int] = None,
+                 grace_seconds: float = 0):
+        """
+        Initializes the store in a subdirectory of CACHE_DIR.
+
+        Args:
+            namespace: The name of the subdirectory holding the stored files.
+            max_bytes: The disk quota of the store in bytes (unbounded if None).
+            max_entries: The maximum number of stored files (unbounded if None).
+            grace_seconds: How long a stored or looked up file is protected from eviction.
+        """
+        self.directory = os.path.join(CACHE_DIR, namespace)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.grace_seconds = grace_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key: str, extension: str) -> str:
+        return os.path.join(self.directory, f"{key}.{extension}")
+
+    def get(self, key: str, extension: str, destination: str) -> Optional[str]:
+        """
+        Copies a stored file to the destination path.
+
+        Args:
+            key: The key, usually built with make_key().
+            extension: The file extension, e.g. "png".
+            destination: Where to copy the stored file.
+
+        Returns:
+            The destination path, or None if nothing is stored under the key.
+        """
+        path = self._path(key, extension)
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(destination)), exist_ok=True)
+            temp_path = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+            shutil.copyfile(path, temp_path)
+            os.replace(temp_path, destination)
+            # Mark the file as recently used
+            os.utime(path, None)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return destination
+
+    def lookup(self, key: str, extension: str) -> Optional[str]:
+        """
+        Returns the path of a stored file for reading it in place.
+
+        Args:
+            key: The key, usually built with make_key().
+            extension: The file extension, e.g. "png".
+
+        Returns:
+            The path of the stored file, or None if nothing is stored under the key.
+        """
+        path = self._path(key, extension)
+        try:
+            os.utime(path, None)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def put(self, key: str, extension: str, source: str, move: bool = False) -> str:
+        """
+        Stores a file and evicts the least recently used files if the store
+        exceeds its quota.
+
+        Args:
+            key: The key, usually built with make_key().
+            extension: The file extension, e.g. "png".
+            source: The file to store.
+            move: If True, the source file is moved into the store instead of copied.
+
+        Returns:
+            The path of the stored file.
+        """
+        path = self._path(key, extension)
+        if move:
+            os.replace(source, path)
+        else:
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            shutil.copyfile(source, temp_path)
+            os.replace(temp_path, path)
+        self._evict()
+        return path
+
+    def stats(self) -> dict:
+        """
+        Returns the hit/miss counters of this store instance.
+
+        Returns:
+            A dictionary with hits, misses and the hit rate.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+    def _evict(self):
+        """Removes the least recently used files until the store is within its quota."""
+        if self.max_entries is None and self.max_bytes is None:
+            return
+
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            entries.sort()
+            total_bytes = sum(size for _, size, _ in entries)
+            count = len(entries)
+            protected_after = time.time() - self.grace_seconds
+            for mtime, size, path in entries:
+                over_entries = self.max_entries is not None and count > self.max_entries
+                over_bytes = self.max_bytes is not None and total_bytes > self.max_bytes
+                # Entries are sorted by recency, so every remaining file is within the grace period too
+                if not (over_entries or over_bytes) or mtime > protected_after:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                count -= 1
+                total_bytes -= size
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_cache(namespace: str, max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+              ttl_seconds: Optional[float] = None) -> DiskCache:
+    """
+    Returns the process-wide DiskCache for a namespace, so that hit/miss
+    counters are shared by every module instance using it.
+
+    Args:
+        namespace: The name of the cache.
+        max_entries: The maximum number of entries kept (used on first access).
+        max_bytes: The maximum total size in bytes (used on first access).
+        ttl_seconds: The maximum age of an entry in seconds (used on first access).
+
+    Returns:
+        The shared DiskCache instance.
+    """
+    with _caches_lock:
+        if namespace not in _caches:
+            _caches[namespace] = DiskCache(namespace, max_entries=max_entries, max_bytes=max_bytes,
+                                           ttl_seconds=ttl_seconds)
+        return _caches[namespace]
+
+def get_file_cache(namespace: str, max_bytes: Optional[int] = None, max_entries: Optional[int] = None,
+                   grace_seconds: float = 0) -> FileCache:
+    """
+    Returns the process-wide FileCache for a namespace.
+
+    Args:
+        namespace: The name of the store.
+        max_bytes: The disk quota in bytes (used on first access).
+        max_entries: The maximum number of stored files (used on first access).
+        grace_seconds: How long a returned file is protected from eviction (used on first access).
+
+    Returns:
+        The shared FileCache instance.
+    """
+    with _caches_lock:
+        if namespace not in _caches:
+            _caches[namespace] = FileCache(namespace, max_bytes=max_bytes, max_entries=max_entries,
+                                           grace_seconds=grace_seconds)
+        return _caches[namespace]
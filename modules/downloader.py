@@ -0,0 +1,274 @@
+import os
+import re
+import glob
+import time
+import hashlib
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Optional
+from config import DOWNLOAD_CONFIG, HTTP_CLIENT_CONFIG
+from .clients import get_http_session
+from .disk_cache import make_key
+from .scheduler import retry_after
+from . import metrics
+
+if TYPE_CHECKING:
+    import requests
+
+# HTTP statuses that are worth retrying besides 5xx: request timeout and rate limit
+RETRYABLE_STATUSES = {408, 429}
+
+def _retryable_errors() -> tuple:
+    """
+    Returns the errors after which a download is retried from where it stopped.
+    HTTPError is included so that _retry() can check its status.
+    """
+    import requests
+    return (
+        requests.exceptions.ConnectionError,
+        requests.exceptions.ChunkedEncodingError,
+        requests.exceptions.Timeout,
+        requests.exceptions.HTTPError
+    )
+
+class DownloadError(Exception):
+    """Raised when a downloaded file is incomplete or does not match its expected hash."""
+
+def _total_size(response: "requests.Response") -> Optional[int]:
+    """Returns the full size of the remote file from Content-Range or Content-Length."""
+    content_range = response.headers.get("Content-Range", "")
+    match = re.match(r"bytes \d+-\d+/(\d+)", content_range)
+    if match:
+        return int(match.group(1))
+    if response.status_code == 200 and response.headers.get("Content-Length"):
+        return int(response.headers["Content-Length"])
+    return None
+
+class Downloader:
+    """
+    Downloads files to disk in large chunks without holding them in memory.
+
+    Data is written to a "<path>.<url hash>.part" file that is renamed into place only
+    after its size (and optionally its SHA-256) has been verified, so an
+    interrupted download never leaves a truncated file at the final path. A
+    dropped connection is resumed with an HTTP Range request, both within a
+    run and when a later run finds the .part file. Large files can be split
+    into ranged segments that are downloaded in parallel.
+    """
+    def __init__(self, config: Optional[dict] = None):
+        """
+        Initializes the Downloader.
+
+        Args:
+            config: Optional settings overriding DOWNLOAD_CONFIG.
+        """
+        self.config = {**DOWNLOAD_CONFIG, **(config or {})}
+        self.session = get_http_session()
+        self.retryable_errors = _retryable_errors()
+        self.timeout = HTTP_CLIENT_CONFIG["timeout"]
+
+    def _get(self, url: str, start: int = 0, end: Optional[int] = None) -> "requests.Response":
+        """Starts a streaming GET, requesting the range [start, end] if needed."""
+        headers = {}
+        if start or end is not None:
+            headers["Range"] = f"bytes={start}-{'' if end is None else end}"
+        response = self.session.get(url, headers=headers, stream=True, timeout=self.timeout)
+        if response.status_code != 416:
+            try:
+                response.raise_for_status()
+            except Exception:
+                # Release the connection before the error is retried or raised
+                response.close()
+                raise
+        return response
+
+    def _retry(self, attempt: int, error: Exception, url: str):
+        """
+        Waits before the next attempt, honoring Retry-After, or re-raises the
+        error once the retries are used up or if its HTTP status is permanent.
+        """
+        status = getattr(getattr(error, "response", None), "status_code", None)
+        if status is not None and status not in RETRYABLE_STATUSES and status < 500:
+            raise error
+        if attempt >= self.config["max_retries"]:
+            raise error
+        delay = retry_after(error)
+        if delay is None:
+            delay = self.config["retry_backoff"] * 2 ** (attempt - 1)
+        logging.warning(f"Download of '{url}' interrupted ({error}); resuming in {delay:.1f}s "
+                        f"(attempt {attempt}/{self.config['max_retries']})")
+        time.sleep(delay)
+
+    def _probe(self, url: str) -> tuple:
+        """
+        Asks the server for the file size and whether it supports ranges.
+
+        Returns:
+            A tuple (size or None, supports_ranges).
+        """
+        import requests
+        try:
+            response = self.session.head(url, allow_redirects=True, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logging.debug(f"HEAD request for '{url}' failed: {e}")
+            return None, False
+        size = response.headers.get("Content-Length")
+        return (int(size) if size else None), response.headers.get("Accept-Ranges") == "bytes"
+
+    def _download_stream(self, url: str, part_path: str) -> Optional[int]:
+        """
+        Downloads the file in a single stream, appending to an existing .part file.
+
+        Returns:
+            The full size of the file if the server reported it, otherwise None.
+        """
+        attempt = 0
+        total = None
+        while True:
+            attempt += 1
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            try:
+                with self._get(url, start=offset) as response:
+                    if response.status_code == 416:
+                        # Nothing left to request: the .part file is already complete
+                        return offset
+                    total = _total_size(response) or total
+                    # A 200 means the server ignored the range, so start over
+                    mode = "ab" if response.status_code == 206 else "wb"
+                    with open(part_path, mode) as f:
+                        for chunk in response.iter_content(chunk_size=self.config["chunk_size"]):
+                            f.write(chunk)
+                            metrics.record(bytes_downloaded=len(chunk))
+            except self.retryable_errors as e:
+                self._retry(attempt, e, url)
+                continue
+            received = os.path.getsize(part_path)
+            if total is None or received >= total:
+                return total
+            self._retry(attempt, DownloadError(f"Response for '{url}' ended at byte {received} of {total}."), url)
+
+    def _download_segment(self, url: str, part_path: str, start: int, end: int):
+        """Downloads the byte range [start, end] into its place in the .part file."""
+        position = start
+        attempt = 0
+        while position <= end:
+            attempt += 1
+            try:
+                with self._get(url, start=position, end=end) as response:
+                    if response.status_code != 206:
+                        raise DownloadError(f"Server did not honor the range request for '{url}'.")
+                    with open(part_path, "r+b") as f:
+                        f.seek(position)
+                        for chunk in response.iter_content(chunk_size=self.config["chunk_size"]):
+                            chunk = chunk[:end + 1 - position]
+                            f.write(chunk)
+                            position += len(chunk)
+                            metrics.record(bytes_downloaded=len(chunk))
+            except self.retryable_errors as e:
+                self._retry(attempt, e, url)
+                continue
+            if position <= end:
+                # The response ended early without an error; retry the rest like an interrupted download
+                self._retry(attempt, DownloadError(f"Range response for '{url}' ended at byte {position} of {end + 1}."), url)
+
+    def _download_segments(self, url: str, part_path: str, size: int):
+        """
+        Downloads the file as parallel ranged segments. The segments are written
+        into a preallocated file that only becomes the .part file once all of
+        them have finished, so a later run never mistakes it for a complete
+        single-stream download.
+        """
+        segments = self.config["parallel_segments"]
+        segment_size = -(-size // segments)
+        segments_path = f"{part_path}.segments"
+        with open(segments_path, "wb") as f:
+            f.truncate(size)
+
+        logging.info(f"Downloading '{url}' ({size} bytes) in {segments} parallel segments")
+        with ThreadPoolExecutor(max_workers=segments, thread_name_prefix="download") as executor:
+            # Each segment runs in a copy of the caller's context so its bytes count towards the current stage
+            futures = [
+                executor.submit(contextvars.copy_context().run, self._download_segment,
+                                url, segments_path, start, min(start + segment_size, size) - 1)
+                for start in range(0, size, segment_size)
+            ]
+            for future in futures:
+                future.result()
+        os.replace(segments_path, part_path)
+
+    def download(self, url: str, path: str, expected_size: Optional[int] = None,
+                 expected_sha256: Optional[str] = None) -> str:
+        """
+        Downloads a file and moves it to its final path once it is verified.
+
+        Args:
+            url: The URL of the file.
+            path: The final path of the downloaded file.
+            expected_size: The expected size in bytes (optional, defaults to the size reported by the server).
+            expected_sha256: The expected SHA-256 hex digest (optional).
+
+        Returns:
+            The final path of the downloaded file.
+
+        Raises:
+            DownloadError: If the file is incomplete or its hash does not match.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # The .part file is named after the URL, so a partial download is only ever resumed from the same source
+        part_path = f"{path}.{make_key(url)[:16]}.part"
+        # Partial files from other URLs are removed once abandoned; a download still writing to them keeps them fresh
+        stale_before = time.time() - self.config["stale_part_seconds"]
+        for stale_path in glob.glob(f"{glob.escape(path)}.*.part*"):
+            try:
+                if stale_path != part_path and os.path.getmtime(stale_path) < stale_before:
+                    os.remove(stale_path)
+            except FileNotFoundError:
+                continue
+
+        size, supports_ranges = (None, False)
+        if self.config["parallel_segments"] > 1 and not os.path.exists(part_path):
+            size, supports_ranges = self._probe(url)
+
+        if supports_ranges and size and size >= self.config["parallel_min_size"]:
+            self._download_segments(url, part_path, size)
+        else:
+            size = self._download_stream(url, part_path) or size
+
+        actual_size = os.path.getsize(part_path)
+        expected_size = expected_size or size
+        if expected_size is not None and actual_size != expected_size:
+            # Keep the .part file only if it can still be resumed
+            if actual_size > expected_size:
+                os.remove(part_path)
+            raise DownloadError(f"Download of '{url}' is incomplete: got {actual_size} of {expected_size} bytes.")
+
+        if expected_sha256:
+            sha256 = hashlib.sha256()
+            with open(part_path, "rb") as f:
+                for block in iter(lambda: f.read(self.config["chunk_size"]), b""):
+                    sha256.update(block)
+            if sha256.hexdigest() != expected_sha256:
+                os.remove(part_path)
+                raise DownloadError(f"Download of '{url}' does not match the expected SHA-256.")
+
+        os.replace(part_path, path)
+        return path
+
+_downloader = None
+_downloader_lock = threading.Lock()
+
+def get_downloader() -> Downloader:
+    """
+    Returns the shared Downloader.
+
+    Returns:
+        The process-wide Downloader instance.
+    """
+    global _downloader
+    with _downloader_lock:
+        if _downloader is None:
+            _downloader = Downloader()
+        return _downloader
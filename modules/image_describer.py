@@ -1,6 +1,60 @@
-import base64
-import openai
-from config import IMAGE_DESCRIBER_CONFIG
+import re
+import asyncio
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from config import IMAGE_DESCRIBER_CONFIG, IMAGE_GENERATOR_CONFIG, DESCRIPTION_CACHE_CONFIG
+from .disk_cache import get_cache, make_key
+from .cpu_pool import encode_data_url, hash_file
+from .clients import get_openai_client, get_async_openai_client
+from .image_preprocessor import normalize_image
+from .scheduler import get_scheduler
+from .streaming import complete_chat, complete_chat_async
+from .openai_batch import OpenAIBatchRunner
+from . import metrics
+
+# Formats the vision API accepts as-is; anything else is re-encoded to JPEG
+PASSTHROUGH_FORMATS = {"JPEG", "PNG", "WEBP", "GIF"}
+
+# The version of the message layout of describe requests (1: instructions in the user message, 2: in the
+# system message); part of the cache key, so descriptions made with an earlier layout are not reused
+REQUEST_LAYOUT = 2
+
+# The line that starts each description in a batched answer ("### Image 2"); stray markdown around it is tolerated
+BATCH_MARKER = re.compile(r"^[#*\s]*Image\s+(\d+)[\s:#*]*$", re.IGNORECASE | re.MULTILINE)
+
+def _image_bytes(request: dict) -> int:
+    """Returns the size of the image data URLs in a chat completion request."""
+    return sum(
+        len(part["image_url"]["url"]) for message in request["messages"] if isinstance(message["content"], list)
+        for part in message["content"] if part["type"] == "image_url"
+    )
+
+def split_batch_descriptions(text: str, count: int) -> dict:
+    """
+    Splits a batched answer into the descriptions of its images.
+
+    Args:
+        text: The completion text with one "### Image N" section per image.
+        count: The number of images in the request.
+
+    Returns:
+        A mapping of image number (1-based) to its description. Images whose
+        section is missing, empty, out of range or repeated are left out.
+    """
+    markers = list(BATCH_MARKER.finditer(text))
+    sections = {}
+    repeated = set()
+    for position, marker in enumerate(markers):
+        end = markers[position + 1].start() if position + 1 < len(markers) else len(text)
+        number = int(marker.group(1))
+        description = text[marker.end():end].strip()
+        if number in sections:
+            repeated.add(number)
+        elif 1 <= number <= count and description:
+            sections[number] = description
+    return {number: description for number, description in sections.items() if number not in repeated}
 
 class ImageDescriber:
     """
@@ -13,60 +67,452 @@ class ImageDescriber:
         self.config = IMAGE_DESCRIBER_CONFIG
         
         if self.config["model_type"] == "local":
-            self.client = openai.OpenAI(
-                base_url=self.config["local_server_url"],
-                api_key="not-needed" # API key is not needed for local server
-            )
+            self.client_args = {
+                "base_url": self.config["local_server_url"],
+                "api_key": "not-needed" # API key is not needed for local server
+            }
         else:
             # Assumes OPENAI_API_KEY is set in the environment for the default client
-            self.client = openai.OpenAI()
+            self.client_args = {}
+        self.client = get_openai_client(**self.client_args)
+        self.scheduler = get_scheduler()
+        self.scheduler.configure(self.config["model_type"], self.config["model_name"], self.config.get("rate_limit"))
+
+        self.cache = None
+        if DESCRIPTION_CACHE_CONFIG["enabled"]:
+            self.cache = get_cache(
+                "descriptions",
+                max_entries=DESCRIPTION_CACHE_CONFIG.get("max_entries"),
+                max_bytes=DESCRIPTION_CACHE_CONFIG.get("max_bytes")
+            )
+
+    def _cache_key(self, image_path: str) -> str:
+        """
+        Builds the description cache key from the image content and every
+        model setting that influences the description.
+
+        Args:
+            image_path: The path to the image file.
+
+        Returns:
+            The cache key.
+        """
+        system_prompt_hash = hashlib.sha256(self.config["system_prompt"].encode("utf-8")).hexdigest()
+        return make_key(
+            hash_file(image_path),
+            self.config["model_name"],
+            self.config["temperature"],
+            self.config["top_p"],
+            self.config.get("max_image_edge"),
+            self._normalize_spec(),
+            system_prompt_hash,
+            REQUEST_LAYOUT
+        )
+
+    def _normalize_spec(self) -> dict:
+        """
+        Returns the conversion applied to images the vision API cannot take as
+        they are. The image generator's upload spec is reused when it fits
+        within max_image_edge, so an input is converted once for both stages
+        and the same cached file is uploaded to OpenAI and Replicate.
+
+        Returns:
+            The spec for normalize_image().
+        """
+        max_edge = self.config.get("max_image_edge", 2048)
+        spec = IMAGE_GENERATOR_CONFIG.get("preprocess")
+        if spec and spec["max_edge"] <= max_edge and spec.get("format", "JPEG").upper() in PASSTHROUGH_FORMATS:
+            return spec
+        return {"max_edge": max_edge, "format": "JPEG", "quality": self.config.get("jpeg_quality", 85)}
 
     def _encode_image(self, image_path: str) -> str:
         """
-        Encodes the image at the given path to a base64 string.
+        Encodes the image at the given path to a base64 data URL.
+
+        Images that are already within max_image_edge and in a format the
+        vision API accepts are streamed from disk unchanged; anything else is
+        converted once and cached (see _normalize_spec and normalize_image).
 
         Args:
             image_path: The path to the image file.
 
         Returns:
-            The base64 encoded image string.
+            The data URL with the correct MIME type.
         """
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        from PIL import Image
+        max_edge = self.config.get("max_image_edge", 2048)
+
+        # Image.open only reads the header here; pixels are loaded on demand
+        with Image.open(image_path) as image:
+            passthrough = max(image.size) <= max_edge and image.format in PASSTHROUGH_FORMATS
+            mime_type = Image.MIME[image.format]
 
-    def describe(self, image_path: str) -> str:
+        if not passthrough:
+            spec = self._normalize_spec()
+            image_path = normalize_image(image_path, spec)
+            mime_type = Image.MIME[spec.get("format", "JPEG").upper()]
+        # Large files are encoded in the CPU process pool
+        return encode_data_url(image_path, mime_type)
+
+    def _build_request(self, image_path: str) -> dict:
         """
-        Analyzes the given image and returns a description of its artistic style.
+        Builds the chat completion arguments for describing the given image.
 
         Args:
             image_path: The path to the image to be analyzed.
 
         Returns:
-            A string containing the detailed description of the image's style.
+            The keyword arguments for chat.completions.create().
         """
-        base64_image = self._encode_image(image_path)
-
-        response = self.client.chat.completions.create(
-            model=self.config["model_name"],
-            messages=[
+        image_url = self._encode_image(image_path)
+        # The instructions go first, in the system role and byte-identical for every image, so the
+        # provider can serve them from its prompt cache; only the image differs between requests
+        return {
+            "model": self.config["model_name"],
+            "messages": [
+                {"role": "system", "content": self.config["system_prompt"]},
                 {
                     "role": "user",
                     "content": [
-                        {   "type": "text",
-                            "text": self.config["system_prompt"]
-                        },
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
+                                "url": image_url
                             }
                         }
                     ]
                 }
             ],
-            temperature=self.config["temperature"],
-            top_p=self.config["top_p"],
-            max_tokens=500
+            "temperature": self.config["temperature"],
+            "top_p": self.config["top_p"],
+            "max_tokens": 500
+        }
+
+    def _build_batch_request(self, image_paths: list) -> dict:
+        """
+        Builds the chat completion arguments for describing several images in
+        one request, so the system prompt is sent once for all of them.
+
+        Args:
+            image_paths: The paths to the images to be analyzed.
+
+        Returns:
+            The keyword arguments for chat.completions.create().
+        """
+        content = [{"type": "text", "text": self.config["batch_prompt"].format(count=len(image_paths))}]
+        for number, image_path in enumerate(image_paths, start=1):
+            content.append({"type": "text", "text": f"Image {number}:"})
+            content.append({"type": "image_url", "image_url": {"url": self._encode_image(image_path)}})
+        return {
+            "model": self.config["model_name"],
+            "messages": [
+                {"role": "system", "content": self.config["system_prompt"]},
+                {"role": "user", "content": content}
+            ],
+            "temperature": self.config["temperature"],
+            "top_p": self.config["top_p"],
+            "max_tokens": 500 * len(image_paths)
+        }
+
+    def _describe_group(self, image_paths: list) -> dict:
+        """
+        Describes a group of images with one batched request.
+
+        Args:
+            image_paths: The paths to the images to be analyzed.
+
+        Returns:
+            A mapping of image path to description for every image whose
+            description could be parsed from the answer.
+        """
+        request = self._build_batch_request(image_paths)
+        metrics.record(bytes_uploaded=_image_bytes(request))
+        text = complete_chat(
+            self.scheduler, self.config["model_type"], self.client.chat.completions.create, request,
+            stream=self.config.get("stream", False), log_label="Style descriptions"
+        )
+        sections = split_batch_descriptions(text, len(image_paths))
+        return {image_paths[number - 1]: description for number, description in sections.items()}
+
+    def describe_with_batch_api(self, image_paths: list, use_cache: bool = True, runner: OpenAIBatchRunner = None) -> dict:
+        """
+        Describes many images through the OpenAI Batch API: one request per
+        uncached image, submitted as a batch job and waited for.
+
+        Args:
+            image_paths: The paths to the images to be analyzed.
+            use_cache: If False, the description cache is neither read nor updated.
+            runner: The batch runner to use (a new one by default).
+
+        Returns:
+            A mapping of image path to its style description. Images whose
+            request failed are left out (describe() can be used for them).
+        """
+        if self.config["model_type"] != "openai":
+            logging.warning("The Batch API is only available for OpenAI models; images are described one by one.")
+            return {}
+
+        descriptions = {}
+        cache_keys = {}
+
+        def requests():
+            # Each request (with its image data URL) is built only when the runner writes it to the batch file
+            for number, image_path in enumerate(image_paths):
+                if self.cache and use_cache:
+                    cache_keys[image_path] = self._cache_key(image_path)
+                    cached_description = self.cache.get(cache_keys[image_path])
+                    if cached_description is not None:
+                        descriptions[image_path] = cached_description
+                        continue
+                yield str(number), self._build_request(image_path)
+
+        results = (runner or OpenAIBatchRunner()).run(requests(), name="describe")
+        for custom_id, description in results.items():
+            image_path = image_paths[int(custom_id)]
+            descriptions[image_path] = description
+            if image_path in cache_keys and description:
+                self.cache.set(cache_keys[image_path], description)
+        return descriptions
+
+    def describe(self, image_path: str, use_cache: bool = True) -> str:
+        """
+        Analyzes the given image and returns a description of its artistic style.
+
+        Args:
+            image_path: The path to the image to be analyzed.
+            use_cache: If False, the description cache is neither read nor updated.
+
+        Returns:
+            A string containing the detailed description of the image's style.
+        """
+        cache_key = None
+        if self.cache and use_cache:
+            cache_key = self._cache_key(image_path)
+            cached_description = self.cache.get(cache_key)
+            if cached_description is not None:
+                logging.info(f"Using cached style description for '{image_path}'.")
+                metrics.record(cache_hits=1)
+                return cached_description
+
+        description = self._describe_uncached(image_path)
+        if cache_key and description:
+            self.cache.set(cache_key, description)
+        return description
+
+    def _describe_uncached(self, image_path: str) -> str:
+        """Describes a single image with its own request."""
+        request = self._build_request(image_path)
+        metrics.record(bytes_uploaded=_image_bytes(request))
+        return complete_chat(
+            self.scheduler, self.config["model_type"], self.client.chat.completions.create, request,
+            stream=self.config.get("stream", False), log_label="Style description"
+        )
+
+    def describe_batched(self, image_path: str, use_cache: bool = True) -> str:
+        """
+        Like describe(), but the request is shared with the images other
+        workers describe at the same time (see DescriptionBatcher). Used by
+        batch jobs; with IMAGE_DESCRIBER_CONFIG["batch_size"] 1 it is describe().
+
+        Args:
+            image_path: The path to the image to be analyzed.
+            use_cache: If False, the description cache is neither read nor updated.
+
+        Returns:
+            A string containing the detailed description of the image's style.
+        """
+        if self.config.get("batch_size", 1) <= 1:
+            return self.describe(image_path, use_cache=use_cache)
+
+        cache_key = None
+        if self.cache and use_cache:
+            cache_key = self._cache_key(image_path)
+            cached_description = self.cache.get(cache_key)
+            if cached_description is not None:
+                logging.info(f"Using cached style description for '{image_path}'.")
+                metrics.record(cache_hits=1)
+                return cached_description
+
+        description, share = get_description_batcher().submit(image_path).result()
+        metrics.record(**share)
+        if description is None:
+            description = self._describe_uncached(image_path)
+        if cache_key and description:
+            self.cache.set(cache_key, description)
+        return description
+
+    async def describe_async(self, image_path: str, use_cache: bool = True) -> str:
+        """
+        Asynchronous version of describe() using the async OpenAI client.
+        Hashing and encoding run in a worker thread so the event loop stays free.
+
+        Args:
+            image_path: The path to the image to be analyzed.
+            use_cache: If False, the description cache is neither read nor updated.
+
+        Returns:
+            A string containing the detailed description of the image's style.
+        """
+        cache_key = None
+        if self.cache and use_cache:
+            cache_key = await asyncio.to_thread(self._cache_key, image_path)
+            cached_description = await asyncio.to_thread(self.cache.get, cache_key)
+            if cached_description is not None:
+                logging.info(f"Using cached style description for '{image_path}'.")
+                metrics.record(cache_hits=1)
+                return cached_description
+
+        description = await self._describe_uncached_async(image_path)
+        if cache_key and description:
+            await asyncio.to_thread(self.cache.set, cache_key, description)
+        return description
+
+    async def _describe_uncached_async(self, image_path: str) -> str:
+        """Asynchronous version of _describe_uncached()."""
+        request = await asyncio.to_thread(self._build_request, image_path)
+        metrics.record(bytes_uploaded=_image_bytes(request))
+        async_client = get_async_openai_client(**self.client_args)
+        return await complete_chat_async(
+            self.scheduler, self.config["model_type"], async_client.chat.completions.create, request,
+            stream=self.config.get("stream", False), log_label="Style description"
         )
 
-        return response.choices[0].message.content 
\ No newline at end of file
+    async def describe_batched_async(self, image_path: str, use_cache: bool = True) -> str:
+        """
+        Asynchronous version of describe_batched(); waiting for the group does
+        not block the event loop.
+
+        Args:
+            image_path: The path to the image to be analyzed.
+            use_cache: If False, the description cache is neither read nor updated.
+
+        Returns:
+            A string containing the detailed description of the image's style.
+        """
+        if self.config.get("batch_size", 1) <= 1:
+            return await self.describe_async(image_path, use_cache=use_cache)
+
+        cache_key = None
+        if self.cache and use_cache:
+            cache_key = await asyncio.to_thread(self._cache_key, image_path)
+            cached_description = await asyncio.to_thread(self.cache.get, cache_key)
+            if cached_description is not None:
+                logging.info(f"Using cached style description for '{image_path}'.")
+                metrics.record(cache_hits=1)
+                return cached_description
+
+        description, share = await asyncio.wrap_future(get_description_batcher().submit(image_path))
+        metrics.record(**share)
+        if description is None:
+            description = await self._describe_uncached_async(image_path)
+        if cache_key and description:
+            await asyncio.to_thread(self.cache.set, cache_key, description)
+        return description
+
+# Stage counters that belong to the waiting image itself rather than to the shared request
+PER_IMAGE_METRICS = {"wall_seconds", "calls"}
+
+class DescriptionBatcher:
+    """
+    Collects the describe requests of images processed at the same time and
+    sends them as multi-image requests: a group is flushed as soon as it holds
+    batch_size images, or batch_wait_seconds after its first image arrived.
+    Each image continues its pipeline as soon as its group is answered.
+
+    The usage of a group request (tokens, cost, uploaded bytes, retries) is
+    split evenly between its images, so it shows up in their runs. An image
+    that is alone in its group, or whose description is missing from the
+    answer, is described by its caller with a regular request.
+    """
+    def __init__(self, describer: ImageDescriber):
+        """
+        Initializes the batcher with configuration from config.py.
+
+        Args:
+            describer: The describer that sends the group requests.
+        """
+        self.describer = describer
+        self.batch_size = describer.config["batch_size"]
+        self.wait_seconds = describer.config.get("batch_wait_seconds", 0.5)
+        self.executor = ThreadPoolExecutor(max_workers=describer.config.get("batch_workers", 4), thread_name_prefix="describe")
+        self._pending = []
+        self._generation = 0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def submit(self, image_path: str) -> Future:
+        """
+        Adds an image to the current group.
+
+        Args:
+            image_path: The path to the image to be analyzed.
+
+        Returns:
+            A future resolving to the description (None if the caller has to
+            describe the image itself) and the image's share of the group usage.
+        """
+        future = Future()
+        with self._lock:
+            self._pending.append((image_path, future))
+            if len(self._pending) >= self.batch_size:
+                self._flush_locked()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.wait_seconds, self._flush, args=(self._generation,))
+                self._timer.daemon = True
+                self._timer.start()
+        return future
+
+    def _flush(self, generation: int):
+        with self._lock:
+            # A timer that fires after its group was flushed by size must not cut the next group short
+            if generation == self._generation:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        group, self._pending = self._pending, []
+        self._generation += 1
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if len(group) == 1:
+            group[0][1].set_result((None, {}))
+        elif group:
+            self.executor.submit(self._run, group)
+
+    def _run(self, group: list):
+        """Sends the request of a group and resolves the futures of its images."""
+        image_paths = [image_path for image_path, _ in group]
+        run_metrics = metrics.RunMetrics()
+        try:
+            with run_metrics.stage("describe"):
+                described = self.describer._describe_group(image_paths)
+        except Exception as e:
+            logging.warning(f"Batched description of {len(group)} images failed ({e}); describing them one by one.")
+            described = {}
+        totals = run_metrics.to_dict().get("describe", {})
+        # Every image waited for the first token of the shared answer, so that latency is not split
+        share = {
+            name: value if name == "time_to_first_token_seconds" else value / len(group)
+            for name, value in totals.items() if name not in PER_IMAGE_METRICS
+        }
+        for image_path, future in group:
+            if image_path not in described:
+                logging.warning(f"No description for '{image_path}' in the batched answer; describing it on its own.")
+            future.set_result((described.get(image_path), share))
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+def get_description_batcher() -> DescriptionBatcher:
+    """
+    Returns the process-wide DescriptionBatcher, so images processed by
+    different workers (or tasks) share their requests.
+
+    Returns:
+        The shared DescriptionBatcher.
+    """
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = DescriptionBatcher(ImageDescriber())
+        return _batcher
@@ -1,88 +1,260 @@
 import os
-import requests
-import replicate
-from config import IMAGE_GENERATOR_CONFIG, IMAGE_DIR
+import asyncio
+from typing import Optional
+from config import IMAGE_GENERATOR_CONFIG, IMAGE_PREVIEW_CONFIG, IMAGE_DIR, GENERATION_STORE_CONFIG
+from .downloader import get_downloader
+from .image_preprocessor import normalize_image
+from .disk_cache import get_file_cache, make_key
+from .cpu_pool import hash_file
+from .prediction_manager import API_RATE_LIMIT_KEY, PredictionError, get_prediction_manager
+from . import metrics
 import logging
 
 class ImageGenerator:
     """
     Generates an image using the Replicate API based on a given prompt.
     """
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, preview: bool = False):
         """
         Initializes the ImageGenerator with configuration from config.py.
+
+        Args:
+            api_key: The Replicate API key.
+            preview: If True, the faster preview tier (IMAGE_PREVIEW_CONFIG) is used.
         """
         if not api_key:
             raise ValueError("Replicate API key is required.")
-        self.config = IMAGE_GENERATOR_CONFIG
-        self.client = replicate.Client(api_token=api_key)
+        self.config = {**IMAGE_GENERATOR_CONFIG, **IMAGE_PREVIEW_CONFIG} if preview else IMAGE_GENERATOR_CONFIG
+        self.predictions = get_prediction_manager(api_key)
+        self.predictions.scheduler.configure("replicate", self.config["model"], self.config.get("rate_limit"))
+
+        self.store = None
+        if GENERATION_STORE_CONFIG["enabled"]:
+            self.store = get_file_cache(
+                "generations",
+                max_bytes=GENERATION_STORE_CONFIG.get("max_bytes"),
+                max_entries=GENERATION_STORE_CONFIG.get("max_entries"),
+                grace_seconds=GENERATION_STORE_CONFIG.get("grace_seconds", 0)
+            )
+
+    def _build_input(self, prompt: str, input_image_file=None, seed: int = None) -> dict:
+        """
+        Prepares the input parameters for the Replicate model.
+
+        Args:
+            prompt: The prompt to use for image generation.
+            input_image_file: An open binary file handle or an uploaded file URL of the input image (optional).
+            seed: Overrides the configured seed (optional).
+
+        Returns:
+            The input dictionary for the Replicate model.
+        """
+        input_params = {
+            "prompt": prompt,
+            "seed": seed if seed is not None else self.config.get('seed'),
+            "aspect_ratio": self.config.get('aspect_ratio'),
+            "output_format": self.config.get('output_format'),
+        }
+        if self.config.get('safety_tolerance') is not None:
+            input_params["safety_tolerance"] = self.config.get('safety_tolerance')
+        # Parameters only some models accept, e.g. the step count of the preview model
+        input_params.update(self.config.get('input', {}))
+
+        # For image-to-image models, pass the opened input image
+        if input_image_file:
+            input_params["input_image"] = input_image_file
+
+        return input_params
+
+    def _prediction_key(self, prompt: str, output_name: str, input_image_path: str = None, seed: int = None,
+                        input_image_hash: str = None) -> str:
+        """
+        Builds the idempotency key that lets a restarted run reattach to a
+        prediction that is still running for the same request.
+
+        Args:
+            prompt: The prompt to use for image generation.
+            output_name: The filename for the output image (without extension).
+            input_image_path: The path to the input image file (optional).
+            seed: Overrides the configured seed (optional).
+            input_image_hash: The precomputed hash of the input image (optional).
+
+        Returns:
+            The prediction key.
+        """
+        if input_image_path and not input_image_hash:
+            input_image_hash = hash_file(input_image_path)
+        return make_key(self.config["model"], self._build_input(prompt, seed=seed), input_image_hash,
+                        self.config.get("preprocess"), output_name)
+
+    def _store_key(self, prompt: str, input_image_hash: str = None, seed: int = None) -> Optional[str]:
+        """
+        Builds the generation store key from the model, all input parameters
+        and the input image content. The output name is deliberately left out,
+        so identical requests for different files share one stored image.
+
+        Args:
+            prompt: The prompt to use for image generation.
+            input_image_hash: The hash of the input image (optional).
+            seed: Overrides the configured seed (optional).
+
+        Returns:
+            The store key, or None if the store is disabled or there is no
+            fixed seed (the output would not be reproducible).
+        """
+        input_params = self._build_input(prompt, seed=seed)
+        if self.store is None or input_params["seed"] is None:
+            return None
+        return make_key(self.config["model"], input_params, input_image_hash, self.config.get("preprocess"))
+
+    def _output_path(self, output_name: str) -> str:
+        return os.path.join(IMAGE_DIR, f"{output_name}.{self.config.get('output_format', 'png')}")
+
+    def _from_store(self, store_key: Optional[str], output_name: str) -> Optional[str]:
+        """
+        Copies a stored image for an identical earlier request to the image directory.
+
+        Args:
+            store_key: The key built by _store_key().
+            output_name: The filename for the output image (without extension).
+
+        Returns:
+            The path to the image file, or None if no image is stored for the request.
+        """
+        if not store_key:
+            return None
+        image_path = self.store.get(store_key, self.config.get("output_format", "png"), self._output_path(output_name))
+        if image_path:
+            logging.info(f"Reusing stored image for an identical request: '{image_path}'")
+            metrics.record(cache_hits=1)
+        return image_path
+
+    def _to_store(self, store_key: Optional[str], image_path: str):
+        """Keeps a copy of a freshly generated image for identical future requests."""
+        if store_key:
+            self.store.put(store_key, self.config.get("output_format", "png"), image_path)
+
+    def _prepare_input_image(self, input_image_path: str, input_image_hash: str = None) -> str:
+        """
+        Returns the input image as the model uses it (see IMAGE_GENERATOR_CONFIG["preprocess"]),
+        converted once per input and cached.
+
+        Args:
+            input_image_path: The path to the input image file.
+            input_image_hash: The precomputed hash of the input image (optional).
+
+        Returns:
+            The path to the file to upload.
+        """
+        upload_path = normalize_image(input_image_path, self.config.get("preprocess"), input_image_hash)
+        metrics.record(bytes_uploaded=os.path.getsize(upload_path))
+        return upload_path
+
+    def _upload_input_image(self, input_image_path: str) -> str:
+        """
+        Uploads the input image to Replicate once so that several predictions
+        can reference it by URL instead of each uploading its own copy.
+
+        Args:
+            input_image_path: The path to the (prepared) input image file.
+
+        Returns:
+            The URL of the uploaded file.
+        """
+        def upload():
+            with open(input_image_path, "rb") as input_image_file:
+                return self.predictions.client.files.create(input_image_file)
+
+        uploaded_file = self.predictions.scheduler.call("replicate", API_RATE_LIMIT_KEY, upload, idempotent=False)
+        return uploaded_file.urls["get"]
+
+    def _download_output(self, output, output_name: str) -> str:
+        """
+        Downloads the image produced by a prediction to the image directory.
+
+        Args:
+            output: The prediction output (a URL or a list of URLs).
+            output_name: The filename for the output image (without extension).
+
+        Returns:
+            The path to the saved image file.
+        """
+        image_url = output[0] if isinstance(output, list) else output
+        image_path = get_downloader().download(str(image_url), self._output_path(output_name))
 
-    def generate(self, prompt: str, output_name: str, input_image_path: str = None) -> str:
+        logging.info(f"Image successfully downloaded and saved to '{image_path}'")
+        return image_path
+
+    def generate(self, prompt: str, output_name: str, input_image_path: str = None,
+                 prediction_id: str = None, on_submit=None, use_store: bool = True) -> str:
         """
-        Generates an image and saves it to the image directory.
+        Generates an image and saves it to the image directory. If an identical
+        request was generated before, the stored image is used instead.
 
         Args:
             prompt: The prompt to use for image generation.
             output_name: The filename for the output image (without extension).
-            input_image_path: The path to the input image file (optional, currently unused).
+            input_image_path: The path to the input image file (optional).
+            prediction_id: An earlier prediction to reattach to instead of submitting a new one (optional).
+            on_submit: Called with the prediction ID once it is submitted (optional).
+            use_store: If False, the generation store is neither read nor updated.
 
         Returns:
             The path to the generated image file.
         """
+        # The SDKs are only needed once a generation runs, so they are imported here instead of at startup
+        import replicate
+        import requests
         logging.info(f"Generating image with prompt: '{prompt}'")
 
         try:
-            # Prepare input parameters for the Replicate model
-            input_params = {
-                "prompt": prompt,
-                "seed": self.config.get('seed'),
-                "aspect_ratio": self.config.get('aspect_ratio'),
-                "output_format": self.config.get('output_format'),
-                "safety_tolerance": self.config.get('safety_tolerance'),
-            }
-
-            # For image-to-image models, open the input image and pass it
+            input_image_hash = hash_file(input_image_path) if input_image_path else None
+            store_key = self._store_key(prompt, input_image_hash) if use_store else None
+            stored_image_path = self._from_store(store_key, output_name)
+            if stored_image_path:
+                return stored_image_path
+
+            input_image_file = None
             if input_image_path:
                 logging.info(f"Using input image: {input_image_path}")
                 # The replicate library expects a file-like object, so we open it in binary read mode
-                input_image_file = open(input_image_path, "rb")
-                input_params["input_image"] = input_image_file
+                input_image_file = open(self._prepare_input_image(input_image_path, input_image_hash), "rb")
             else:
                 # Handle case where no input image is provided for an img2img model
                 # Depending on the model, this might be an error or fallback to text-to-image
                 logging.warning("No input image provided for an image-to-image generation process.")
 
-
-            # Run the model on Replicate
+            # Submit the prediction on Replicate and poll until it finishes
             try:
-                output = self.client.run(
+                output = self.predictions.run(
                     self.config["model"],
-                    input=input_params
+                    input=self._build_input(prompt, input_image_file),
+                    key=self._prediction_key(prompt, output_name, input_image_path, input_image_hash=input_image_hash),
+                    prediction_id=prediction_id,
+                    on_submit=on_submit
                 )
             finally:
                 # Ensure the file is closed after the API call
-                if 'input_image' in input_params and input_params['input_image']:
-                    input_params['input_image'].close()
-            
+                if input_image_file:
+                    input_image_file.close()
+
             if not output:
                 raise Exception("Image generation failed. No output from Replicate API.")
 
             logging.info("Image generation complete. Saving file...")
 
-            # The output from replicate.run is a FileOutput object.
-            # Use its .read() method to get the binary content directly.
-            image_data = output.read()
-            
-            # Save the image
-            image_filename = f"{output_name}.{self.config.get('output_format', 'png')}"
-            image_path = os.path.join(IMAGE_DIR, image_filename)
-
-            with open(image_path, 'wb') as f:
-                f.write(image_data)
-            
-            logging.info(f"Image successfully downloaded and saved to '{image_path}'")
+            # The prediction output is the URL of the generated image
+            image_path = self._download_output(output, output_name)
+            self._to_store(store_key, image_path)
             return image_path
 
+        except PredictionError as e:
+            if e.status == "canceled":
+                # Canceled on purpose, e.g. a discarded speculative run
+                logging.info(f"Image generation canceled: {e}")
+            else:
+                logging.error(f"Replicate prediction failed during image generation: {e}")
+            raise
         except replicate.exceptions.ReplicateError as e:
             logging.error(f"Replicate API error during image generation: {e}")
             raise
@@ -91,4 +263,142 @@ class ImageGenerator:
             raise
         except Exception as e:
             logging.error(f"An unexpected error occurred during image generation: {e}")
-            raise 
\ No newline at end of file
+            raise
+
+    def generate_variants(self, prompt: str, output_name: str, input_image_path: str = None, count: int = None,
+                          seeds: list = None, prompts: list = None, use_store: bool = True) -> list:
+        """
+        Generates several candidate images concurrently and saves each under its
+        own name ({output_name}_v1, {output_name}_v2, ...).
+
+        All predictions are submitted at once and polled together, so the
+        wall time is close to that of a single generation.
+
+        Args:
+            prompt: The prompt to use for image generation.
+            output_name: The base filename for the output images (without extension).
+            input_image_path: The path to the input image file (optional).
+            count: The number of variants (defaults to IMAGE_GENERATOR_CONFIG["variants"]).
+            seeds: The seed for each variant (defaults to the configured seed + i).
+            prompts: A prompt for each variant (defaults to the same prompt for all).
+            use_store: If False, the generation store is neither read nor updated.
+
+        Returns:
+            The paths to the generated images, in variant order. Variants whose
+            prediction failed are left out.
+        """
+        import replicate
+        import requests
+        prompts = prompts or [prompt] * (count or self.config.get("variants", 4))
+        base_seed = self.config.get("seed") or 0
+        seeds = seeds or [base_seed + i for i in range(len(prompts))]
+        logging.info(f"Generating {len(prompts)} image variants with seeds {seeds}")
+
+        try:
+            input_image_hash = hash_file(input_image_path) if input_image_path else None
+
+            # Variants generated by an identical earlier request come from the store
+            image_paths = {}
+            store_keys = {}
+            for index, (variant_prompt, seed) in enumerate(zip(prompts, seeds), start=1):
+                store_keys[index] = self._store_key(variant_prompt, input_image_hash, seed=seed) if use_store else None
+                stored_image_path = self._from_store(store_keys[index], f"{output_name}_v{index}")
+                if stored_image_path:
+                    image_paths[index] = stored_image_path
+
+            missing = [index for index in store_keys if index not in image_paths]
+            input_image_url = None
+            if missing and input_image_path:
+                input_image_url = self._upload_input_image(self._prepare_input_image(input_image_path, input_image_hash))
+
+            prediction_ids = {}
+            for index in missing:
+                variant_prompt, seed = prompts[index - 1], seeds[index - 1]
+                prediction_ids[index] = self.predictions.submit(
+                    self.config["model"],
+                    input=self._build_input(variant_prompt, input_image_url, seed=seed),
+                    key=self._prediction_key(variant_prompt, f"{output_name}_v{index}", seed=seed,
+                                             input_image_hash=input_image_hash)
+                )
+
+            outputs = self.predictions.wait_all(list(prediction_ids.values()), return_exceptions=True)
+
+            for index, prediction_id in prediction_ids.items():
+                output = outputs[prediction_id]
+                if isinstance(output, PredictionError) or not output:
+                    logging.warning(f"Variant {index} failed: {output}")
+                    continue
+                image_paths[index] = self._download_output(output, f"{output_name}_v{index}")
+                self._to_store(store_keys[index], image_paths[index])
+            image_paths = [image_paths[index] for index in sorted(image_paths)]
+
+            if not image_paths:
+                raise Exception("Image generation failed. No variant produced an output.")
+            return image_paths
+
+        except replicate.exceptions.ReplicateError as e:
+            logging.error(f"Replicate API error during variant generation: {e}")
+            raise
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Failed to download a generated variant: {e}")
+            raise
+
+    async def generate_async(self, prompt: str, output_name: str, input_image_path: str = None,
+                             prediction_id: str = None, on_submit=None, use_store: bool = True) -> str:
+        """
+        Asynchronous version of generate(); polling does not block the event loop.
+
+        Args:
+            prompt: The prompt to use for image generation.
+            output_name: The filename for the output image (without extension).
+            input_image_path: The path to the input image file (optional).
+            prediction_id: An earlier prediction to reattach to instead of submitting a new one (optional).
+            on_submit: Called with the prediction ID once it is submitted (optional).
+            use_store: If False, the generation store is neither read nor updated.
+
+        Returns:
+            The path to the generated image file.
+        """
+        import replicate
+        logging.info(f"Generating image with prompt: '{prompt}'")
+
+        try:
+            input_image_hash = await asyncio.to_thread(hash_file, input_image_path) if input_image_path else None
+            store_key = self._store_key(prompt, input_image_hash) if use_store else None
+            stored_image_path = await asyncio.to_thread(self._from_store, store_key, output_name)
+            if stored_image_path:
+                return stored_image_path
+
+            key = self._prediction_key(prompt, output_name, input_image_path, input_image_hash=input_image_hash)
+            input_image_file = None
+            if input_image_path:
+                upload_path = await asyncio.to_thread(self._prepare_input_image, input_image_path, input_image_hash)
+                input_image_file = open(upload_path, "rb")
+            try:
+                output = await self.predictions.run_async(
+                    self.config["model"],
+                    input=self._build_input(prompt, input_image_file),
+                    key=key,
+                    prediction_id=prediction_id,
+                    on_submit=on_submit
+                )
+            finally:
+                if input_image_file:
+                    input_image_file.close()
+
+            if not output:
+                raise Exception("Image generation failed. No output from Replicate API.")
+
+            image_path = await asyncio.to_thread(self._download_output, output, output_name)
+            await asyncio.to_thread(self._to_store, store_key, image_path)
+            return image_path
+
+        except PredictionError as e:
+            logging.error(f"Replicate prediction failed during image generation: {e}")
+            raise
+        except replicate.exceptions.ReplicateError as e:
+            logging.error(f"Replicate API error during image generation: {e}")
+            raise
+        except Exception as e:
+            logging.error(f"An unexpected error occurred during image generation: {e}")
+            raise
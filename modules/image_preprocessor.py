@@ -0,0 +1,72 @@
+import os
+import logging
+import threading
+from typing import Optional
+from config import NORMALIZED_IMAGE_CACHE_CONFIG
+from .disk_cache import get_file_cache, make_key
+from .cpu_pool import hash_file, run_cpu
+from . import metrics
+
+# File extensions of the formats Pillow writes for the preprocess "format" setting
+FORMAT_EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+
+def _cache():
+    return get_file_cache("normalized", max_bytes=NORMALIZED_IMAGE_CACHE_CONFIG.get("max_bytes"),
+                          grace_seconds=NORMALIZED_IMAGE_CACHE_CONFIG.get("grace_seconds", 0))
+
+def _convert(image_path: str, output_path: str, spec: dict):
+    """Converts an image to the spec and writes it without metadata (runs in a worker process)."""
+    from PIL import Image, ImageOps
+    image_format = spec.get("format", "JPEG").upper()
+    max_edge = spec["max_edge"]
+    with Image.open(image_path) as image:
+        # Let the JPEG decoder scale down while decoding instead of loading full resolution
+        image.draft("RGB", (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge))
+        if image_format == "JPEG" and image.mode != "RGB":
+            image = image.convert("RGB")
+
+        save_args = {"quality": spec["quality"]} if "quality" in spec and image_format != "PNG" else {}
+        # No exif/icc_profile/pnginfo arguments are passed, so no metadata is written
+        image.save(output_path, format=image_format, **save_args)
+
+def normalize_image(image_path: str, spec: Optional[dict], image_hash: Optional[str] = None) -> str:
+    """
+    Returns a copy of an image converted to what a model actually uses: at most
+    spec["max_edge"] pixels on the long side, in spec["format"], with EXIF
+    orientation applied and all metadata stripped.
+
+    The result is cached by the image content and the spec, so every input is
+    converted once and the same file is reused by every stage with that spec.
+
+    Args:
+        image_path: The path to the original image.
+        spec: A dict with "max_edge", "format" and "quality" (JPEG/WEBP only).
+            If None, the original path is returned unchanged.
+        image_hash: The precomputed SHA-256 of the image (optional).
+
+    Returns:
+        The path to the normalized image.
+    """
+    if not spec:
+        return image_path
+
+    image_format = spec.get("format", "JPEG").upper()
+    extension = FORMAT_EXTENSIONS[image_format]
+    key = make_key(image_hash or hash_file(image_path), spec)
+    cache = _cache()
+    normalized_path = cache.lookup(key, extension)
+    if normalized_path:
+        return normalized_path
+
+    # Decoding and resizing run in the CPU process pool; only the paths cross the process boundary
+    temp_path = os.path.join(cache.directory, f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+    run_cpu(_convert, image_path, temp_path, spec)
+
+    normalized_path = cache.put(key, extension, temp_path, move=True)
+    original_size = os.path.getsize(image_path)
+    normalized_size = os.path.getsize(normalized_path)
+    metrics.record(preprocess_bytes_saved=original_size - normalized_size)
+    logging.info(f"Normalized '{image_path}' for upload: {original_size // 1024} KB -> {normalized_size // 1024} KB.")
+    return normalized_path
@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from typing import Optional
+from config import STATE_DIR
+
+JOB_STATUSES = ("queued", "running", "completed", "failed")
+
+class JobQueue:
+    """
+    A durable FIFO work queue stored in SQLite.
+
+    Jobs survive restarts: a job that was running when the process stopped is
+    put back in the queue on startup, and the pipeline checkpoints let it
+    continue from its last completed stage.
+    """
+    def __init__(self, db_path: Optional[str] = None):
+        """
+        Opens (and if needed creates) the queue database.
+
+        Args:
+            db_path: The SQLite file (defaults to STATE_DIR/jobs.sqlite3).
+        """
+        self.db_path = db_path or os.path.join(STATE_DIR, "jobs.sqlite3")
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._local = threading.local()
+        self._available = threading.Condition()
+        with self._connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    input_path TEXT NOT NULL,
+                    options TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Returns this thread's connection; SQLite connections must not be shared between threads."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            # WAL lets status reads run while a worker is writing
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def _to_dict(self, row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job["options"] = json.loads(job["options"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def submit(self, input_path: str, **options) -> str:
+        """
+        Adds a job to the end of the queue.
+
+        Args:
+            input_path: The full path to the input image.
+            **options: Options passed to the pipeline, e.g. create_video=True.
+
+        Returns:
+            The job ID.
+        """
+        job_id = uuid.uuid4().hex
+        self._connect().execute(
+            "INSERT INTO jobs (id, status, input_path, options, created_at) VALUES (?, 'queued', ?, ?, ?)",
+            (job_id, input_path, json.dumps(options), time.time())
+        )
+        with self._available:
+            self._available.notify()
+        logging.info(f"Queued job {job_id} for '{os.path.basename(input_path)}'.")
+        return job_id
+
+    def claim(self, timeout: float = None) -> Optional[dict]:
+        """
+        Takes the oldest queued job and marks it as running.
+
+        Args:
+            timeout: Seconds to wait for a job if the queue is empty (no waiting if None).
+
+        Returns:
+            The job, or None if no job became available.
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            connection = self._connect()
+            # BEGIN IMMEDIATE takes the write lock, so two workers never claim the same job
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row:
+                    connection.execute(
+                        "UPDATE jobs SET status = 'running', started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                        (time.time(), row["id"])
+                    )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            if row:
+                job = self._to_dict(row)
+                job["status"] = "running"
+                return job
+
+            remaining = deadline - time.monotonic() if deadline else 0
+            if remaining <= 0:
+                return None
+            with self._available:
+                self._available.wait(remaining)
+
+    def finish(self, job_id: str, result: dict):
+        """
+        Stores the outcome of a job.
+
+        Args:
+            job_id: The job ID.
+            result: The finished pipeline record; its "status" decides whether
+                the job completed or failed.
+        """
+        status = "completed" if result and result.get("status") == "completed" else "failed"
+        error = (result or {}).get("error") if status == "failed" else None
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+            (status, json.dumps(result, ensure_ascii=False), error, time.time(), job_id)
+        )
+
+    def fail(self, job_id: str, error: str):
+        """
+        Marks a job as failed without a pipeline record.
+
+        Args:
+            job_id: The job ID.
+            error: The error message.
+        """
+        self._connect().execute(
+            "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+            (error, time.time(), job_id)
+        )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """
+        Returns a job by ID.
+
+        Args:
+            job_id: The job ID.
+
+        Returns:
+            The job, or None if it does not exist.
+        """
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def position(self, job_id: str) -> Optional[int]:
+        """
+        Returns how many queued jobs are ahead of a queued job.
+
+        Args:
+            job_id: The job ID.
+
+        Returns:
+            The number of jobs ahead, or None if the job is not queued.
+        """
+        job = self.get(job_id)
+        if not job or job["status"] != "queued":
+            return None
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < ?", (job["created_at"],)
+        ).fetchone()
+        return row[0]
+
+    def counts(self) -> dict:
+        """
+        Returns the number of jobs per status.
+
+        Returns:
+            A mapping of status to job count.
+        """
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in JOB_STATUSES}
+        counts.update({row[0]: row[1] for row in rows})
+        return counts
+
+    def requeue_running(self) -> int:
+        """
+        Puts jobs left running by a stopped process back in the queue. Must be
+        called before any worker of this process starts.
+
+        Returns:
+            The number of requeued jobs.
+        """
+        cursor = self._connect().execute("UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'")
+        if cursor.rowcount:
+            logging.info(f"Requeued {cursor.rowcount} interrupted jobs.")
+        return cursor.rowcount
@@ -1,23 +1,93 @@
 import json
 import os
+import threading
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional
+from typing import Iterator, Optional
 from config import LOG_DIR
 
+try:
+    import fcntl
+except ImportError:
+    # Windows: dopisywanie w trybie O_APPEND bez blokady między procesami
+    fcntl = None
+
 class JSONLogger:
     """
-    Klasa do logowania informacji o procesie przetwarzania obrazów w formacie JSON.
+    Klasa do logowania informacji o procesie przetwarzania obrazów w formacie JSON Lines.
+
+    Każdy zakończony proces to jedna linia dopisywana na końcu pliku, więc zapis
+    nie zależy od rozmiaru logu, a równoległe procesy nie nadpisują swoich wpisów.
     """
+
+    # Blokada w obrębie procesu - flock chroni przed innymi procesami
+    _write_lock = threading.Lock()
     
-    def __init__(self, log_filename: str = "process_log.json"):
+    def __init__(self, log_filename: str = "process_log.jsonl"):
         """
         Inicjalizuje JSONLogger.
         
         Args:
-            log_filename: Nazwa pliku JSON do zapisywania logów
+            log_filename: Nazwa pliku JSON Lines do zapisywania logów
         """
         self.log_file_path = os.path.join(LOG_DIR, log_filename)
+        os.makedirs(LOG_DIR, exist_ok=True)
+        self.legacy_log_file_path = os.path.splitext(self.log_file_path)[0] + ".json"
         self.current_process = {}
+        self._migrate_legacy_log()
+
+    @contextmanager
+    def _append_fd(self):
+        """
+        Otwiera plik logu do dopisywania z wyłączną blokadą.
+
+        Yields:
+            Deskryptor pliku otwartego w trybie O_APPEND
+        """
+        with self._write_lock:
+            fd = os.open(self.log_file_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                yield fd
+            finally:
+                # Zamknięcie deskryptora zwalnia również blokadę flock
+                os.close(fd)
+
+    def _append_records(self, fd: int, records: list):
+        """
+        Dopisuje wpisy jako linie JSON jednym wywołaniem zapisu.
+
+        Args:
+            fd: Deskryptor z _append_fd()
+            records: Lista wpisów do zapisania
+        """
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf-8")
+        view = memoryview(data)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+
+    def _migrate_legacy_log(self):
+        """
+        Jednorazowo przenosi wpisy ze starego pliku z tablicą JSON do pliku JSON Lines.
+        Stary plik zostaje zachowany z rozszerzeniem .migrated.
+        """
+        if not os.path.exists(self.legacy_log_file_path):
+            return
+
+        with self._append_fd() as fd:
+            # Inny proces mógł już wykonać migrację, gdy czekaliśmy na blokadę
+            if not os.path.exists(self.legacy_log_file_path):
+                return
+            try:
+                with open(self.legacy_log_file_path, 'r', encoding='utf-8') as f:
+                    legacy_logs = json.load(f)
+            except (json.JSONDecodeError, FileNotFoundError):
+                legacy_logs = []
+            if isinstance(legacy_logs, list) and legacy_logs:
+                self._append_records(fd, legacy_logs)
+            os.replace(self.legacy_log_file_path, self.legacy_log_file_path + ".migrated")
         
     def start_process(self, input_filename: str):
         """
@@ -73,6 +143,15 @@ class JSONLogger:
         """
         self.current_process["output_image"] = os.path.basename(image_path)
     
+    def log_variant_images(self, image_paths: list):
+        """
+        Zapisuje ścieżki do wszystkich wygenerowanych wariantów obrazu.
+        
+        Args:
+            image_paths: Lista ścieżek do wariantów
+        """
+        self.current_process["variant_images"] = [os.path.basename(path) for path in image_paths]
+    
     def log_output_video(self, video_path: str):
         """
         Zapisuje ścieżkę do wygenerowanego wideo.
@@ -82,43 +161,53 @@ class JSONLogger:
         """
         self.current_process["output_video"] = os.path.basename(video_path)
     
-    def finish_process(self, success: bool = True):
+    def log_metrics(self, metrics: dict):
+        """
+        Zapisuje metryki poszczególnych etapów (czasy, bajty, tokeny, koszty).
+        
+        Args:
+            metrics: Słownik metryk z RunMetrics.to_dict()
+        """
+        self.current_process["metrics"] = metrics
+    
+    def finish_process(self, success: bool = True, error_message: Optional[str] = None) -> dict:
         """
         Kończy proces i zapisuje dane do pliku JSON.
         
         Args:
             success: Czy proces zakończył się sukcesem
+            error_message: Opcjonalny opis błędu dla nieudanego procesu
+
+        Returns:
+            Kopia zapisanego wpisu logu
         """
         self.current_process["status"] = "completed" if success else "failed"
         self.current_process["completed_at"] = datetime.now().isoformat()
+        if error_message:
+            self.current_process["error"] = error_message
+        record = self.current_process.copy()
         
-        # Wczytaj istniejące logi lub utwórz nową listę
-        logs = []
-        if os.path.exists(self.log_file_path):
-            try:
-                with open(self.log_file_path, 'r', encoding='utf-8') as f:
-                    logs = json.load(f)
-            except (json.JSONDecodeError, FileNotFoundError):
-                logs = []
-        
-        # Dodaj nowy log
-        logs.append(self.current_process.copy())
-        
-        # Zapisz do pliku
-        with open(self.log_file_path, 'w', encoding='utf-8') as f:
-            json.dump(logs, f, indent=2, ensure_ascii=False)
+        # Dopisz jedną linię na końcu pliku
+        with self._append_fd() as fd:
+            self._append_records(fd, [record])
+
+        return record
     
-    def get_all_logs(self) -> list:
+    def get_all_logs(self) -> Iterator[dict]:
         """
-        Zwraca wszystkie zapisane logi.
+        Zwraca wszystkie zapisane logi, wczytując plik linia po linii.
         
         Returns:
-            Lista wszystkich logów
-        """
-        if os.path.exists(self.log_file_path):
-            try:
-                with open(self.log_file_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, FileNotFoundError):
-                return []
-        return [] 
\ No newline at end of file
+            Iterator po wszystkich logach (uszkodzone linie są pomijane)
+        """
+        if not os.path.exists(self.log_file_path):
+            return
+        with open(self.log_file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
@@ -0,0 +1,237 @@
+import os
+import time
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Optional
+from config import METRICS_CONFIG, LOG_DIR
+
+# The run and stage being measured. Context variables follow each worker thread
+# and each asyncio task, so concurrent images never mix their numbers.
+_current_run = ContextVar("current_run", default=None)
+_current_stage = ContextVar("current_stage", default=None)
+
+class RunMetrics:
+    """
+    Collects per-stage metrics for one pipeline run (one input image).
+    """
+    def __init__(self):
+        """Initializes an empty set of stage metrics."""
+        self.stages = defaultdict(lambda: defaultdict(float))
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, **values: float):
+        """
+        Adds values to the counters of a stage.
+
+        Args:
+            stage: The stage name.
+            **values: The amounts to add, e.g. bytes_uploaded=1024.
+        """
+        with self._lock:
+            for name, value in values.items():
+                self.stages[stage][name] += value
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Measures the wall time of a stage. Time spent in a nested stage is
+        counted for the nested stage only.
+
+        Args:
+            name: The stage name.
+        """
+        parent = _current_stage.get()
+        stage_token = _current_stage.set(name)
+        run_token = _current_run.set(self)
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - start
+            self.add(name, wall_seconds=elapsed, calls=1)
+            if parent:
+                self.add(parent, wall_seconds=-elapsed)
+            _current_stage.reset(stage_token)
+            _current_run.reset(run_token)
+
+    def to_dict(self) -> dict:
+        """
+        Returns the metrics as plain dictionaries for the JSON log.
+
+        Returns:
+            A mapping of stage name to its rounded counters.
+        """
+        with self._lock:
+            return {
+                stage: {name: round(value, 6) for name, value in values.items()}
+                for stage, values in self.stages.items()
+            }
+
+@contextmanager
+def measure(stage: str):
+    """
+    Measures a stage of the current run, if any. Used by modules that run
+    both inside and outside of an instrumented pipeline.
+
+    Args:
+        stage: The stage name.
+    """
+    run = _current_run.get()
+    if run is None:
+        yield None
+        return
+    with run.stage(stage):
+        yield run
+
+def start_run() -> RunMetrics:
+    """
+    Starts collecting metrics for a pipeline run in the current thread or task.
+
+    Returns:
+        The new RunMetrics.
+    """
+    run = RunMetrics()
+    _current_run.set(run)
+    return run
+
+def record(**values: float):
+    """
+    Adds values to the stage currently being measured. Does nothing outside a run.
+
+    Args:
+        **values: The amounts to add, e.g. bytes_downloaded=2048.
+    """
+    run = _current_run.get()
+    stage = _current_stage.get()
+    if run and stage:
+        run.add(stage, **values)
+
+def record_usage(usage, model: str, price_factor: float = 1.0):
+    """
+    Records OpenAI token usage and its estimated cost for the current stage.
+    Prompt tokens served from the provider's prompt cache are counted as
+    cached_tokens and priced at the cached input rate.
+
+    Args:
+        usage: The `usage` object of a chat completion response (may be None).
+        model: The model name, used to look up the token prices.
+        price_factor: Scales the token prices, e.g. 0.5 for Batch API requests.
+    """
+    if usage is None:
+        return
+    prompt_tokens = usage.prompt_tokens or 0
+    completion_tokens = usage.completion_tokens or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details else 0
+    # Fine-tuned models are priced by their base model, e.g. "ft:gpt-4o-mini-2024-07-18:..."
+    base_model = model.split(":")[1] if model.startswith("ft:") else model
+    prices = next(
+        (price for name, price in METRICS_CONFIG["token_prices"].items() if base_model.startswith(name)),
+        {"input": 0.0, "output": 0.0}
+    )
+    input_cost = (prompt_tokens - cached_tokens) * prices["input"] + cached_tokens * prices.get("cached_input", prices["input"])
+    record(
+        prompt_tokens=prompt_tokens,
+        cached_tokens=cached_tokens,
+        completion_tokens=completion_tokens,
+        cost_usd=(input_cost + completion_tokens * prices["output"]) * price_factor / 1_000_000
+    )
+
+def _parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+def record_prediction(prediction: dict):
+    """
+    Records the timings Replicate reports for a finished prediction.
+
+    Args:
+        prediction: A prediction record with created_at/started_at/completed_at and metrics.
+    """
+    created_at = _parse_timestamp(prediction.get("created_at"))
+    started_at = _parse_timestamp(prediction.get("started_at"))
+    completed_at = _parse_timestamp(prediction.get("completed_at"))
+    values = {}
+    if created_at and started_at:
+        values["prediction_queue_seconds"] = (started_at - created_at).total_seconds()
+    if started_at and completed_at:
+        values["prediction_run_seconds"] = (completed_at - started_at).total_seconds()
+    predict_time = (prediction.get("metrics") or {}).get("predict_time")
+    if predict_time is not None:
+        values["predict_seconds"] = predict_time
+    record(**values)
+
+class MetricsRegistry:
+    """
+    Aggregates the metrics of all runs in this process and exports them in the
+    Prometheus text format.
+    """
+    def __init__(self):
+        """Initializes empty totals."""
+        self.stage_totals = defaultdict(lambda: defaultdict(float))
+        self.run_totals = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def observe(self, run: RunMetrics, status: str):
+        """
+        Adds a finished run to the totals.
+
+        Args:
+            run: The metrics of the finished run.
+            status: The final status of the run ("completed" or "failed").
+        """
+        with self._lock:
+            self.run_totals[status] += 1
+            for stage, values in run.to_dict().items():
+                for name, value in values.items():
+                    self.stage_totals[stage][name] += value
+
+    def to_prometheus(self) -> str:
+        """
+        Renders the totals in the Prometheus text exposition format.
+
+        Returns:
+            The metrics text.
+        """
+        lines = [
+            "# HELP pipeline_runs_total Pipeline runs by final status.",
+            "# TYPE pipeline_runs_total counter"
+        ]
+        with self._lock:
+            for status, count in sorted(self.run_totals.items()):
+                lines.append(f'pipeline_runs_total{{status="{status}"}} {count}')
+
+            metric_names = sorted({name for values in self.stage_totals.values() for name in values})
+            for name in metric_names:
+                metric = f"pipeline_stage_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for stage, values in sorted(self.stage_totals.items()):
+                    if name in values:
+                        lines.append(f'{metric}{{stage="{stage}"}} {values[name]:g}')
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: Optional[str] = None) -> str:
+        """
+        Writes the Prometheus text to a file (atomically), e.g. for the node
+        exporter's textfile collector.
+
+        Args:
+            path: The output file (defaults to METRICS_CONFIG["export_file"] in LOG_DIR).
+
+        Returns:
+            The path of the written file.
+        """
+        path = path or os.path.join(LOG_DIR, METRICS_CONFIG["export_file"])
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(temp_path, path)
+        return path
+
+# Process-wide totals
+METRICS = MetricsRegistry()
@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from types import SimpleNamespace
+from typing import Dict, Iterable, List, Optional, Tuple
+from config import OPENAI_BATCH_CONFIG, STATE_DIR
+from .clients import get_openai_client
+from .scheduler import get_scheduler
+from .state_file import read_state, update_state
+from . import metrics
+
+# The scheduler key of the Files and Batches endpoints (they are not tied to a model)
+BATCH_RATE_LIMIT_KEY = "batch"
+# Batch statuses after which nothing changes any more
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+ENDPOINT = "/v1/chat/completions"
+
+class _RequestFile:
+    """A batch request file being written; named after its content hash when closed."""
+    def __init__(self, batch_dir: str, name: str, number: int):
+        self.batch_dir = batch_dir
+        self.name = name
+        # The final name is only known at the end, so the file is written under a name private to this writer
+        self.temp_path = os.path.join(batch_dir, f"{name}.{os.getpid()}.{threading.get_ident()}.{number}.partial")
+        self.file = open(self.temp_path, "wb")
+        self.digest = hashlib.sha256()
+        self.count = 0
+        self.size = 0
+
+    def write(self, line: bytes):
+        self.file.write(line)
+        self.digest.update(line)
+        self.count += 1
+        self.size += len(line)
+
+    def close(self) -> Tuple[str, str]:
+        """Closes and renames the file; returns its path and content hash."""
+        self.file.close()
+        file_hash = self.digest.hexdigest()
+        path = os.path.join(self.batch_dir, f"{self.name}_{file_hash[:16]}.jsonl")
+        os.replace(self.temp_path, path)
+        return path, file_hash
+
+    def discard(self):
+        """Closes and deletes an unfinished file."""
+        self.file.close()
+        os.remove(self.temp_path)
+
+class OpenAIBatchRunner:
+    """
+    Runs many chat completions through the OpenAI Batch API instead of one
+    synchronous call each: the requests are written to a JSONL file, uploaded,
+    submitted as a batch job and polled until the job finishes.
+
+    Submitted batches are persisted by the content hash of their request file,
+    so a restarted run with the same requests reattaches to the running job
+    instead of submitting (and paying for) it again.
+    """
+    def __init__(self, state_path: Optional[str] = None, poll_interval: Optional[float] = None):
+        """
+        Initializes the runner with configuration from config.py.
+
+        Args:
+            state_path: The JSON file holding the submitted batches (optional).
+            poll_interval: Overrides the configured seconds between status checks (optional).
+        """
+        self.config = OPENAI_BATCH_CONFIG
+        self.client = get_openai_client()
+        self.scheduler = get_scheduler()
+        self.state_path = state_path or os.path.join(STATE_DIR, self.config["state_file"])
+        self.batch_dir = os.path.join(STATE_DIR, self.config["batch_dir"])
+        self.poll_interval = poll_interval if poll_interval is not None else self.config["poll_interval"]
+        self._lock = threading.Lock()
+
+    def _load_state(self) -> Dict[str, str]:
+        return read_state(self.state_path)
+
+    def _update_state(self, file_hash: str, batch_id: Optional[str]):
+        """Records (or, with batch_id None, forgets) the batch submitted for a request file."""
+        with self._lock:
+            update_state(self.state_path, {file_hash: batch_id})
+
+    def _write_files(self, name: str, requests: Iterable[Tuple[str, dict]]) -> Tuple[List[Tuple[str, str]], Dict[str, str]]:
+        """
+        Writes the requests to JSONL files one line at a time, starting a new
+        file whenever the next line would exceed the request count or size
+        limit of the API, so only one request is held in memory at a time.
+
+        Returns:
+            The path and content hash of every file, and the model of every
+            request by its ID.
+        """
+        os.makedirs(self.batch_dir, exist_ok=True)
+        files = []
+        models = {}
+        request_file = None
+        try:
+            for custom_id, request in requests:
+                line = (json.dumps({"custom_id": custom_id, "method": "POST", "url": ENDPOINT, "body": request},
+                                   ensure_ascii=False) + "\n").encode("utf-8")
+                models[custom_id] = request["model"]
+                if request_file and (request_file.count >= self.config["max_requests"]
+                                     or request_file.size + len(line) > self.config["max_file_bytes"]):
+                    files.append(request_file.close())
+                    request_file = None
+                if request_file is None:
+                    request_file = _RequestFile(self.batch_dir, name, len(files))
+                request_file.write(line)
+        except BaseException:
+            if request_file:
+                request_file.discard()
+            raise
+        if request_file:
+            files.append(request_file.close())
+        return files, models
+
+    def _submit(self, path: str) -> str:
+        """Uploads a request file and starts a batch job for it; returns the batch ID."""
+        def upload():
+            with open(path, "rb") as f:
+                return self.client.files.create(file=f, purpose="batch")
+
+        # Creating calls are not retried once they may have reached OpenAI, so no job is submitted twice
+        input_file = self.scheduler.call("openai", BATCH_RATE_LIMIT_KEY, upload, idempotent=False)
+        batch = self.scheduler.call(
+            "openai", BATCH_RATE_LIMIT_KEY, self.client.batches.create, idempotent=False,
+            input_file_id=input_file.id, endpoint=ENDPOINT, completion_window=self.config["completion_window"]
+        )
+        logging.info(f"Submitted OpenAI batch {batch.id} ({os.path.basename(path)}).")
+        return batch.id
+
+    def _poll(self, batch_id: str, last_progress: Dict[str, tuple]):
+        """Fetches the status of a batch job, logging its progress when it changed; returns the batch object."""
+        batch = self.scheduler.call("openai", BATCH_RATE_LIMIT_KEY, self.client.batches.retrieve, batch_id)
+        counts = batch.request_counts
+        progress = (batch.status, counts.completed if counts else 0, counts.failed if counts else 0)
+        if progress != last_progress.get(batch_id):
+            total = counts.total if counts else "?"
+            logging.info(f"OpenAI batch {batch_id}: {batch.status}, {progress[1]}/{total} completed, {progress[2]} failed.")
+            last_progress[batch_id] = progress
+        return batch
+
+    def _read_results(self, file_id: Optional[str], name: str) -> List[dict]:
+        """Downloads an output or error file of a batch, keeping a copy next to the request files if configured."""
+        if not file_id:
+            return []
+        content = self.scheduler.call("openai", BATCH_RATE_LIMIT_KEY, self.client.files.content, file_id).text
+        if self.config.get("keep_results"):
+            with open(os.path.join(self.batch_dir, f"{name}_{file_id}.jsonl"), "w", encoding="utf-8") as f:
+                f.write(content)
+        return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+    def _collect(self, batch, name: str, models: Dict[str, str]) -> Dict[str, str]:
+        """Reads the results of a finished batch and records their usage; returns the completion text by request ID."""
+        if batch.status != "completed":
+            logging.warning(f"OpenAI batch {batch.id} ended as '{batch.status}'; finished requests are still used.")
+        results = {}
+        for result in self._read_results(batch.output_file_id, name):
+            response = result.get("response") or {}
+            body = response.get("body") or {}
+            if response.get("status_code") != 200 or not body.get("choices"):
+                logging.warning(f"Batch request {result.get('custom_id')} failed: {result.get('error') or body.get('error')}")
+                continue
+            if body.get("usage"):
+                usage = body["usage"]
+                metrics.record_usage(SimpleNamespace(prompt_tokens=usage.get("prompt_tokens"),
+                                                     completion_tokens=usage.get("completion_tokens"),
+                                                     prompt_tokens_details=SimpleNamespace(**(usage.get("prompt_tokens_details") or {}))),
+                                     body.get("model", models.get(result["custom_id"], "")),
+                                     price_factor=self.config["price_factor"])
+            results[result["custom_id"]] = body["choices"][0]["message"]["content"]
+        for result in self._read_results(batch.error_file_id, f"{name}_errors"):
+            logging.warning(f"Batch request {result.get('custom_id')} failed: {result.get('error') or result.get('response')}")
+        return results
+
+    def run(self, requests: Iterable[Tuple[str, dict]], name: str = "requests") -> Dict[str, str]:
+        """
+        Runs chat completions through the Batch API and waits for all of them.
+        Requests that do not fit into one file are split into several batch
+        jobs, which are all submitted first and then run at the same time.
+
+        Args:
+            requests: (ID, request) pairs, where the request holds the keyword
+                arguments for chat.completions.create() and the ID is chosen by
+                the caller and unique within the call. A generator is consumed
+                one request at a time, so large inputs are never all in memory.
+            name: A prefix for the request and result files, e.g. "describe".
+
+        Returns:
+            The completion text by request ID. Requests that failed (or that
+            the job did not finish) are left out, so the caller can run them
+            synchronously instead.
+        """
+        files, models = self._write_files(name, requests)
+        state = self._load_state()
+        pending = {}
+        for path, file_hash in files:
+            batch_id = state.get(file_hash)
+            if batch_id:
+                logging.info(f"Reattaching to OpenAI batch {batch_id} submitted by an earlier run.")
+            else:
+                batch_id = self._submit(path)
+                self._update_state(file_hash, batch_id)
+            pending[batch_id] = (path, file_hash)
+
+        results = {}
+        last_progress = {}
+        while pending:
+            for batch_id in list(pending):
+                batch = self._poll(batch_id, last_progress)
+                if batch.status not in TERMINAL_STATUSES:
+                    continue
+                path, file_hash = pending.pop(batch_id)
+                results.update(self._collect(batch, name, models))
+                # A finished batch is not reattached again; a rerun submits whatever is still missing
+                self._update_state(file_hash, None)
+                os.remove(path)
+            if pending:
+                time.sleep(self.poll_interval)
+
+        logging.info(f"OpenAI batch '{name}': {len(results)}/{len(models)} requests succeeded.")
+        return results
@@ -0,0 +1,551 @@
+import os
+import hmac
+import json
+import time
+import base64
+import asyncio
+import hashlib
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Mapping, Optional
+from config import PREDICTION_MANAGER_CONFIG, STATE_DIR
+from .clients import get_replicate_client, get_async_replicate_client
+from .scheduler import get_scheduler
+from .state_file import read_state, update_state
+from . import metrics
+
+TERMINAL_STATUSES = {"succeeded", "failed", "canceled"}
+# Scheduler key of the Replicate endpoints that are not tied to a model (polling, cancels, uploads)
+API_RATE_LIMIT_KEY = "api"
+
+def _rewind_files(input: dict):
+    """Rewinds open file inputs so that a retried submission uploads them again in full."""
+    for value in input.values():
+        if hasattr(value, "seek"):
+            value.seek(0)
+
+def verify_webhook(headers: Mapping[str, str], body: bytes, secret: str, tolerance_seconds: float) -> bool:
+    """
+    Checks the signature Replicate attaches to every webhook request: an
+    HMAC-SHA256 of "{webhook-id}.{webhook-timestamp}.{body}" keyed with the
+    signing secret, listed in the webhook-signature header as "v1,<base64>".
+
+    Args:
+        headers: The request headers.
+        body: The raw request body.
+        secret: The signing secret ("whsec_...").
+        tolerance_seconds: How far the timestamp may be from now (against replays).
+
+    Returns:
+        True if the request was signed with the secret and is recent.
+    """
+    webhook_id = headers.get("webhook-id")
+    timestamp = headers.get("webhook-timestamp")
+    signatures = headers.get("webhook-signature")
+    if not (webhook_id and timestamp and signatures):
+        return False
+    try:
+        if abs(time.time() - int(timestamp)) > tolerance_seconds:
+            return False
+        key = base64.b64decode(secret.split("_", 1)[1] if secret.startswith("whsec_") else secret)
+    except ValueError:
+        return False
+    signed_content = f"{webhook_id}.{timestamp}.".encode("utf-8") + body
+    expected = base64.b64encode(hmac.new(key, signed_content, hashlib.sha256).digest()).decode("ascii")
+    return any(
+        hmac.compare_digest(signature.split(",", 1)[-1], expected)
+        for signature in signatures.split() if signature.startswith("v1,")
+    )
+
+class PredictionError(Exception):
+    """Raised when a Replicate prediction ends as failed or canceled."""
+    def __init__(self, prediction_id: str, status: str, error: Optional[str] = None):
+        super().__init__(f"Prediction {prediction_id} {status}: {error or 'no error details'}")
+        self.prediction_id = prediction_id
+        self.status = status
+        self.error = error
+
+class PredictionManager:
+    """
+    Creates Replicate predictions without blocking on them and tracks them by ID.
+
+    Predictions are polled with an adaptive backoff (or completed early by a
+    webhook) and their state is persisted, so a restarted process reattaches
+    to predictions that are still running instead of paying for them again.
+    """
+    def __init__(self, api_key: str, state_path: Optional[str] = None):
+        """
+        Initializes the manager and loads the persisted prediction state.
+
+        Args:
+            api_key: The Replicate API key.
+            state_path: The JSON file holding the tracked predictions.
+        """
+        if not api_key:
+            raise ValueError("Replicate API key is required.")
+        self.api_key = api_key
+        self.client = get_replicate_client(api_key)
+        self.config = PREDICTION_MANAGER_CONFIG
+        self.state_path = state_path or os.path.join(STATE_DIR, self.config["state_file"])
+        self._lock = threading.Lock()
+        self._completed = threading.Condition(self._lock)
+        self._predictions = self._load_state()
+        # The number of callers waiting for each prediction; its record is kept until the last one has read it
+        self._waiters = {}
+        self.scheduler = get_scheduler()
+        self.scheduler.configure("replicate", API_RATE_LIMIT_KEY, self.config.get("rate_limit"))
+
+    # --- State persistence ---
+
+    def _load_state(self) -> Dict[str, dict]:
+        return read_state(self.state_path)
+
+    def _save_state(self, prediction_id: str):
+        """
+        Writes the record of a prediction (or its removal) to the state file,
+        keeping the predictions other processes track there. Must be called
+        with the lock held.
+        """
+        update_state(self.state_path, {prediction_id: self._predictions.get(prediction_id)})
+
+    def _record(self, prediction_id: str, data: dict):
+        """Merges prediction data into the state and wakes up waiters on completion."""
+        with self._lock:
+            record = self._predictions.setdefault(prediction_id, {"id": prediction_id})
+            updates = {key: value for key, value in data.items() if value is not None and record.get(key) != value}
+            if updates or len(record) == 1:
+                record.update(updates)
+                self._save_state(prediction_id)
+            if record.get("status") in TERMINAL_STATUSES:
+                self._completed.notify_all()
+
+    def _record_prediction(self, prediction):
+        self._record(prediction.id, {
+            "status": prediction.status,
+            "output": prediction.output,
+            "error": str(prediction.error) if prediction.error else None,
+            "metrics": prediction.metrics,
+            "created_at": prediction.created_at,
+            "started_at": prediction.started_at,
+            "completed_at": prediction.completed_at
+        })
+
+    def _find_by_key(self, key: str) -> Optional[str]:
+        with self._lock:
+            for prediction_id, record in self._predictions.items():
+                if record.get("key") == key and record.get("status") not in {"failed", "canceled"}:
+                    return prediction_id
+        return None
+
+    # --- Submission ---
+
+    def _create_params(self) -> dict:
+        params = {}
+        if self.config.get("webhook_url"):
+            params["webhook"] = self.config["webhook_url"]
+            params["webhook_events_filter"] = ["completed"]
+        return params
+
+    def submit(self, model: str, input: dict, key: Optional[str] = None) -> str:
+        """
+        Creates a prediction and returns immediately.
+
+        Args:
+            model: The Replicate model in the form "owner/name".
+            input: The model input.
+            key: An optional idempotency key. If a prediction with the same key
+                is still tracked (e.g. from before a restart), its ID is returned
+                instead of creating a new one.
+
+        Returns:
+            The prediction ID.
+        """
+        if key:
+            existing_id = self._find_by_key(key)
+            if existing_id:
+                logging.info(f"Reattaching to tracked prediction {existing_id} for model '{model}'.")
+                return existing_id
+
+        def create():
+            _rewind_files(input)
+            return self.client.predictions.create(model=model, input=input, **self._create_params())
+
+        # Not retried once the request may have reached Replicate: a second prediction would be billed too
+        prediction = self.scheduler.call("replicate", model, create, idempotent=False)
+        self._record(prediction.id, {"model": model, "key": key, "submitted_at": time.time()})
+        self._record_prediction(prediction)
+        logging.info(f"Submitted prediction {prediction.id} for model '{model}'.")
+        return prediction.id
+
+    async def submit_async(self, model: str, input: dict, key: Optional[str] = None) -> str:
+        """
+        Asynchronous version of submit() using the async Replicate client.
+
+        Args:
+            model: The Replicate model in the form "owner/name".
+            input: The model input.
+            key: An optional idempotency key (see submit()).
+
+        Returns:
+            The prediction ID.
+        """
+        if key:
+            existing_id = self._find_by_key(key)
+            if existing_id:
+                logging.info(f"Reattaching to tracked prediction {existing_id} for model '{model}'.")
+                return existing_id
+
+        client = get_async_replicate_client(self.api_key)
+
+        async def create():
+            _rewind_files(input)
+            return await client.predictions.async_create(model=model, input=input, **self._create_params())
+
+        prediction = await self.scheduler.call_async("replicate", model, create, idempotent=False)
+        self._record(prediction.id, {"model": model, "key": key, "submitted_at": time.time()})
+        self._record_prediction(prediction)
+        logging.info(f"Submitted prediction {prediction.id} for model '{model}'.")
+        return prediction.id
+
+    # --- Completion ---
+
+    def _terminal_record(self, prediction_id: str) -> Optional[dict]:
+        record = self._predictions.get(prediction_id)
+        if record and record.get("status") in TERMINAL_STATUSES:
+            return record
+        return None
+
+    def _attach(self, prediction_id: str):
+        """Registers a caller waiting for a prediction."""
+        with self._lock:
+            self._waiters[prediction_id] = self._waiters.get(prediction_id, 0) + 1
+
+    def _detach(self, prediction_id: str) -> bool:
+        """Unregisters a waiting caller; returns True if it was the last one. Must be called with the lock held."""
+        remaining = self._waiters.get(prediction_id, 1) - 1
+        if remaining > 0:
+            self._waiters[prediction_id] = remaining
+            return False
+        self._waiters.pop(prediction_id, None)
+        return True
+
+    def _finish(self, prediction_id: str) -> Any:
+        """
+        Returns the output of a completed prediction to one of its waiters. The
+        last waiter removes the prediction from the state, so callers that
+        reattached to the same prediction (e.g. by key) all get its result.
+        """
+        with self._lock:
+            record = self._terminal_record(prediction_id)
+            if self._detach(prediction_id) and record is not None:
+                self._predictions.pop(prediction_id, None)
+                self._save_state(prediction_id)
+        if record is None:
+            raise PredictionError(prediction_id, "unknown", "no longer tracked")
+        metrics.record_prediction(record)
+        if record["status"] != "succeeded":
+            raise PredictionError(prediction_id, record["status"], record.get("error"))
+        return record.get("output")
+
+    def _get(self, prediction_id: str):
+        return self.scheduler.call("replicate", API_RATE_LIMIT_KEY, self.client.predictions.get, prediction_id)
+
+    def _next_interval(self, interval: float) -> float:
+        return min(interval * self.config["poll_backoff"], self.config["poll_max_interval"])
+
+    def wait(self, prediction_id: str, timeout: Optional[float] = None) -> Any:
+        """
+        Blocks until a prediction finishes, polling with an increasing interval.
+
+        Args:
+            prediction_id: The prediction ID returned by submit().
+            timeout: The maximum number of seconds to wait (unbounded if None).
+
+        Returns:
+            The prediction output.
+
+        Raises:
+            PredictionError: If the prediction failed or was canceled.
+            TimeoutError: If the timeout expired first.
+        """
+        return self.wait_all([prediction_id], timeout=timeout)[prediction_id]
+
+    def wait_all(self, prediction_ids: List[str], timeout: Optional[float] = None,
+                 return_exceptions: bool = False) -> Dict[str, Any]:
+        """
+        Waits for several predictions from a single thread.
+
+        Args:
+            prediction_ids: The prediction IDs returned by submit().
+            timeout: The maximum number of seconds to wait (unbounded if None).
+            return_exceptions: If True, a failed prediction maps to its
+                PredictionError instead of raising it.
+
+        Returns:
+            A mapping of prediction ID to output.
+
+        Raises:
+            PredictionError: If any prediction failed or was canceled (unless return_exceptions is set).
+            TimeoutError: If the timeout expired first.
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        pending = set(prediction_ids)
+        interval = self.config["poll_initial_interval"]
+        for prediction_id in prediction_ids:
+            self._attach(prediction_id)
+        attached = list(prediction_ids)
+
+        try:
+            while True:
+                for prediction_id in list(pending):
+                    with self._lock:
+                        done = self._terminal_record(prediction_id) is not None
+                    if not done:
+                        self._record_prediction(self._get(prediction_id))
+                        with self._lock:
+                            done = self._terminal_record(prediction_id) is not None
+                    if done:
+                        pending.discard(prediction_id)
+                if not pending:
+                    break
+
+                if deadline and time.monotonic() >= deadline:
+                    raise TimeoutError(f"Predictions still running after {timeout}s: {sorted(pending)}")
+                # A webhook completing a prediction wakes this wait up early
+                with self._lock:
+                    self._completed.wait(interval)
+                interval = self._next_interval(interval)
+
+            results = {}
+            for prediction_id in prediction_ids:
+                attached.remove(prediction_id)
+                try:
+                    results[prediction_id] = self._finish(prediction_id)
+                except PredictionError as e:
+                    if not return_exceptions:
+                        raise
+                    results[prediction_id] = e
+            return results
+        finally:
+            # A caller that gives up (timeout, error, cancellation) no longer holds the records back
+            with self._lock:
+                for prediction_id in attached:
+                    self._detach(prediction_id)
+
+    async def wait_async(self, prediction_id: str) -> Any:
+        """
+        Asynchronous version of wait(); sleeping does not block the event loop.
+
+        Args:
+            prediction_id: The prediction ID returned by submit().
+
+        Returns:
+            The prediction output.
+
+        Raises:
+            PredictionError: If the prediction failed or was canceled.
+        """
+        client = get_async_replicate_client(self.api_key)
+        interval = self.config["poll_initial_interval"]
+        self._attach(prediction_id)
+        try:
+            while True:
+                with self._lock:
+                    done = self._terminal_record(prediction_id) is not None
+                if not done:
+                    self._record_prediction(await self.scheduler.call_async(
+                        "replicate", API_RATE_LIMIT_KEY, client.predictions.async_get, prediction_id
+                    ))
+                    with self._lock:
+                        done = self._terminal_record(prediction_id) is not None
+                if done:
+                    break
+                await asyncio.sleep(interval)
+                interval = self._next_interval(interval)
+        except BaseException:
+            with self._lock:
+                self._detach(prediction_id)
+            raise
+        return self._finish(prediction_id)
+
+    def run(self, model: str, input: dict, key: Optional[str] = None, prediction_id: Optional[str] = None,
+            on_submit: Optional[Callable[[str], None]] = None) -> Any:
+        """
+        Submits a prediction and waits for its output.
+
+        Args:
+            model: The Replicate model in the form "owner/name".
+            input: The model input.
+            key: An optional idempotency key (see submit()).
+            prediction_id: An earlier prediction to reattach to (e.g. from a
+                checkpoint). A new one is submitted if it failed or was canceled.
+            on_submit: Called with the prediction ID once it is known.
+
+        Returns:
+            The prediction output.
+        """
+        if prediction_id:
+            try:
+                return self.wait(prediction_id)
+            except PredictionError as e:
+                logging.warning(f"Cannot reuse prediction {prediction_id} ({e}); submitting a new one.")
+
+        prediction_id = self.submit(model, input, key=key)
+        if on_submit:
+            on_submit(prediction_id)
+        return self.wait(prediction_id)
+
+    async def run_async(self, model: str, input: dict, key: Optional[str] = None, prediction_id: Optional[str] = None,
+                        on_submit: Optional[Callable[[str], None]] = None) -> Any:
+        """
+        Asynchronous version of run().
+
+        Args:
+            model: The Replicate model in the form "owner/name".
+            input: The model input.
+            key: An optional idempotency key (see submit()).
+            prediction_id: An earlier prediction to reattach to (see run()).
+            on_submit: Called with the prediction ID once it is known.
+
+        Returns:
+            The prediction output.
+        """
+        if prediction_id:
+            try:
+                return await self.wait_async(prediction_id)
+            except PredictionError as e:
+                logging.warning(f"Cannot reuse prediction {prediction_id} ({e}); submitting a new one.")
+
+        prediction_id = await self.submit_async(model, input, key=key)
+        if on_submit:
+            on_submit(prediction_id)
+        return await self.wait_async(prediction_id)
+
+    def cancel(self, prediction_id: str):
+        """
+        Cancels a running prediction.
+
+        Args:
+            prediction_id: The prediction ID returned by submit().
+        """
+        self._record_prediction(self.scheduler.call(
+            "replicate", API_RATE_LIMIT_KEY, self.client.predictions.cancel, prediction_id
+        ))
+        logging.info(f"Canceled prediction {prediction_id}.")
+
+    def outstanding(self) -> List[dict]:
+        """
+        Returns the tracked predictions whose output has not been consumed yet,
+        including those restored from a previous process.
+
+        Returns:
+            A list of prediction records.
+        """
+        with self._lock:
+            return [dict(record) for record in self._predictions.values()]
+
+    def handle_webhook(self, payload: dict):
+        """
+        Updates a tracked prediction from a Replicate webhook payload.
+
+        Args:
+            payload: The decoded JSON body of the webhook request.
+        """
+        prediction_id = payload.get("id")
+        if not prediction_id:
+            return
+        with self._lock:
+            tracked = prediction_id in self._predictions
+        if not tracked:
+            logging.warning(f"Ignoring webhook for untracked prediction {prediction_id}.")
+            return
+        self._record(prediction_id, {
+            "status": payload.get("status"),
+            "output": payload.get("output"),
+            "error": payload.get("error"),
+            "metrics": payload.get("metrics"),
+            "started_at": payload.get("started_at"),
+            "completed_at": payload.get("completed_at")
+        })
+
+class WebhookReceiver:
+    """
+    A minimal local HTTP server that forwards Replicate webhooks to a PredictionManager.
+    PREDICTION_MANAGER_CONFIG["webhook_url"] must be a public URL routed to this port.
+    Requests without a valid signature (see verify_webhook()) are rejected.
+    """
+    def __init__(self, manager: PredictionManager, port: int, secret: str, host: str = "127.0.0.1"):
+        """
+        Initializes the receiver.
+
+        Args:
+            manager: The manager that receives the prediction updates.
+            port: The local port to listen on.
+            secret: The webhook signing secret of the Replicate account.
+            host: The local interface to listen on.
+        """
+        tolerance_seconds = PREDICTION_MANAGER_CONFIG.get("webhook_tolerance_seconds", 300)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length)
+                if not verify_webhook(self.headers, body, secret, tolerance_seconds):
+                    logging.warning(f"Rejected a webhook with a missing or invalid signature from {self.client_address[0]}.")
+                    self.send_response(401)
+                    self.end_headers()
+                    return
+                try:
+                    manager.handle_webhook(json.loads(body))
+                    self.send_response(204)
+                except json.JSONDecodeError:
+                    self.send_response(400)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logging.debug(f"Webhook receiver: {format % args}")
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        """Starts serving in a background thread."""
+        self.thread.start()
+        host, port = self.server.server_address[:2]
+        logging.info(f"Webhook receiver listening on {host}:{port}.")
+
+    def stop(self):
+        """Stops the server."""
+        self.server.shutdown()
+        self.server.server_close()
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+def get_prediction_manager(api_key: str) -> PredictionManager:
+    """
+    Returns the process-wide PredictionManager for an API key, starting the
+    webhook receiver on first use when a webhook URL is configured.
+
+    Args:
+        api_key: The Replicate API key.
+
+    Returns:
+        The shared PredictionManager.
+    """
+    with _managers_lock:
+        if api_key not in _managers:
+            manager = PredictionManager(api_key)
+            if PREDICTION_MANAGER_CONFIG.get("webhook_url"):
+                if PREDICTION_MANAGER_CONFIG.get("webhook_secret"):
+                    WebhookReceiver(manager, PREDICTION_MANAGER_CONFIG["webhook_port"], PREDICTION_MANAGER_CONFIG["webhook_secret"],
+                                    PREDICTION_MANAGER_CONFIG.get("webhook_host", "127.0.0.1")).start()
+                else:
+                    logging.warning("webhook_url is set but REPLICATE_WEBHOOK_SECRET is not; "
+                                    "webhooks cannot be verified, so predictions are only polled.")
+            outstanding = manager.outstanding()
+            if outstanding:
+                logging.info(f"Restored {len(outstanding)} tracked predictions from '{manager.state_path}'.")
+            _managers[api_key] = manager
+        return _managers[api_key]
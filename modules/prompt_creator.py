@@ -1,6 +1,14 @@
-import openai
-from config import PROMPT_CREATOR_CONFIG
+import asyncio
+import hashlib
+import logging
+from config import PROMPT_CREATOR_CONFIG, PROMPT_CACHE_CONFIG
 from .prompt_enhancer import PromptEnhancer
+from .clients import get_openai_client, get_async_openai_client
+from .disk_cache import get_cache, make_key, normalize_text
+from .scheduler import get_scheduler
+from .streaming import complete_chat, complete_chat_async
+from .openai_batch import OpenAIBatchRunner
+from . import metrics
 
 class PromptCreator:
     """
@@ -11,38 +19,199 @@ class PromptCreator:
         Initializes the PromptCreator with configuration from config.py.
         """
         self.config = PROMPT_CREATOR_CONFIG
-        self.client = openai.OpenAI()
+        self.client = get_openai_client()
+        self.scheduler = get_scheduler()
+        self.scheduler.configure(self.config["model_type"], self.config["model_name"], self.config.get("rate_limit"))
         self.enhancer = PromptEnhancer()
 
-    def create_prompt(self, description: str) -> str:
+        self.cache = None
+        if PROMPT_CACHE_CONFIG["enabled"]:
+            self.cache = get_cache(
+                "prompts",
+                max_entries=PROMPT_CACHE_CONFIG.get("max_entries"),
+                max_bytes=PROMPT_CACHE_CONFIG.get("max_bytes"),
+                ttl_seconds=PROMPT_CACHE_CONFIG.get("ttl_seconds")
+            )
+
+    def _cache_key(self, description: str) -> str:
+        """
+        Builds the prompt cache key from the normalized description and every
+        model setting that influences the prompt.
+
+        Args:
+            description: A detailed description of the artistic style.
+
+        Returns:
+            The cache key.
+        """
+        system_prompt_hash = hashlib.sha256(self.config["system_prompt"].encode("utf-8")).hexdigest()
+        return make_key(
+            "creator",
+            normalize_text(description),
+            self.config["model_name"],
+            self.config["temperature"],
+            self.config["top_p"],
+            system_prompt_hash
+        )
+
+    def _build_request(self, description: str) -> dict:
+        """
+        Builds the chat completion arguments for turning a style description into a prompt.
+
+        Args:
+            description: A detailed description of the artistic style.
+
+        Returns:
+            The keyword arguments for chat.completions.create().
+        """
+        return {
+            "model": self.config["model_name"],
+            "messages": [
+                {"role": "system", "content": self.config["system_prompt"]},
+                {"role": "user", "content": description}
+            ],
+            "temperature": self.config["temperature"],
+            "top_p": self.config["top_p"],
+            "max_tokens": 150
+        }
+
+    def generate_prompt(self, description: str, use_cache: bool = True, on_text=None) -> str:
+        """
+        Generates a prompt from a style description without any user interaction.
+
+        Args:
+            description: A detailed description of the artistic style.
+            use_cache: If False, the prompt cache is neither read nor updated,
+                e.g. to get a fresh sample for the same description.
+            on_text: Called with every text delta while the prompt streams in (optional).
+
+        Returns:
+            A string containing the generated prompt.
+        """
+        cache_key = None
+        if self.cache and use_cache:
+            cache_key = self._cache_key(description)
+            cached_prompt = self.cache.get(cache_key)
+            if cached_prompt is not None:
+                logging.info("Using cached generation prompt for this style description.")
+                metrics.record(cache_hits=1)
+                return cached_prompt
+
+        prompt = complete_chat(
+            self.scheduler, self.config["model_type"], self.client.chat.completions.create,
+            self._build_request(description), stream=self.config.get("stream", False), on_text=on_text
+        ).strip()
+        if cache_key and prompt:
+            self.cache.set(cache_key, prompt)
+        return prompt
+
+    def generate_prompts_with_batch_api(self, descriptions: dict, use_cache: bool = True,
+                                        runner: OpenAIBatchRunner = None) -> dict:
+        """
+        Generates the prompts for many style descriptions through the OpenAI
+        Batch API: one request per uncached description, submitted as a batch
+        job and waited for.
+
+        Args:
+            descriptions: The style descriptions, by a caller-chosen key (e.g. the input path).
+            use_cache: If False, the prompt cache is neither read nor updated.
+            runner: The batch runner to use (a new one by default).
+
+        Returns:
+            The generated prompts by the same keys. Descriptions whose request
+            failed are left out (generate_prompt() can be used for them).
+        """
+        if self.config["model_type"] != "openai":
+            logging.warning("The Batch API is only available for OpenAI models; prompts are generated one by one.")
+            return {}
+
+        prompts = {}
+        cache_keys = {}
+        keys = list(descriptions)
+
+        def requests():
+            for number, key in enumerate(keys):
+                if self.cache and use_cache:
+                    cache_keys[key] = self._cache_key(descriptions[key])
+                    cached_prompt = self.cache.get(cache_keys[key])
+                    if cached_prompt is not None:
+                        prompts[key] = cached_prompt
+                        continue
+                yield str(number), self._build_request(descriptions[key])
+
+        results = (runner or OpenAIBatchRunner()).run(requests(), name="prompt")
+        for custom_id, prompt in results.items():
+            key = keys[int(custom_id)]
+            prompts[key] = prompt.strip()
+            if key in cache_keys and prompts[key]:
+                self.cache.set(cache_keys[key], prompts[key])
+        return prompts
+
+    async def generate_prompt_async(self, description: str, use_cache: bool = True) -> str:
+        """
+        Asynchronous version of generate_prompt() using the async OpenAI client.
+
+        Args:
+            description: A detailed description of the artistic style.
+            use_cache: If False, the prompt cache is neither read nor updated.
+
+        Returns:
+            A string containing the generated prompt.
+        """
+        cache_key = None
+        if self.cache and use_cache:
+            cache_key = self._cache_key(description)
+            cached_prompt = await asyncio.to_thread(self.cache.get, cache_key)
+            if cached_prompt is not None:
+                logging.info("Using cached generation prompt for this style description.")
+                metrics.record(cache_hits=1)
+                return cached_prompt
+
+        prompt = (await complete_chat_async(
+            self.scheduler, self.config["model_type"], get_async_openai_client().chat.completions.create,
+            self._build_request(description), stream=self.config.get("stream", False)
+        )).strip()
+        if cache_key and prompt:
+            await asyncio.to_thread(self.cache.set, cache_key, prompt)
+        return prompt
+
+    def create_prompt(self, description: str, use_cache: bool = True, on_prompt=None) -> str:
         """
         Generates a prompt and allows the user to iteratively refine it.
 
         Args:
             description: A detailed description of the artistic style.
+            use_cache: If False, neither the initial prompt nor the refinements are taken from the prompt cache.
+            on_prompt: Called with every prompt as it is shown for review, before
+                the user decides on it (optional), e.g. to start rendering it speculatively.
 
         Returns:
             A string containing the user-approved generated prompt.
         """
         print("\n--- Prompt Creation ---")
         print("Generating initial prompt from style description...")
-        
-        response = self.client.chat.completions.create(
-            model=self.config["model_name"],
-            messages=[
-                {"role": "system", "content": self.config["system_prompt"]},
-                {"role": "user", "content": description}
-            ],
-            temperature=self.config["temperature"],
-            top_p=self.config["top_p"],
-            max_tokens=150
-        )
-        generated_prompt = response.choices[0].message.content.strip()
+
+        # A streamed prompt is shown while it is generated; a cached one is shown in full below
+        streamed = []
+        def show(text: str):
+            if not streamed:
+                print("\n--- Generated Prompt ---")
+            streamed.append(text)
+            print(text, end="", flush=True)
+
+        generated_prompt = self.generate_prompt(description, use_cache=use_cache, on_text=show)
+        if streamed:
+            print("\n------------------------")
+        show_prompt = not streamed
 
         while True:
-            print("\n--- Generated Prompt ---")
-            print(f"'{generated_prompt}'")
-            print("------------------------")
+            if show_prompt:
+                print("\n--- Generated Prompt ---")
+                print(f"'{generated_prompt}'")
+                print("------------------------")
+            show_prompt = True
+            if on_prompt:
+                on_prompt(generated_prompt)
 
             while True:
                 choice = input("\nChoose an action: [1] Accept, [2] Modify: ").strip()
@@ -59,4 +228,4 @@ class PromptCreator:
                 print("No modification request. Accepting the current prompt.")
                 return generated_prompt
 
-            generated_prompt = self.enhancer.enhance_prompt(generated_prompt, modification_request) 
\ No newline at end of file
+            generated_prompt = self.enhancer.enhance_prompt(generated_prompt, modification_request, use_cache=use_cache) 
\ No newline at end of file
@@ -1,5 +1,14 @@
-import openai
-from config import PROMPT_ENHANCER_CONFIG
+import hashlib
+import logging
+from config import PROMPT_ENHANCER_CONFIG, PROMPT_CACHE_CONFIG
+from .clients import get_openai_client
+from .disk_cache import get_cache, make_key, normalize_text
+from .scheduler import get_scheduler
+from . import metrics
+
+# The format the fine-tuned model was trained on (training_data.jsonl); it is part of the cache key,
+# so prompts enhanced with an earlier layout of the user message are not reused
+USER_TEMPLATE = "Original Prompt: {original_prompt}\nModification Request: {modification_request}"
 
 class PromptEnhancer:
     """
@@ -10,9 +19,45 @@ class PromptEnhancer:
         Initializes the PromptEnhancer with configuration from config.py.
         """
         self.config = PROMPT_ENHANCER_CONFIG
-        self.client = openai.OpenAI()
+        self.client = get_openai_client()
+        self.scheduler = get_scheduler()
+        self.scheduler.configure(self.config["model_type"], self.config["model_name"], self.config.get("rate_limit"))
+
+        self.cache = None
+        if PROMPT_CACHE_CONFIG["enabled"]:
+            self.cache = get_cache(
+                "prompts",
+                max_entries=PROMPT_CACHE_CONFIG.get("max_entries"),
+                max_bytes=PROMPT_CACHE_CONFIG.get("max_bytes"),
+                ttl_seconds=PROMPT_CACHE_CONFIG.get("ttl_seconds")
+            )
 
-    def enhance_prompt(self, original_prompt: str, modification_request: str) -> str:
+    def _cache_key(self, original_prompt: str, modification_request: str) -> str:
+        """
+        Builds the prompt cache key from the normalized inputs and every model
+        setting that influences the enhanced prompt.
+
+        Args:
+            original_prompt: The prompt to be enhanced.
+            modification_request: The user's instructions for changes.
+
+        Returns:
+            The cache key.
+        """
+        system_prompt_hash = hashlib.sha256(self.config["system_prompt"].encode("utf-8")).hexdigest()
+        return make_key(
+            "enhancer",
+            normalize_text(original_prompt),
+            normalize_text(modification_request),
+            self.config["model_name"],
+            self.config["temperature"],
+            self.config["top_p"],
+            self.config["max_tokens"],
+            system_prompt_hash,
+            USER_TEMPLATE
+        )
+
+    def enhance_prompt(self, original_prompt: str, modification_request: str, use_cache: bool = True) -> str:
         """
         Generates a new, improved prompt by integrating the user's modification
         request into the original prompt.
@@ -20,15 +65,30 @@ class PromptEnhancer:
         Args:
             original_prompt: The prompt to be enhanced.
             modification_request: The user's instructions for changes.
+            use_cache: If False, the prompt cache is neither read nor updated,
+                e.g. to get a different result for the same request.
 
         Returns:
             A new, enhanced prompt.
         """
         print("Enhancing prompt with your modifications...")
+
+        cache_key = None
+        if self.cache and use_cache:
+            cache_key = self._cache_key(original_prompt, modification_request)
+            cached_prompt = self.cache.get(cache_key)
+            if cached_prompt is not None:
+                logging.info("Using cached enhanced prompt for this modification request.")
+                metrics.record(cache_hits=1)
+                return cached_prompt
         
-        user_content = f"The previous prompt was: '{original_prompt}'. The user wants to modify it with these instructions: '{modification_request}'."
+        # The system prompt stays a stable, cacheable prefix; only the user message differs between requests
+        user_content = USER_TEMPLATE.format(original_prompt=original_prompt, modification_request=modification_request)
 
-        response = self.client.chat.completions.create(
+        response = self.scheduler.call(
+            self.config["model_type"],
+            self.config["model_name"],
+            self.client.chat.completions.create,
             model=self.config["model_name"],
             messages=[
                 {"role": "system", "content": self.config["system_prompt"]},
@@ -39,5 +99,8 @@ class PromptEnhancer:
             max_tokens=self.config["max_tokens"]
         )
         
+        metrics.record_usage(response.usage, self.config["model_name"])
         enhanced_prompt = response.choices[0].message.content.strip()
+        if cache_key and enhanced_prompt:
+            self.cache.set(cache_key, enhanced_prompt)
         return enhanced_prompt 
\ No newline at end of file
@@ -0,0 +1,382 @@
+import sys
+import time
+import random
+import asyncio
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Optional
+from config import SCHEDULER_CONFIG
+from . import metrics
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider/model whose circuit is open after repeated failures."""
+
+class TokenBucket:
+    """
+    A token bucket that admits `requests_per_minute` calls on average and up
+    to `burst` calls at once.
+    """
+    def __init__(self, requests_per_minute: float, burst: int):
+        """
+        Initializes a full bucket.
+
+        Args:
+            requests_per_minute: The sustained call rate.
+            burst: The bucket capacity.
+        """
+        self.rate = requests_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Takes a token if one is available.
+
+        Returns:
+            0 if a token was taken, otherwise the seconds to wait before trying again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def pause(self, seconds: float):
+        """
+        Stops admitting calls for a while, e.g. after the provider answered 429.
+
+        Args:
+            seconds: How long to pause.
+        """
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+class CircuitBreaker:
+    """
+    Opens after a number of consecutive failures and rejects calls until the
+    reset timeout has passed; the next call then probes the provider again.
+    """
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        """
+        Initializes a closed circuit.
+
+        Args:
+            failure_threshold: The consecutive failures that open the circuit.
+            reset_seconds: How long the circuit stays open.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.open_until = 0.0
+        self._lock = threading.Lock()
+
+    def check(self, name: str):
+        """Raises CircuitOpenError if the circuit is open."""
+        with self._lock:
+            remaining = self.open_until - time.monotonic()
+        if remaining > 0:
+            raise CircuitOpenError(f"Calls to {name} are suspended for {remaining:.0f}s after repeated failures.")
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+
+    def failure(self, name: str):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.open_until = time.monotonic() + self.reset_seconds
+                self.failures = 0
+                logging.error(f"Opening the circuit for {name} for {self.reset_seconds:.0f}s.")
+
+# The SDK exception classes are looked up in sys.modules instead of being imported:
+# an error can only come from an SDK that some stage has already imported, and
+# importing openai just to classify errors would undo its lazy loading.
+
+def _status_code(error: Exception) -> Optional[int]:
+    openai = sys.modules.get("openai")
+    if openai and isinstance(error, openai.APIStatusError):
+        return error.status_code
+    replicate_exceptions = sys.modules.get("replicate.exceptions")
+    if replicate_exceptions and isinstance(error, replicate_exceptions.ReplicateError):
+        return error.status
+    return None
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Tells whether a failed call is worth retrying: rate limits, server errors,
+    timeouts and dropped connections.
+
+    Args:
+        error: The exception raised by the call.
+
+    Returns:
+        True if the call should be retried.
+    """
+    openai = sys.modules.get("openai")
+    if openai and isinstance(error, openai.APIConnectionError):
+        return True
+    httpx = sys.modules.get("httpx")
+    if httpx and isinstance(error, httpx.TransportError):
+        return True
+    status = _status_code(error)
+    return status is not None and (status in (408, 409, 429) or status >= 500)
+
+def is_outage(error: Exception) -> bool:
+    """
+    Tells whether a failure points at a provider outage (server errors and
+    connection failures), which counts towards opening its circuit. Rate
+    limits do not: the token bucket pauses for them instead.
+
+    Args:
+        error: The exception raised by the call.
+
+    Returns:
+        True if the failure counts towards the circuit breaker.
+    """
+    openai = sys.modules.get("openai")
+    if openai and isinstance(error, openai.APIConnectionError):
+        return True
+    httpx = sys.modules.get("httpx")
+    if httpx and isinstance(error, httpx.TransportError):
+        return True
+    status = _status_code(error)
+    return status is not None and status >= 500
+
+def was_not_sent(error: Exception) -> bool:
+    """
+    Tells whether a failed request certainly never reached the provider, so
+    that repeating a non-idempotent call (e.g. creating a prediction) cannot
+    create a duplicate: it was rejected by the rate limit, or the connection
+    could not be established.
+
+    Args:
+        error: The exception raised by the call.
+
+    Returns:
+        True if the request was not processed by the provider.
+    """
+    if _status_code(error) == 429:
+        return True
+    httpx = sys.modules.get("httpx")
+    if not httpx:
+        return False
+    # The OpenAI SDK wraps the httpx error, so the cause chain is followed
+    cause = error
+    while cause is not None:
+        if isinstance(cause, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+            return True
+        cause = cause.__cause__ or cause.__context__
+    return False
+
+def retry_after(error: Exception) -> Optional[float]:
+    """
+    Reads the delay the provider asked for from the Retry-After headers.
+
+    Args:
+        error: The exception raised by the call.
+
+    Returns:
+        The delay in seconds, or None if the provider did not specify one.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class CallScheduler:
+    """
+    Paces, retries and circuit-breaks calls to the OpenAI and Replicate APIs.
+
+    Every provider/model pair gets its own token bucket (from the "rate_limit"
+    entry next to its configuration) and its own circuit breaker, so a batch
+    runs at the provider's limits without exceeding them. Calls that fail with
+    a rate limit, server error or connection error are retried with jittered
+    exponential backoff, honoring Retry-After when the provider sends it.
+    Only server errors and connection failures count towards the circuit.
+
+    Calls that create something billable are made with idempotent=False and
+    are only retried if the failed request never reached the provider.
+    """
+    def __init__(self, config: Optional[dict] = None):
+        """
+        Initializes the scheduler.
+
+        Args:
+            config: Optional settings overriding SCHEDULER_CONFIG.
+        """
+        self.config = {**SCHEDULER_CONFIG, **(config or {})}
+        self._buckets = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def configure(self, provider: str, model: str, rate_limit: Optional[dict]):
+        """
+        Sets the rate limit of a provider/model. Calls to pairs without a rate
+        limit are only retried and circuit-broken, not paced.
+
+        Args:
+            provider: The provider name, e.g. "openai" or "replicate".
+            model: The model name.
+            rate_limit: A dict with "requests_per_minute" and "burst", or None.
+        """
+        with self._lock:
+            if rate_limit and (provider, model) not in self._buckets:
+                self._buckets[(provider, model)] = TokenBucket(rate_limit["requests_per_minute"], rate_limit["burst"])
+
+    def _bucket(self, provider: str, model: str) -> Optional[TokenBucket]:
+        with self._lock:
+            return self._buckets.get((provider, model))
+
+    def _breaker(self, provider: str, model: str) -> CircuitBreaker:
+        with self._lock:
+            if (provider, model) not in self._breakers:
+                self._breakers[(provider, model)] = CircuitBreaker(
+                    self.config["circuit_failure_threshold"], self.config["circuit_reset_seconds"]
+                )
+            return self._breakers[(provider, model)]
+
+    def _backoff(self, attempt: int, error: Exception, bucket: Optional[TokenBucket]) -> float:
+        """Returns the delay before the next attempt and pauses the bucket on rate limits."""
+        delay = retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(self.config["backoff_max"], self.config["backoff_base"] * 2 ** attempt))
+        if bucket and _status_code(error) == 429:
+            # Hold back every caller of this model, not just the one that was rejected
+            bucket.pause(delay)
+        return delay
+
+    def _on_error(self, name: str, attempt: int, error: Exception, breaker: CircuitBreaker, idempotent: bool) -> bool:
+        """Records a failed attempt and tells whether to retry it."""
+        if not is_retryable(error):
+            raise error
+        if is_outage(error):
+            breaker.failure(name)
+        if not idempotent and not was_not_sent(error):
+            logging.error(f"Not retrying {name}: the request may already have been processed ({error}).")
+            return False
+        if attempt >= self.config["max_retries"]:
+            logging.error(f"Giving up on {name} after {attempt + 1} attempts: {error}")
+            return False
+        metrics.record(retries=1)
+        return True
+
+    def call(self, provider: str, model: str, function: Callable, /, *args, idempotent: bool = True, **kwargs) -> Any:
+        """
+        Calls a provider API function within its rate limit, retrying transient failures.
+
+        Args:
+            provider: The provider name, e.g. "openai" or "replicate".
+            model: The model name (selects the rate limit and circuit).
+            function: The API function to call.
+            *args: Positional arguments for the function.
+            idempotent: If False, the call is only retried when the failed
+                request never reached the provider (see was_not_sent()).
+            **kwargs: Keyword arguments for the function.
+
+        Returns:
+            The return value of the function.
+
+        Raises:
+            CircuitOpenError: If the circuit of the provider/model is open.
+        """
+        name = f"{provider}/{model}"
+        bucket = self._bucket(provider, model)
+        breaker = self._breaker(provider, model)
+        attempt = 0
+        while True:
+            breaker.check(name)
+            while bucket and (wait := bucket.reserve()) > 0:
+                metrics.record(rate_limit_wait_seconds=wait)
+                time.sleep(wait)
+            try:
+                result = function(*args, **kwargs)
+                breaker.success()
+                return result
+            except Exception as e:
+                if not self._on_error(name, attempt, e, breaker, idempotent):
+                    raise
+                delay = self._backoff(attempt, e, bucket)
+                logging.warning(f"Call to {name} failed ({type(e).__name__}); retrying in {delay:.1f}s.")
+                time.sleep(delay)
+                attempt += 1
+
+    async def call_async(self, provider: str, model: str, function: Callable, /, *args, idempotent: bool = True,
+                         **kwargs) -> Any:
+        """
+        Asynchronous version of call() for coroutine functions; waiting does
+        not block the event loop.
+
+        Args:
+            provider: The provider name, e.g. "openai" or "replicate".
+            model: The model name (selects the rate limit and circuit).
+            function: The coroutine function to call.
+            *args: Positional arguments for the function.
+            idempotent: If False, the call is only retried when the failed
+                request never reached the provider (see was_not_sent()).
+            **kwargs: Keyword arguments for the function.
+
+        Returns:
+            The result of the coroutine.
+
+        Raises:
+            CircuitOpenError: If the circuit of the provider/model is open.
+        """
+        name = f"{provider}/{model}"
+        bucket = self._bucket(provider, model)
+        breaker = self._breaker(provider, model)
+        attempt = 0
+        while True:
+            breaker.check(name)
+            while bucket and (wait := bucket.reserve()) > 0:
+                metrics.record(rate_limit_wait_seconds=wait)
+                await asyncio.sleep(wait)
+            try:
+                result = await function(*args, **kwargs)
+                breaker.success()
+                return result
+            except Exception as e:
+                if not self._on_error(name, attempt, e, breaker, idempotent):
+                    raise
+                delay = self._backoff(attempt, e, bucket)
+                logging.warning(f"Call to {name} failed ({type(e).__name__}); retrying in {delay:.1f}s.")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> CallScheduler:
+    """
+    Returns the process-wide CallScheduler shared by all stages.
+
+    Returns:
+        The shared CallScheduler.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = CallScheduler()
+        return _scheduler
@@ -0,0 +1,207 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import mimetypes
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+from urllib.parse import parse_qs, urlparse
+from config import SERVER_CONFIG, STATE_DIR, IMAGE_DIR, VIDEO_DIR, BATCH_CONFIG
+from .job_queue import JobQueue
+
+# Result files the API serves, by the JSON log field naming them
+RESULT_FILES = {"image": ("output_image", IMAGE_DIR), "video": ("output_video", VIDEO_DIR)}
+
+class PipelineServer:
+    """
+    A long-running HTTP service that queues image-to-image and image-to-video
+    jobs in a durable JobQueue and runs them on a pool of worker threads.
+
+    Endpoints:
+        POST /jobs?filename=<name>&video=<0|1>  Body: the raw input image. Returns the job ID.
+        GET  /jobs/<id>                         The job status (and queue position while queued).
+        GET  /jobs/<id>/result                  The finished pipeline record.
+        GET  /jobs/<id>/result/image|video      The generated file.
+        GET  /health                            Job counts per status.
+    """
+    def __init__(self, process: Callable[..., dict], host: str = None, port: int = None, workers: int = None,
+                 queue: JobQueue = None):
+        """
+        Initializes the server without starting it.
+
+        Args:
+            process: Runs the pipeline for one input image without user interaction
+                and returns the finished JSON log record. Called as
+                process(input_path, create_video=...).
+            host: The interface to listen on (defaults to SERVER_CONFIG["host"]).
+            port: The port to listen on (defaults to SERVER_CONFIG["port"]).
+            workers: The number of concurrent jobs (defaults to SERVER_CONFIG["workers"]).
+            queue: The job queue (defaults to a JobQueue in STATE_DIR).
+        """
+        self.process = process
+        self.queue = queue or JobQueue(os.path.join(STATE_DIR, SERVER_CONFIG["queue_file"]))
+        self.workers = workers or SERVER_CONFIG["workers"]
+        self.upload_dir = os.path.join(STATE_DIR, "uploads")
+        self._stopping = threading.Event()
+        self._threads = []
+        self.httpd = ThreadingHTTPServer(
+            (host or SERVER_CONFIG["host"], port if port is not None else SERVER_CONFIG["port"]),
+            self._handler_class()
+        )
+
+    # --- Workers ---
+
+    def _work(self):
+        """Claims and runs jobs until the server stops."""
+        while not self._stopping.is_set():
+            job = self.queue.claim(timeout=SERVER_CONFIG["poll_interval"])
+            if job is None:
+                continue
+            logging.info(f"Worker {threading.current_thread().name} running job {job['id']}.")
+            try:
+                record = self.process(job["input_path"], **job["options"])
+                self.queue.finish(job["id"], record)
+            except Exception as e:
+                logging.error(f"Job {job['id']} failed: {e}", exc_info=True)
+                self.queue.fail(job["id"], str(e))
+
+    # --- HTTP API ---
+
+    def submit_upload(self, filename: str, data: bytes, create_video: bool) -> str:
+        """
+        Saves an uploaded image and queues a job for it.
+
+        Args:
+            filename: The original filename, used for its extension.
+            data: The image content.
+            create_video: If True, the job also animates the generated image.
+
+        Returns:
+            The job ID.
+        """
+        extension = os.path.splitext(filename)[1].lower()
+        if extension not in BATCH_CONFIG["image_extensions"]:
+            raise ValueError(f"Unsupported image type '{extension}'.")
+        os.makedirs(self.upload_dir, exist_ok=True)
+        # Uploads are named by content, so outputs of different users never collide
+        # and re-submitting the same image resumes from its checkpoint
+        input_path = os.path.join(self.upload_dir, f"{hashlib.sha256(data).hexdigest()[:16]}{extension}")
+        if not os.path.exists(input_path):
+            temp_path = f"{input_path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, input_path)
+        return self.queue.submit(input_path, create_video=create_video)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send_json(self, status: int, body: dict):
+                payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _send_file(self, path: str):
+                self.send_response(200)
+                self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+                self.send_header("Content-Length", str(os.path.getsize(path)))
+                self.end_headers()
+                with open(path, "rb") as f:
+                    while chunk := f.read(1024 * 1024):
+                        self.wfile.write(chunk)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                if url.path != "/jobs":
+                    return self._send_json(404, {"error": "not found"})
+                if self.headers.get("Content-Length") is None:
+                    return self._send_json(411, {"error": "Content-Length is required"})
+                try:
+                    length = int(self.headers["Content-Length"])
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    return self._send_json(400, {"error": "invalid Content-Length"})
+                if not length:
+                    return self._send_json(400, {"error": "the request body must contain the input image"})
+                if length > SERVER_CONFIG["max_upload_bytes"]:
+                    return self._send_json(413, {"error": "image too large"})
+                query = parse_qs(url.query)
+                filename = query.get("filename", ["input.png"])[0]
+                create_video = query.get("video", ["0"])[0].lower() in ("1", "true", "yes")
+                try:
+                    job_id = server.submit_upload(filename, self.rfile.read(length), create_video)
+                except ValueError as e:
+                    return self._send_json(400, {"error": str(e)})
+                self._send_json(202, {"id": job_id, "status": "queued"})
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path == "/health":
+                    return self._send_json(200, {"jobs": server.queue.counts()})
+
+                match = re.fullmatch(r"/jobs/([0-9a-f]+)(/result(?:/(image|video))?)?", path)
+                job = server.queue.get(match.group(1)) if match else None
+                if not job:
+                    return self._send_json(404, {"error": "job not found"})
+
+                if not match.group(2):
+                    status = {key: job[key] for key in ("id", "status", "error", "attempts", "created_at", "started_at", "finished_at")}
+                    if job["status"] == "queued":
+                        status["position"] = server.queue.position(job["id"])
+                    return self._send_json(200, status)
+
+                if job["status"] != "completed":
+                    return self._send_json(409, {"id": job["id"], "status": job["status"], "error": job["error"]})
+                if not match.group(3):
+                    return self._send_json(200, job["result"])
+
+                field, directory = RESULT_FILES[match.group(3)]
+                filename = job["result"].get(field)
+                if not filename or not os.path.exists(os.path.join(directory, filename)):
+                    return self._send_json(404, {"error": f"the job has no {match.group(3)} output"})
+                self._send_file(os.path.join(directory, filename))
+
+            def log_message(self, format, *args):
+                logging.debug(f"API: {format % args}")
+
+        return Handler
+
+    # --- Lifecycle ---
+
+    def start(self):
+        """Requeues interrupted jobs and starts the workers and the HTTP server in background threads."""
+        self.queue.requeue_running()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{index + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self.httpd.serve_forever, name="api", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        host, port = self.httpd.server_address[:2]
+        logging.info(f"Serving the job API on http://{host}:{port} with {self.workers} workers.")
+
+    def serve_forever(self):
+        """Starts the server and blocks until interrupted."""
+        self.start()
+        try:
+            self._stopping.wait()
+        except KeyboardInterrupt:
+            logging.info("Shutting down the job API.")
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stops accepting requests and lets the workers finish their current job."""
+        self._stopping.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        for thread in self._threads:
+            thread.join()
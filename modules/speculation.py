@@ -0,0 +1,110 @@
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable, Optional
+
+class Speculator:
+    """
+    Runs at most one pipeline step ahead of the user: the step starts in the
+    background for the input the user is currently looking at, and its result
+    is used only if the user settles on that same input. If the input changes
+    first, the running Replicate prediction is canceled.
+    """
+    def __init__(self, cancel_prediction: Callable[[str], None], name: str):
+        """
+        Initializes an idle speculator.
+
+        Args:
+            cancel_prediction: Cancels a Replicate prediction by ID, e.g. PredictionManager.cancel.
+            name: What is speculated, for log messages (e.g. "image generation").
+        """
+        self.cancel_prediction = cancel_prediction
+        self.name = name
+        self._lock = threading.Lock()
+        self._key = None
+        self._future = None
+        self._prediction_id = None
+        self._discarded = False
+
+    def start(self, key: Hashable, function: Callable, *args, **kwargs):
+        """
+        Starts function(*args, on_submit=..., **kwargs) in the background. A
+        speculation for another key is discarded first; one for the same key
+        keeps running.
+
+        Args:
+            key: Identifies the input, e.g. the prompt.
+            function: The step to run; it must accept an on_submit callback that
+                receives the ID of the prediction it creates.
+            *args: Positional arguments for the function.
+            **kwargs: Keyword arguments for the function.
+        """
+        if self._future is not None and self._key == key:
+            return
+        self.discard()
+        with self._lock:
+            self._key = key
+            self._prediction_id = None
+            self._discarded = False
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speculation")
+        # A fresh context, so metrics of the background step never count towards the caller's current stage
+        self._future = executor.submit(contextvars.Context().run, function, *args, on_submit=self._on_submit, **kwargs)
+        executor.shutdown(wait=False)
+        logging.info(f"Started speculative {self.name}.")
+
+    def _on_submit(self, prediction_id: str):
+        with self._lock:
+            self._prediction_id = prediction_id
+            discarded = self._discarded
+        if discarded:
+            # Discarded before the prediction existed
+            self._cancel(prediction_id)
+
+    def _cancel(self, prediction_id: str):
+        try:
+            self.cancel_prediction(prediction_id)
+        except Exception as e:
+            logging.warning(f"Could not cancel speculative prediction {prediction_id}: {e}")
+
+    def take(self, key: Hashable) -> Optional[Any]:
+        """
+        Returns the result of the speculation for a key, waiting for it if it is
+        still running. A speculation for another key is discarded.
+
+        Args:
+            key: Identifies the input the user settled on.
+
+        Returns:
+            The result, or None if there was no speculation for the key or it failed.
+        """
+        if self._future is None:
+            return None
+        if self._key != key:
+            self.discard()
+            return None
+        future, self._future = self._future, None
+        try:
+            result = future.result()
+        except Exception as e:
+            logging.warning(f"Speculative {self.name} failed ({e}); running it again.")
+            return None
+        logging.info(f"Using the result of speculative {self.name}.")
+        return result
+
+    def discard(self):
+        """Cancels the running speculation, if any, and waits until it has stopped."""
+        if self._future is None:
+            return
+        future, self._future = self._future, None
+        with self._lock:
+            self._discarded = True
+            prediction_id = self._prediction_id
+        if prediction_id and not future.done():
+            self._cancel(prediction_id)
+        # Waiting keeps a discarded step from writing its output after the replacement
+        try:
+            future.result()
+        except Exception:
+            pass
+        logging.info(f"Discarded speculative {self.name}.")
@@ -0,0 +1,59 @@
+import os
+import json
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no lock between processes; the per-process temp file still keeps every write atomic
+    fcntl = None
+
+def read_state(path: str) -> Dict[str, Any]:
+    """
+    Reads a JSON state file.
+
+    Args:
+        path: The path to the file.
+
+    Returns:
+        The stored object, or an empty dict if the file is missing or unreadable.
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable state file '{path}': {e}")
+        return {}
+
+def update_state(path: str, changes: Dict[str, Optional[Any]]):
+    """
+    Applies changes to a JSON state file that several processes may share.
+
+    The file is re-read under an exclusive lock and only the given entries are
+    replaced, so the entries other processes wrote in the meantime are kept.
+    The result is written to a temp file private to this process and thread
+    and then renamed over the original.
+
+    Args:
+        path: The path to the file.
+        changes: The entries to set, by key; a value of None removes the entry.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(f"{path}.lock", "a") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        state = read_state(path)
+        for key, value in changes.items():
+            if value is None:
+                state.pop(key, None)
+            else:
+                state[key] = value
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2, ensure_ascii=False)
+        os.replace(temp_path, path)
+        # Closing the lock file also releases the flock
@@ -0,0 +1,139 @@
+import time
+import logging
+from typing import Callable, Optional
+from .scheduler import CallScheduler
+from . import metrics
+
+class LineLogger:
+    """
+    Logs streamed text line by line as it arrives, so long completions show up
+    in the log while they are still being generated.
+    """
+    def __init__(self, label: str):
+        """
+        Initializes the logger.
+
+        Args:
+            label: The prefix of every logged line, e.g. "Style description".
+        """
+        self.label = label
+        self.buffer = ""
+
+    def write(self, text: str):
+        self.buffer += text
+        *lines, self.buffer = self.buffer.split("\n")
+        for line in lines:
+            if line.strip():
+                logging.info(f"{self.label}: {line}")
+
+    def flush(self):
+        if self.buffer.strip():
+            logging.info(f"{self.label}: {self.buffer}")
+        self.buffer = ""
+
+class _StreamState:
+    """Collects the deltas of one streamed completion attempt."""
+    def __init__(self, log_label: Optional[str], on_text: Optional[Callable[[str], None]]):
+        self.started_at = time.perf_counter()
+        self.first_token_seconds = None
+        self.parts = []
+        self.usage = None
+        self.line_logger = LineLogger(log_label) if log_label else None
+        self.on_text = on_text
+
+    def add(self, chunk):
+        if getattr(chunk, "usage", None):
+            self.usage = chunk.usage
+        for choice in chunk.choices:
+            text = choice.delta.content
+            if not text:
+                continue
+            if self.first_token_seconds is None:
+                self.first_token_seconds = time.perf_counter() - self.started_at
+            self.parts.append(text)
+            if self.line_logger:
+                self.line_logger.write(text)
+            if self.on_text:
+                self.on_text(text)
+
+    def finish(self, model: str) -> str:
+        if self.line_logger:
+            self.line_logger.flush()
+        if self.first_token_seconds is not None:
+            metrics.record(time_to_first_token_seconds=self.first_token_seconds)
+            logging.info(f"{model}: first token after {self.first_token_seconds:.2f}s, "
+                         f"complete after {time.perf_counter() - self.started_at:.2f}s.")
+        metrics.record_usage(self.usage, model)
+        return "".join(self.parts)
+
+def _stream_request(request: dict) -> dict:
+    # include_usage adds a final chunk with the token counts, which are otherwise missing when streaming
+    return {**request, "stream": True, "stream_options": {"include_usage": True}}
+
+def complete_chat(scheduler: CallScheduler, provider: str, create: Callable, request: dict, stream: bool = True,
+                  log_label: Optional[str] = None, on_text: Optional[Callable[[str], None]] = None) -> str:
+    """
+    Runs a chat completion through the scheduler and returns its text.
+
+    When streaming, tokens are consumed as they arrive: each line is logged
+    under log_label and every delta is passed to on_text, and the time to the
+    first token is recorded. A stream that breaks off is retried as a whole.
+
+    Args:
+        scheduler: The scheduler that paces and retries the call.
+        provider: The provider name ("openai" or "local").
+        create: The client's chat.completions.create function.
+        request: The keyword arguments for create().
+        stream: If False, the completion is requested in one piece.
+        log_label: If set, the streamed text is logged line by line with this prefix.
+        on_text: Called with every streamed text delta (optional).
+
+    Returns:
+        The completion text.
+    """
+    model = request["model"]
+    if not stream:
+        response = scheduler.call(provider, model, create, **request)
+        metrics.record_usage(response.usage, model)
+        return response.choices[0].message.content
+
+    def run() -> _StreamState:
+        state = _StreamState(log_label, on_text)
+        with create(**_stream_request(request)) as chunks:
+            for chunk in chunks:
+                state.add(chunk)
+        return state
+
+    return scheduler.call(provider, model, run).finish(model)
+
+async def complete_chat_async(scheduler: CallScheduler, provider: str, create: Callable, request: dict, stream: bool = True,
+                              log_label: Optional[str] = None, on_text: Optional[Callable[[str], None]] = None) -> str:
+    """
+    Asynchronous version of complete_chat() for the async OpenAI client.
+
+    Args:
+        scheduler: The scheduler that paces and retries the call.
+        provider: The provider name ("openai" or "local").
+        create: The async client's chat.completions.create function.
+        request: The keyword arguments for create().
+        stream: If False, the completion is requested in one piece.
+        log_label: If set, the streamed text is logged line by line with this prefix.
+        on_text: Called with every streamed text delta (optional).
+
+    Returns:
+        The completion text.
+    """
+    model = request["model"]
+    if not stream:
+        response = await scheduler.call_async(provider, model, create, **request)
+        metrics.record_usage(response.usage, model)
+        return response.choices[0].message.content
+
+    async def run() -> _StreamState:
+        state = _StreamState(log_label, on_text)
+        async with await create(**_stream_request(request)) as chunks:
+            async for chunk in chunks:
+                state.add(chunk)
+        return state
+
+    return (await scheduler.call_async(provider, model, run)).finish(model)
@@ -1,7 +1,12 @@
 import os
-import replicate
-import requests
+import asyncio
 from config import VIDEO_ANIMATOR_CONFIG, VIDEO_DIR
+from .downloader import get_downloader
+from .disk_cache import make_key
+from .cpu_pool import hash_file
+from .image_preprocessor import normalize_image
+from .prediction_manager import PredictionError, get_prediction_manager
+from . import metrics
 import logging
 
 class VideoAnimator:
@@ -15,11 +20,82 @@ class VideoAnimator:
         if not api_key:
             raise ValueError("Replicate API key is required.")
         self.config = VIDEO_ANIMATOR_CONFIG
-        self.client = replicate.Client(api_token=api_key)
+        self.predictions = get_prediction_manager(api_key)
+        self.predictions.scheduler.configure("replicate", self.config["model"], self.config.get("rate_limit"))
         os.makedirs(VIDEO_DIR, exist_ok=True)
         logging.info("VideoAnimator initialized.")
 
-    def animate(self, image_path: str, output_name: str, prompt: str) -> str:
+    def _build_input(self, prompt: str, image_file) -> dict:
+        """
+        Prepares the input parameters for the Replicate video model.
+
+        Args:
+            prompt: The text prompt to guide the video generation.
+            image_file: An open binary file handle of the start image.
+
+        Returns:
+            The input dictionary for the Replicate model.
+        """
+        return {
+            "prompt": prompt,
+            "start_image": image_file,
+            "duration": self.config.get('duration', 5),
+            "cfg_scale": self.config.get('cfg_scale', 0.5),
+            "negative_prompt": self.config.get('negative_prompt', "")
+        }
+
+    def _prediction_key(self, image_hash: str, prompt: str) -> str:
+        """
+        Builds the idempotency key that lets a restarted run reattach to a
+        video prediction that is still rendering.
+
+        Args:
+            image_hash: The SHA-256 of the input image to animate.
+            prompt: The text prompt to guide the video generation.
+
+        Returns:
+            The prediction key.
+        """
+        return make_key(self.config['model'], self._build_input(prompt, None), image_hash, self.config.get('preprocess'))
+
+    def _prepare_image(self, image_path: str) -> tuple:
+        """
+        Converts the start image to what the model uses (see VIDEO_ANIMATOR_CONFIG["preprocess"]),
+        once per image.
+
+        Args:
+            image_path: The path to the input image to animate.
+
+        Returns:
+            A tuple (SHA-256 of the original image, path to the file to upload).
+        """
+        image_hash = hash_file(image_path)
+        upload_path = normalize_image(image_path, self.config.get('preprocess'), image_hash)
+        metrics.record(bytes_uploaded=os.path.getsize(upload_path))
+        return image_hash, upload_path
+
+    def download_video(self, video_url: str, output_name: str) -> str:
+        """
+        Downloads a rendered video to the video directory. The download is
+        resumed after connection drops and the file only appears under its
+        final name once it is complete.
+
+        Args:
+            video_url: The URL of the rendered video.
+            output_name: The base name for the output video file (without extension).
+
+        Returns:
+            The full path to the downloaded video file.
+        """
+        with metrics.measure("download"):
+            video_filename = f"{output_name}.mp4"
+            video_path = get_downloader().download(video_url, os.path.join(VIDEO_DIR, video_filename))
+
+        logging.info(f"Video successfully downloaded and saved to '{video_path}'")
+        return video_path
+
+    def animate(self, image_path: str, output_name: str, prompt: str,
+                prediction_id: str = None, on_submit=None) -> str:
         """
         Animates an image using the configured Replicate model.
 
@@ -27,26 +103,29 @@ class VideoAnimator:
             image_path: The path to the input image to animate.
             output_name: The base name for the output video file (without extension).
             prompt: The text prompt to guide the video generation.
+            prediction_id: An earlier prediction to reattach to instead of submitting a new one (optional).
+            on_submit: Called with the prediction ID once it is submitted (optional).
 
         Returns:
             The full path to the generated video file.
         """
+        # The SDKs are only needed once an animation runs, so they are imported here instead of at startup
+        import replicate
+        import requests
         logging.info(f"Starting animation for '{image_path}' with prompt: '{prompt}'")
 
         try:
-            with open(image_path, "rb") as image_file:
-                # Run the model on Replicate
-                output = self.client.run(
+            image_hash, upload_path = self._prepare_image(image_path)
+            with open(upload_path, "rb") as image_file:
+                # Submit the prediction on Replicate and poll until the render finishes
+                output = self.predictions.run(
                     self.config['model'],
-                    input={
-                        "prompt": prompt,
-                        "start_image": image_file,
-                        "duration": self.config.get('duration', 5),
-                        "cfg_scale": self.config.get('cfg_scale', 0.5),
-                        "negative_prompt": self.config.get('negative_prompt', "")
-                    }
+                    input=self._build_input(prompt, image_file),
+                    key=self._prediction_key(image_hash, prompt),
+                    prediction_id=prediction_id,
+                    on_submit=on_submit
                 )
-            
+
             video_url = output
             if not video_url:
                 raise Exception("Replicate API did not return a video URL.")
@@ -54,19 +133,15 @@ class VideoAnimator:
             logging.info(f"Animation generated, video URL: {video_url}")
 
             # Download the video
-            response = requests.get(video_url, stream=True)
-            response.raise_for_status()
-
-            video_filename = f"{output_name}.mp4"
-            video_path = os.path.join(VIDEO_DIR, video_filename)
-
-            with open(video_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-
-            logging.info(f"Video successfully downloaded and saved to '{video_path}'")
-            return video_path
+            return self.download_video(str(video_url), output_name)
 
+        except PredictionError as e:
+            if e.status == "canceled":
+                # Canceled on purpose, e.g. a discarded speculative run
+                logging.info(f"Animation canceled: {e}")
+            else:
+                logging.error(f"Replicate prediction failed during animation: {e}")
+            raise
         except replicate.exceptions.ReplicateError as e:
             logging.error(f"Replicate API error during animation: {e}")
             raise
@@ -75,4 +150,46 @@ class VideoAnimator:
             raise
         except Exception as e:
             logging.error(f"An unexpected error occurred during animation: {e}")
-            raise 
\ No newline at end of file
+            raise
+
+    async def render_video_async(self, image_path: str, prompt: str,
+                                 prediction_id: str = None, on_submit=None) -> str:
+        """
+        Renders a video without downloading it, so the caller can schedule the
+        download separately. Polling does not block the event loop.
+
+        Args:
+            image_path: The path to the input image to animate.
+            prompt: The text prompt to guide the video generation.
+            prediction_id: An earlier prediction to reattach to instead of submitting a new one (optional).
+            on_submit: Called with the prediction ID once it is submitted (optional).
+
+        Returns:
+            The URL of the rendered video.
+        """
+        import replicate
+        logging.info(f"Starting animation for '{image_path}' with prompt: '{prompt}'")
+
+        try:
+            image_hash, upload_path = await asyncio.to_thread(self._prepare_image, image_path)
+            with open(upload_path, "rb") as image_file:
+                output = await self.predictions.run_async(
+                    self.config['model'],
+                    input=self._build_input(prompt, image_file),
+                    key=self._prediction_key(image_hash, prompt),
+                    prediction_id=prediction_id,
+                    on_submit=on_submit
+                )
+
+            if not output:
+                raise Exception("Replicate API did not return a video URL.")
+
+            logging.info(f"Animation generated, video URL: {output}")
+            return str(output)
+
+        except PredictionError as e:
+            logging.error(f"Replicate prediction failed during animation: {e}")
+            raise
+        except replicate.exceptions.ReplicateError as e:
+            logging.error(f"Replicate API error during animation: {e}")
+            raise